@@ -0,0 +1,297 @@
+"""End-to-end load harness.
+
+Drives POST /search followed by the answer websocket at a fixed concurrency
+and reports latency percentiles, time-to-first-token and throughput. By
+default it starts the upstream stand-ins and the API locally, so no real
+Brave, Exa, Notion or OpenAI quota is used:
+
+    python -m benchmarks.load --requests 200 --concurrency 20
+
+Stand-in behaviour is configured with STANDIN_* environment variables (see
+benchmarks/standins.py). Pass --target to load an already running API.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+import redis
+import websockets
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+QUERIES = [
+    "vector database indexing tradeoffs",
+    "reinforcement learning from human feedback",
+    "distributed tracing best practices",
+    "transformer attention optimizations",
+    "retrieval augmented generation evaluation",
+    "rust async runtime internals",
+    "kubernetes autoscaling latency",
+    "python asyncio performance tuning",
+]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+@dataclass
+class Sample:
+    search_seconds: float = 0.0
+    first_token_seconds: Optional[float] = None
+    stream_seconds: float = 0.0
+    total_seconds: float = 0.0
+    answer_chars: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class LoadReport:
+    concurrency: int
+    wall_seconds: float
+    samples: List[Sample] = field(default_factory=list)
+
+    def summary(self) -> Dict[str, object]:
+        ok = [sample for sample in self.samples if sample.error is None]
+
+        def distribution(values: List[float]) -> Dict[str, Optional[float]]:
+            return {f"p{pct}": _ms(percentile(values, pct)) for pct in (50, 95, 99)}
+
+        stream_rates = [
+            sample.answer_chars / sample.stream_seconds for sample in ok if sample.stream_seconds > 0
+        ]
+        errors: Dict[str, int] = {}
+        for sample in self.samples:
+            if sample.error:
+                errors[sample.error] = errors.get(sample.error, 0) + 1
+
+        return {
+            "requests": len(self.samples),
+            "succeeded": len(ok),
+            "errors": errors,
+            "concurrency": self.concurrency,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "throughput_rps": round(len(ok) / self.wall_seconds, 3) if self.wall_seconds else 0.0,
+            "search_ms": distribution([sample.search_seconds for sample in ok]),
+            "time_to_first_token_ms": distribution(
+                [sample.first_token_seconds for sample in ok if sample.first_token_seconds is not None]
+            ),
+            "stream_ms": distribution([sample.stream_seconds for sample in ok]),
+            "end_to_end_ms": distribution([sample.total_seconds for sample in ok]),
+            "answer_chars_per_second_p50": round(percentile(stream_rates, 50) or 0.0, 1)
+        }
+
+    def render(self) -> str:
+        summary = self.summary()
+        lines = [
+            f"requests {summary['requests']}  ok {summary['succeeded']}  concurrency {summary['concurrency']}  "
+            f"wall {summary['wall_seconds']}s  throughput {summary['throughput_rps']} req/s",
+            f"{'':<24}{'p50':>10}{'p95':>10}{'p99':>10}"
+        ]
+        for key, label in (("search_ms", "POST /search"), ("time_to_first_token_ms", "time to first token"),
+                           ("stream_ms", "answer stream"), ("end_to_end_ms", "end to end")):
+            row = summary[key]
+            lines.append(f"{label:<24}" + "".join(
+                f"{'-' if row[p] is None else row[p]:>10}" for p in ("p50", "p95", "p99")
+            ))
+        lines.append(f"answer chars/s (p50)    {summary['answer_chars_per_second_p50']}")
+        if summary["errors"]:
+            lines.append(f"errors {summary['errors']}")
+        return "\n".join(lines)
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+async def run_one(client: httpx.AsyncClient, ws_base: str, query: str, protocol: int) -> Sample:
+    """One search followed by its streamed answer"""
+    sample = Sample()
+    started_at = time.perf_counter()
+    try:
+        response = await client.post("/search", json={"query": query})
+        sample.search_seconds = time.perf_counter() - started_at
+        if response.status_code != 200:
+            sample.error = f"search_http_{response.status_code}"
+            return sample
+        data = response.json()
+
+        stream_started_at = time.perf_counter()
+        url = f"{ws_base}/ws/stream/{data['thread_id']}/{data['message_id']}?protocol={protocol}"
+        async with websockets.connect(url, max_size=None) as websocket:
+            async for raw in websocket:
+                frame = json.loads(raw)
+                delta = frame.get("delta", "") if protocol == 2 else frame.get("content", "")
+                if delta and sample.first_token_seconds is None:
+                    sample.first_token_seconds = time.perf_counter() - stream_started_at
+                sample.answer_chars += len(delta)
+                if frame.get("error"):
+                    sample.error = "stream_error"
+                if frame.get("finished"):
+                    break
+        sample.stream_seconds = time.perf_counter() - stream_started_at
+    except Exception as e:
+        sample.error = type(e).__name__
+    sample.total_seconds = time.perf_counter() - started_at
+    return sample
+
+
+async def run_load(base_url: str, requests: int, concurrency: int, protocol: int = 2,
+                   distinct_queries: int = 0) -> LoadReport:
+    """Issue `requests` search+stream round trips from `concurrency` workers.
+
+    With `distinct_queries` > 0 queries repeat after that many, exercising the
+    caches; by default every query is unique.
+    """
+    ws_base = base_url.replace("http://", "ws://").replace("https://", "wss://")
+    samples: List[Sample] = []
+    next_index = iter(range(requests))
+
+    def query_for(index: int) -> str:
+        slot = index % distinct_queries if distinct_queries else index
+        return f"{QUERIES[slot % len(QUERIES)]} {slot}"
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+        async def worker():
+            for index in next_index:
+                samples.append(await run_one(client, ws_base, query_for(index), protocol))
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall_seconds = time.perf_counter() - started_at
+
+    return LoadReport(concurrency=concurrency, wall_seconds=wall_seconds, samples=samples)
+
+
+def _wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+def _serve(app: str, port: int, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env
+    )
+
+
+# The stand-ins have no quota, so the OpenAI governor's budgets are lifted unless
+# set explicitly; otherwise the run measures the governor's queue, not the service
+LLM_BUDGET_DEFAULTS = {"OPENAI_RPM_LIMIT": "0", "OPENAI_TPM_LIMIT": "0"}
+
+
+@contextmanager
+def local_stack(standin_port: int, app_port: int, redis_url: Optional[str] = None) -> Iterator[str]:
+    """Start the upstream stand-ins and the API wired to them; yields the API's base URL.
+
+    The API uses in-memory storage unless `redis_url` names a Redis database
+    for the harness, which is flushed first. It never inherits REDIS_URL, so
+    a developer's Redis (Notion tokens, search cache) is left alone.
+    """
+    standins_url = f"http://127.0.0.1:{standin_port}"
+    if redis_url:
+        redis.Redis.from_url(redis_url).flushdb()
+    env = {
+        **LLM_BUDGET_DEFAULTS,
+        **os.environ,
+        "REDIS_URL": redis_url or "memory://",
+        "BRAVE_API_KEY": "standin",
+        "EXA_API_KEY": "standin",
+        "OPENAI_API_KEY": "standin",
+        "NOTION_CLIENT_ID": "standin",
+        "NOTION_CLIENT_SECRET": "standin",
+        "BRAVE_BASE_URL": f"{standins_url}/brave/res/v1",
+        "EXA_BASE_URL": f"{standins_url}/exa",
+        "NOTION_BASE_URL": f"{standins_url}/notion/v1",
+        "OPENAI_BASE_URL": f"{standins_url}/openai/v1",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING")
+    }
+    print("LLM governor: " + "  ".join(
+        f"{name}={env.get(name, '(default)')}"
+        for name in ("OPENAI_RPM_LIMIT", "OPENAI_TPM_LIMIT", "OPENAI_MAX_CONCURRENCY")
+    ), file=sys.stderr)
+    processes = []
+    try:
+        processes.append(_serve("benchmarks.standins:app", standin_port, env))
+        _wait_until_ready(f"{standins_url}/stats", processes[-1])
+        processes.append(_serve("main:app", app_port, env))
+        _wait_until_ready(f"http://127.0.0.1:{app_port}/health", processes[-1])
+        yield f"http://127.0.0.1:{app_port}"
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def connect_notion(base_url: str):
+    """Complete the OAuth flow against the Notion stand-in so searches use a corpus"""
+    response = httpx.post(f"{base_url}/notion/oauth/callback",
+                          params={"code": "standin", "state": "standin:default_user"}, timeout=30.0)
+    response.raise_for_status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /search and the answer stream")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--protocol", type=int, choices=(1, 2), default=2, help="websocket stream protocol")
+    parser.add_argument("--distinct-queries", type=int, default=0,
+                        help="repeat queries after this many (0: every query is unique)")
+    parser.add_argument("--target", help="base URL of a running API; skips starting the local stack")
+    parser.add_argument("--standin-port", type=int, default=8901)
+    parser.add_argument("--app-port", type=int, default=8900)
+    parser.add_argument("--no-notion", action="store_true", help="do not connect the Notion stand-in")
+    parser.add_argument("--redis-url", help="Redis database for the local stack, FLUSHED at start "
+                                            "(default: in-memory storage)")
+    parser.add_argument("--json", dest="json_path", help="also write the summary as JSON to this path")
+    args = parser.parse_args()
+
+    def run(base_url: str) -> LoadReport:
+        return asyncio.run(run_load(base_url, args.requests, args.concurrency, args.protocol,
+                                    args.distinct_queries))
+
+    if args.target:
+        report = run(args.target.rstrip("/"))
+    else:
+        with local_stack(args.standin_port, args.app_port, args.redis_url) as base_url:
+            if not args.no_notion:
+                connect_notion(base_url)
+            report = run(base_url)
+
+    print(report.render())
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report.summary(), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
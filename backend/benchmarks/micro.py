@@ -0,0 +1,284 @@
+"""Microbenchmarks for CPU hot paths that scale with data size.
+
+Each benchmark runs on synthetic fixtures at several sizes and reports the
+best per-call time over several repeats. Results are compared against a
+baseline and any benchmark slower than the baseline by more than the
+threshold (and the noise floor) is re-measured; if it is still slower it is
+reported as a regression (exit code 1):
+
+    git stash && python -m benchmarks.micro --save-baseline && git stash pop
+    python -m benchmarks.micro                    # compare with the baseline
+    python -m benchmarks.micro --filter storage   # only matching benchmarks
+
+Baselines are machine specific and not checked in: record one on the base
+revision on the machine that compares. A baseline from another host is
+reported against but never fails the run.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from models.schemas import Message, SearchResult, Thread  # noqa: E402
+from services.llm_service import LLMService  # noqa: E402
+from services.notion_service import NotionService  # noqa: E402
+from services.passage_index import PassageIndex  # noqa: E402
+from services.storage_service import StorageService  # noqa: E402
+
+SIZES = (10, 100, 1000)
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+VOCABULARY = (
+    "latency throughput cache vector retrieval embedding agent model token stream benchmark "
+    "research notion search index query ranking fusion context budget learning reinforcement "
+    "transformer attention distributed system memory graph python redis websocket prompt"
+).split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words)) + "."
+
+
+def make_sources(rng: random.Random, count: int) -> List[SearchResult]:
+    return [
+        SearchResult(
+            title=_text(rng, 6),
+            url=f"https://example.com/{i}",
+            content=_text(rng, 150),
+            snippet=_text(rng, 30),
+            source="notion" if i % 4 == 0 else "web",
+            favicon_url=f"https://example.com/{i}/favicon.ico"
+        )
+        for i in range(count)
+    ]
+
+
+def make_thread(rng: random.Random, messages: int) -> Thread:
+    started = datetime(2025, 1, 1)
+    return Thread(
+        id="thread-benchmark",
+        title=_text(rng, 8),
+        created_at=started,
+        updated_at=started + timedelta(minutes=messages),
+        messages=[
+            Message(
+                id=f"message-{i}",
+                content=_text(rng, 40 if i % 2 == 0 else 250),
+                role="user" if i % 2 == 0 else "assistant",
+                timestamp=started + timedelta(minutes=i),
+                sources=None if i % 2 == 0 else make_sources(rng, 5)
+            )
+            for i in range(messages)
+        ]
+    )
+
+
+def make_blocks(rng: random.Random, count: int) -> List[Dict[str, Any]]:
+    block_types = ("paragraph", "heading_2", "bulleted_list_item", "to_do", "child_page")
+    blocks = []
+    for i in range(count):
+        block_type = block_types[i % len(block_types)]
+        if block_type == "child_page":
+            blocks.append({"type": block_type, block_type: {"title": _text(rng, 4)}})
+        else:
+            blocks.append({"type": block_type, block_type: {"rich_text": [
+                {"text": {"content": _text(rng, 30)}, "plain_text": ""} for _ in range(2)
+            ]}})
+    return blocks
+
+
+def make_pages(rng: random.Random, count: int) -> List[Dict[str, Any]]:
+    return [
+        {"id": f"page-{i}", "title": _text(rng, 5), "text": _text(rng, 400), "last_edited_time": str(i)}
+        for i in range(count)
+    ]
+
+
+def build_index(pages: List[Dict[str, Any]]) -> PassageIndex:
+    index = PassageIndex()
+    for page in pages:
+        index.add_document(page["id"], page["title"], page["text"], version=page["last_edited_time"])
+    return index
+
+
+def benchmarks() -> Dict[str, Callable[[int], Callable[[], Any]]]:
+    """Benchmark name -> setup(size) returning the callable to time"""
+    storage = StorageService()
+    llm = LLMService()
+    notion = NotionService()
+
+    def serialize_thread(size):
+        thread = make_thread(random.Random(size), size)
+        return lambda: storage._serialize_thread(thread)
+
+    def deserialize_thread(size):
+        data = storage._serialize_thread(make_thread(random.Random(size), size))
+        return lambda: storage._deserialize_thread(data)
+
+    def deserialize_message_log(size):
+        rows = [storage._serialize_message(msg) for msg in make_thread(random.Random(size), size).messages]
+        return lambda: [storage._deserialize_message(row) for row in rows]
+
+    def context_prompt(size):
+        sources = make_sources(random.Random(size), size)
+        return lambda: llm.create_context_prompt("how do vector caches affect retrieval latency", sources)
+
+    def extract_text(size):
+        blocks = make_blocks(random.Random(size), size)
+        return lambda: notion.extract_text_from_blocks(blocks)
+
+    def passage_index_build(size):
+        pages = make_pages(random.Random(size), size)
+        return lambda: build_index(pages)
+
+    def passage_index_search(size):
+        index = build_index(make_pages(random.Random(size), size))
+        return lambda: index.search("vector retrieval latency cache", k=8)
+
+    return {
+        "storage.serialize_thread": serialize_thread,
+        "storage.deserialize_thread": deserialize_thread,
+        "storage.deserialize_message_log": deserialize_message_log,
+        "llm.create_context_prompt": context_prompt,
+        "notion.extract_text_from_blocks": extract_text,
+        "notion.passage_index_build": passage_index_build,
+        "notion.passage_index_search": passage_index_search,
+    }
+
+
+def time_call(fn: Callable[[], Any], repeat: int = 9) -> float:
+    """Best per-call time in seconds over `repeat` runs of at least 0.2s each"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(name_filter: str = "", sizes: Tuple[int, ...] = SIZES, repeat: int = 9,
+        only: Optional[Set[str]] = None) -> Dict[str, float]:
+    results = {}
+    for name, setup in benchmarks().items():
+        if name_filter not in name:
+            continue
+        for size in sizes:
+            key = f"{name}[{size}]"
+            if only is not None and key not in only:
+                continue
+            results[key] = time_call(setup(size), repeat=repeat)
+            print(f"  {key:<45} {_format_seconds(results[key]):>12}", file=sys.stderr)
+    return results
+
+
+def host_info() -> Dict[str, Any]:
+    """Identifies the machine a baseline was recorded on"""
+    return {
+        "node": platform.node(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version()
+    }
+
+
+def is_regression(seconds: float, base: Optional[float], threshold: float, noise_floor: float) -> bool:
+    return bool(base) and seconds > base * (1 + threshold) and seconds - base > noise_floor
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float,
+            noise_floor: float = 0.0) -> List[Dict[str, Any]]:
+    """One row per benchmark with its ratio to the baseline and whether it regressed"""
+    rows = []
+    for key, seconds in results.items():
+        base = baseline.get(key)
+        ratio = seconds / base if base else None
+        rows.append({
+            "benchmark": key,
+            "seconds": seconds,
+            "baseline": base,
+            "ratio": ratio,
+            "regressed": is_regression(seconds, base, threshold, noise_floor)
+        })
+    return rows
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} µs"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for CPU hot paths")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="slowdown ratio past the baseline reported as a regression (0.2 = 20%%)")
+    parser.add_argument("--noise-floor", type=float, default=5.0,
+                        help="slowdowns smaller than this many microseconds are never regressions")
+    parser.add_argument("--confirm", type=int, default=2,
+                        help="times a suspected regression is re-measured before it is reported")
+    parser.add_argument("--repeat", type=int, default=9)
+    args = parser.parse_args()
+
+    results = run(args.filter, repeat=args.repeat)
+
+    if args.save_baseline:
+        existing = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+        if existing.get("host") != host_info():
+            existing = {}
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "host": host_info(),
+                "results": {**existing.get("results", {}), **results}
+            }, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; record one on the base revision with --save-baseline")
+        return
+    stored = json.loads(args.baseline.read_text())
+    baseline = stored.get("results", {})
+    noise_floor = args.noise_floor / 1e6
+
+    # Timing noise only ever adds time, so keep the best of every measurement
+    for _ in range(args.confirm):
+        suspects = {key for key, seconds in results.items()
+                    if is_regression(seconds, baseline.get(key), args.threshold, noise_floor)}
+        if not suspects:
+            break
+        print(f"Re-measuring {len(suspects)} suspected regression(s)", file=sys.stderr)
+        for key, seconds in run(args.filter, repeat=args.repeat, only=suspects).items():
+            results[key] = min(results[key], seconds)
+
+    rows = compare(results, baseline, args.threshold, noise_floor)
+    print(f"{'benchmark':<45}{'current':>12}{'baseline':>12}{'ratio':>8}")
+    for row in rows:
+        base = _format_seconds(row["baseline"]) if row["baseline"] else "-"
+        ratio = f"{row['ratio']:.2f}" if row["ratio"] is not None else "-"
+        flag = "  REGRESSION" if row["regressed"] else ""
+        print(f"{row['benchmark']:<45}{_format_seconds(row['seconds']):>12}{base:>12}{ratio:>8}{flag}")
+
+    regressions = [row for row in rows if row["regressed"]]
+    if stored.get("host") != host_info():
+        print(f"{args.baseline} was recorded on another host ({stored.get('host')}); "
+              "not failing. Record a baseline here with --save-baseline")
+        return
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed more than {args.threshold:.0%} against {args.baseline}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
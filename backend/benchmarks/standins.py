@@ -0,0 +1,244 @@
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+import uuid
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Local stand-ins for the Brave, Exa, Notion and OpenAI APIs. Each upstream is
+# mounted under its own prefix; point the service at them with
+#   BRAVE_BASE_URL=http://host:port/brave/res/v1
+#   EXA_BASE_URL=http://host:port/exa
+#   NOTION_BASE_URL=http://host:port/notion/v1
+#   OPENAI_BASE_URL=http://host:port/openai/v1
+
+WORDS = (
+    "latency throughput cache vector retrieval embedding agent model token stream "
+    "benchmark research notion search index query ranking fusion context budget "
+    "learning reinforcement transformer attention distributed system memory graph"
+).split()
+
+ORIGINAL_QUERY = re.compile(r'ORIGINAL QUERY: "(.*)"')
+
+DEFAULT_PROFILES = {
+    "brave": {"latency_ms": 300, "jitter": 0.3, "error_rate": 0.0},
+    "exa": {"latency_ms": 600, "jitter": 0.3, "error_rate": 0.0},
+    "notion": {"latency_ms": 150, "jitter": 0.3, "error_rate": 0.0},
+    "openai": {"latency_ms": 500, "jitter": 0.3, "error_rate": 0.0},
+}
+
+
+@dataclass
+class UpstreamProfile:
+    """Response behaviour of one stand-in.
+
+    Latencies are log-normal around `latency_ms` (the median) with shape
+    `jitter`; `error_rate` is the share of requests answered with a 500.
+    For OpenAI, `latency_ms` is the time to the first token of a streamed
+    answer, after which tokens arrive at `tokens_per_second`.
+    """
+    latency_ms: float
+    jitter: float = 0.3
+    error_rate: float = 0.0
+    tokens_per_second: float = 40.0
+    answer_tokens: int = 200
+
+    @classmethod
+    def from_env(cls, name: str) -> "UpstreamProfile":
+        defaults = DEFAULT_PROFILES[name]
+        prefix = f"STANDIN_{name.upper()}_"
+        return cls(
+            latency_ms=float(os.getenv(prefix + "LATENCY_MS", defaults["latency_ms"])),
+            jitter=float(os.getenv(prefix + "JITTER", defaults["jitter"])),
+            error_rate=float(os.getenv(prefix + "ERROR_RATE", defaults["error_rate"])),
+            tokens_per_second=float(os.getenv(prefix + "TOKENS_PER_SECOND", "40")),
+            answer_tokens=int(os.getenv(prefix + "ANSWER_TOKENS", "200"))
+        )
+
+    def delay(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.latency_ms / 1000), self.jitter)
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate
+
+
+def _words(seed: str, count: int) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def _error(upstream: str) -> JSONResponse:
+    return JSONResponse({"error": f"{upstream} stand-in injected failure"}, status_code=500)
+
+
+def create_app(profiles: Optional[Dict[str, UpstreamProfile]] = None, notion_pages: Optional[int] = None) -> FastAPI:
+    profiles = profiles or {name: UpstreamProfile.from_env(name) for name in DEFAULT_PROFILES}
+    notion_pages = notion_pages if notion_pages is not None else int(os.getenv("STANDIN_NOTION_PAGES", "20"))
+    app = FastAPI(title="Upstream stand-ins")
+    stats: Dict[str, int] = {}
+
+    async def respond(upstream: str) -> Optional[JSONResponse]:
+        """Count the request and wait out its latency; returns an error response to inject one"""
+        stats[upstream] = stats.get(upstream, 0) + 1
+        profile = profiles[upstream]
+        await asyncio.sleep(profile.delay())
+        return _error(upstream) if profile.fails() else None
+
+    @app.get("/stats")
+    async def request_stats():
+        return stats
+
+    @app.get("/brave/res/v1/web/search")
+    async def brave_search(q: str, count: int = 10):
+        error = await respond("brave")
+        if error:
+            return error
+        return {"web": {"results": [
+            {
+                "title": f"{q} - result {i}",
+                "url": f"https://brave.example/{zlib.crc32(q.encode()) % 10_000}/{i}",
+                "description": _words(f"brave:{q}:{i}", 60)
+            }
+            for i in range(count)
+        ]}}
+
+    @app.post("/exa/search")
+    async def exa_search(request: Request):
+        payload = await request.json()
+        error = await respond("exa")
+        if error:
+            return error
+        query = payload.get("query", "")
+        return {"results": [
+            {
+                "title": f"{query} - exa {i}",
+                "url": f"https://exa.example/{zlib.crc32(query.encode()) % 10_000}/{i}",
+                "text": _words(f"exa:{query}:{i}", 120)
+            }
+            for i in range(payload.get("numResults", 10))
+        ]}
+
+    @app.post("/notion/v1/oauth/token")
+    async def notion_token():
+        error = await respond("notion")
+        if error:
+            return error
+        return {
+            "access_token": f"standin-{uuid.uuid4().hex}",
+            "token_type": "bearer",
+            "workspace_name": "Benchmark workspace",
+            "workspace_id": "standin-workspace"
+        }
+
+    @app.get("/notion/v1/users/me")
+    async def notion_user():
+        error = await respond("notion")
+        if error:
+            return error
+        return {"object": "user", "id": "standin-user", "name": "Benchmark User"}
+
+    @app.post("/notion/v1/search")
+    async def notion_search(request: Request):
+        payload = await request.json()
+        error = await respond("notion")
+        if error:
+            return error
+        pages = [
+            {
+                "object": "page",
+                "id": f"page-{i}",
+                "url": f"https://notion.so/page-{i}",
+                "last_edited_time": "2025-01-01T00:00:00.000Z",
+                "properties": {"title": {"type": "title", "title": [{"plain_text": _words(f"title:{i}", 4)}]}}
+            }
+            for i in range(notion_pages)
+        ]
+        return {"object": "list", "results": pages[:payload.get("page_size", 100)], "has_more": False}
+
+    @app.get("/notion/v1/blocks/{page_id}/children")
+    async def notion_blocks(page_id: str):
+        error = await respond("notion")
+        if error:
+            return error
+        return {"object": "list", "results": [
+            {
+                "type": "paragraph",
+                "paragraph": {"rich_text": [{"text": {"content": _words(f"{page_id}:{i}", 80)}}]}
+            }
+            for i in range(5)
+        ]}
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        if payload.get("stream"):
+            return StreamingResponse(stream_answer(payload), media_type="text/event-stream")
+
+        error = await respond("openai")
+        if error:
+            return error
+        system, prompt = payload["messages"][0]["content"], payload["messages"][-1]["content"]
+        if "search queries" in system:
+            match = ORIGINAL_QUERY.search(prompt)
+            query = match.group(1) if match else ""
+            content = json.dumps([f"{query} {_words(f'{query}:{i}', 2)}" for i in range(3)])
+        else:
+            content = json.dumps({
+                "interests": WORDS[:4],
+                "expertise_areas": WORDS[4:6],
+                "research_focus": WORDS[6:8],
+                "keywords": WORDS[8:14],
+                "context_summary": _words("summary", 20),
+                "summary": _words("summary", 20)
+            })
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "gpt-4"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        }
+
+    async def stream_answer(payload: Dict[str, Any]):
+        profile = profiles["openai"]
+        stats["openai"] = stats.get("openai", 0) + 1
+        await asyncio.sleep(profile.delay())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+            return "data: " + json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "gpt-4"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }) + "\n\n"
+
+        if profile.fails():
+            yield 'data: {"error": {"message": "openai stand-in injected failure"}}\n\n'
+            return
+
+        interval = 1 / profile.tokens_per_second if profile.tokens_per_second > 0 else 0
+        yield chunk({"role": "assistant", "content": ""})
+        for i, word in enumerate(_words(completion_id, profile.answer_tokens).split()):
+            if i:
+                await asyncio.sleep(interval)
+            yield chunk({"content": (" " if i else "") + word})
+        yield chunk({}, "stop")
+        yield "data: [DONE]\n\n"
+
+    return app
+
+
+app = create_app()
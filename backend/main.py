@@ -1,24 +1,65 @@
 import asyncio
+import logging
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Query, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import json
 import os
+from typing import Optional
 from dotenv import load_dotenv
 
 from models.schemas import SearchQuery, Thread, Message, StreamingResponse as StreamingResponseModel
 from services.search_service import SearchService
+from services.context_packer import load_encoding
 from services.llm_service import LLMService
 from services.storage_service import StorageService
+from services.http_client import http_pool
+from services.llm_scheduler import llm_scheduler
+from services.metrics import CACHE_REQUESTS, StreamTimer, metrics
+from services.stream_protocol import DeltaStream, PROTOCOL_DELTA, response_digest, sse_event
+from services.tracing import span, tracer
+from services.upstream_health import upstream_health
 
 from services.notion_service import NotionService
+from services.notion_index import NotionIndex
+from services.notion_sync_worker import NotionSyncWorker
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="Perplexity Clone API", version="1.0.0")
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+# httpx logs every request at INFO; keep upstream calls off the log unless they go wrong
+for noisy_logger in ("httpx", "httpcore"):
+    logging.getLogger(noisy_logger).setLevel(logging.WARNING)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared upstream HTTP clients and the Redis pool live for the whole application
+    await http_pool.start()
+    await storage_service.connect()
+    # Move threads stored as whole JSON blobs to the append-only message log
+    migration = asyncio.create_task(storage_service.migrate_legacy_threads())
+    # Load the tokenizer off the event loop so the first token count never blocks on its download
+    encoding_load = asyncio.create_task(load_encoding())
+    # Keep connected users' Notion corpora warm unless a separate worker process does it
+    if os.getenv("NOTION_SYNC_WORKER", "app") == "app":
+        notion_sync_worker.start()
+    yield
+    await notion_sync_worker.stop()
+    migration.cancel()
+    encoding_load.cancel()
+    await storage_service.close()
+    await http_pool.close()
+
+app = FastAPI(title="Perplexity Clone API", version="1.0.0", lifespan=lifespan)
 
 # Configure CORS origins
 allowed_origins = [
@@ -47,14 +88,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Trace-Id"],
 )
 
 # Initialize services
-search_service = SearchService()
-llm_service = LLMService()
 storage_service = StorageService()
+search_service = SearchService(storage_service)
+llm_service = LLMService()
 
 notion_service = NotionService()
+notion_index = NotionIndex(notion_service, storage_service)
+notion_sync_worker = NotionSyncWorker(notion_index, storage_service)
 
 @app.get("/")
 async def root():
@@ -62,11 +106,89 @@ async def root():
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy"}
+    return {"status": "healthy", "storage": storage_service.backend_info()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Search stage, streaming, cache and upstream error metrics in Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/http-pool")
+async def http_pool_stats():
+    """Connection pool statistics for the shared upstream HTTP clients"""
+    return http_pool.stats()
+
+@app.get("/debug/search/latency")
+async def search_latency():
+    """Per-provider search latency histograms and the current hedge delay"""
+    return search_service.provider_latency()
+
+@app.get("/debug/search/cache")
+async def search_cache_stats():
+    """Hit/miss statistics for the web search result cache"""
+    return search_service.cache_stats()
+
+@app.get("/debug/llm-scheduler")
+async def llm_scheduler_stats():
+    """OpenAI call budgets, queue depth per priority and queue wait times"""
+    return llm_scheduler.stats()
+
+@app.get("/debug/upstreams")
+async def upstream_status():
+    """Circuit breaker state, adaptive timeout and call counts per upstream"""
+    return upstream_health.snapshot()
+
+@app.get("/debug/notion-sync")
+async def notion_sync_stats():
+    """Background Notion sync worker activity"""
+    return notion_sync_worker.stats()
+
+@app.get("/debug/traces")
+async def recent_traces(limit: int = 50):
+    """Most recent request traces, newest first"""
+    return {"traces": tracer.recent(limit)}
+
+@app.get("/debug/traces/{trace_id}")
+async def trace_waterfall(trace_id: str, format: str = "json"):
+    """Latency waterfall of one request; `format=text` renders it as an ASCII chart"""
+    if format == "text":
+        text = tracer.render_text(trace_id)
+        if text is None:
+            raise HTTPException(status_code=404, detail="Trace not found")
+        return PlainTextResponse(text)
+    waterfall = tracer.waterfall(trace_id)
+    if waterfall is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return waterfall
+
+def build_source_groups(results: list) -> dict:
+    """Group sources into personal (Notion) and web results for display"""
+    notion_results = [r for r in results if r.source == "notion"]
+    web_results = [r for r in results if r.source != "notion"]
+    return {
+        "notion": {
+            "title": "📄 Your Personal Knowledge",
+            "description": "From your Notion pages",
+            "results": [result.model_dump() for result in notion_results],
+            "count": len(notion_results)
+        },
+        "web": {
+            "title": "🌐 Web Research",
+            "description": "Personalized search results",
+            "results": [result.model_dump() for result in web_results],
+            "count": len(web_results)
+        }
+    }
 
 @app.post("/search")
-async def search_endpoint(query: SearchQuery):
+async def search_endpoint(query: SearchQuery, response: Response):
     """Search endpoint that returns results and generates response"""
+    with tracer.trace("POST /search", query=query.query) as trace:
+        if trace:
+            response.headers["X-Trace-Id"] = trace.trace_id
+        return await _search(query)
+
+async def _search(query: SearchQuery):
     try:
         # Create or get thread
         thread_id = query.thread_id
@@ -94,14 +216,15 @@ async def search_endpoint(query: SearchQuery):
             count=10, 
             notion_service=notion_service, 
             storage_service=storage_service, 
-            user_id=user_id
+            user_id=user_id,
+            notion_index=notion_index
         )
         
         all_results = search_response["results"]
         search_strategy = search_response.get("search_strategy", {})
         
-        print(f"DEBUG: Personalized search strategy: {search_strategy.get('personal_analysis', {})}")
-        print(f"DEBUG: Generated queries: {search_strategy.get('personalized_queries', [])}")
+        logger.debug("Personalized search strategy: %s", search_strategy.get('personal_analysis', {}))
+        logger.debug("Generated queries: %s", search_strategy.get('personalized_queries', []))
         
         # Create assistant message
         assistant_message = Message(
@@ -112,6 +235,10 @@ async def search_endpoint(query: SearchQuery):
             sources=all_results
         )
         
+        # Hand the sources to the websocket stream so it answers from exactly
+        # these results instead of searching again
+        await storage_service.store_search_handoff(assistant_message.id, thread_id, all_results)
+        
         # Count Notion vs web results
         notion_results = [r for r in all_results if r.source == "notion"]
         web_results = [r for r in all_results if r.source != "notion"]
@@ -120,20 +247,7 @@ async def search_endpoint(query: SearchQuery):
             "thread_id": thread_id,
             "message_id": assistant_message.id,
             "sources": [result.model_dump() for result in all_results],
-            "source_groups": {
-                "notion": {
-                    "title": "📄 Your Personal Knowledge",
-                    "description": "From your Notion pages",
-                    "results": [result.model_dump() for result in notion_results],
-                    "count": len(notion_results)
-                },
-                "web": {
-                    "title": "🌐 Web Research",
-                    "description": "Personalized search results",
-                    "results": [result.model_dump() for result in web_results],
-                    "count": len(web_results)
-                }
-            },
+            "source_groups": build_source_groups(all_results),
             "user_message_id": user_message.id,
             "notion_results_count": len(notion_results),
             "web_results_count": len(web_results),
@@ -155,7 +269,8 @@ async def test_search_structure(query: str = "AI research updates"):
             count=6, 
             notion_service=notion_service, 
             storage_service=storage_service, 
-            user_id=user_id
+            user_id=user_id,
+            notion_index=notion_index
         )
         
         all_results = search_response["results"]
@@ -186,15 +301,125 @@ async def test_search_structure(query: str = "AI research updates"):
     except Exception as e:
         return {"error": str(e)}
 
+@app.get("/search/stream")
+async def search_stream(query: str, thread_id: Optional[str] = None):
+    """Search and answer over one Server-Sent Events connection.
+    
+    Events are sent as each stage completes: "thread", "notion", "strategy",
+    one "web" per personalized query, "sources" (the final source list),
+    "token" for each answer chunk and "done" with the answer's length and
+    checksum. Failures end the stream with a "failed" event.
+    """
+    async def events():
+        with tracer.trace("GET /search/stream", query=query) as trace:
+            async for event in traced_events(trace.trace_id if trace else None):
+                yield event
+    
+    async def traced_events(trace_id: Optional[str]):
+        stream_timer = StreamTimer("sse")
+        try:
+            nonlocal thread_id
+            if not thread_id:
+                title = query[:50] + ("..." if len(query) > 50 else "")
+                thread_id = await storage_service.create_thread(title)
+            
+            user_message = Message(
+                id=str(uuid.uuid4()),
+                content=query,
+                role="user",
+                timestamp=datetime.now(),
+                sources=None
+            )
+            await storage_service.add_message_to_thread(thread_id, user_message)
+            message_id = str(uuid.uuid4())
+            yield sse_event("thread", {
+                "thread_id": thread_id,
+                "message_id": message_id,
+                "user_message_id": user_message.id,
+                "trace_id": trace_id
+            })
+            
+            search_response = {}
+            async for event, data in search_service.stream_personal_content(
+                query,
+                count=10,
+                notion_service=notion_service,
+                storage_service=storage_service,
+                user_id="default_user",
+                notion_index=notion_index
+            ):
+                if event == "notion":
+                    yield sse_event("notion", {"results": [result.model_dump() for result in data]})
+                elif event == "strategy":
+                    yield sse_event("strategy", {
+                        "search_strategy": data.get("personal_analysis", {}),
+                        "personalized_queries": data.get("personalized_queries", [])
+                    })
+                elif event == "web":
+                    yield sse_event("web", {
+                        "query": data["query"],
+                        "results": [result.model_dump() for result in data["results"]]
+                    })
+                elif event == "results":
+                    search_response = data
+            
+            all_results = search_response.get("results", [])
+            yield sse_event("sources", {
+                "sources": [result.model_dump() for result in all_results],
+                "source_groups": build_source_groups(all_results)
+            })
+            
+            chunks = []
+            with span("answer.stream"):
+                async for chunk in llm_service.generate_response(query, all_results):
+                    stream_timer.token()
+                    chunks.append(chunk)
+                    yield sse_event("token", {"delta": chunk})
+            stream_timer.finish()
+            full_response = "".join(chunks)
+            
+            # Save before "done": the client disconnects on it, which cancels this generator
+            await storage_service.add_message_to_thread(thread_id, Message(
+                id=message_id,
+                content=full_response,
+                role="assistant",
+                timestamp=datetime.now(),
+                sources=all_results
+            ))
+            
+            yield sse_event("done", response_digest(full_response))
+        except Exception as e:
+            yield sse_event("failed", {"message": str(e)})
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # Disable proxy buffering so events reach the client as they are sent
+        "X-Accel-Buffering": "no"
+    })
+
 @app.websocket("/ws/stream/{thread_id}/{message_id}")
-async def websocket_stream(websocket: WebSocket, thread_id: str, message_id: str):
-    """WebSocket endpoint for streaming responses"""
+async def websocket_stream(websocket: WebSocket, thread_id: str, message_id: str, protocol: int = 1):
+    """WebSocket endpoint for streaming responses.
+    
+    `protocol=2` streams sequence-numbered deltas coalesced into frames and ends
+    with a frame carrying the response length and checksum; protocol 1 sends
+    each chunk together with the full response so far.
+    """
     await websocket.accept()
+    with tracer.trace("WS /ws/stream", thread_id=thread_id, protocol=protocol):
+        await _stream_answer(websocket, thread_id, message_id, protocol)
+
+async def _stream_answer(websocket: WebSocket, thread_id: str, message_id: str, protocol: int):
+    delta_stream = DeltaStream(websocket.send_text) if protocol == PROTOCOL_DELTA else None
+    stream_timer = StreamTimer("websocket")
     
     try:
         # Get the latest message (user query) from the thread
         thread = await storage_service.get_thread(thread_id)
         if not thread or not thread.messages:
+            if delta_stream:
+                await delta_stream.error("Thread not found")
+                return
             await websocket.send_text(json.dumps({
                 "content": "Error: Thread not found",
                 "finished": True
@@ -211,36 +436,53 @@ async def websocket_stream(websocket: WebSocket, thread_id: str, message_id: str
                 user_query = msg.content
                 break
                 
-        # Find if there are any sources from previous assistant messages
-        for msg in reversed(thread.messages):
-            if msg.role == "assistant" and msg.sources:
-                search_results = msg.sources
-                break
+        # Use the sources /search computed for this message, if handed off
+        handoff = await storage_service.pop_search_handoff(message_id)
+        if handoff and handoff["thread_id"] == thread_id:
+            search_results = handoff["sources"]
+        CACHE_REQUESTS.inc(cache="search_handoff", outcome="hit" if search_results else "miss")
+        
+        # Otherwise find if there are any sources from previous assistant messages
+        if not search_results:
+            for msg in reversed(thread.messages):
+                if msg.role == "assistant" and msg.sources:
+                    search_results = msg.sources
+                    break
         
         # If no sources found, perform search
         if not search_results:
             search_results = await search_service.search(user_query)
         
         # Generate and stream response
-        full_response = ""
-        async for chunk in llm_service.generate_response(user_query, search_results):
-            full_response += chunk
+        if delta_stream:
+            async for chunk in llm_service.generate_response(user_query, search_results):
+                stream_timer.token()
+                await delta_stream.write(chunk)
+            full_response = await delta_stream.finish()
+        else:
+            chunks = []
+            async for chunk in llm_service.generate_response(user_query, search_results):
+                stream_timer.token()
+                chunks.append(chunk)
+                
+                # Send chunk to client
+                response_data = {
+                    "content": chunk,
+                    "finished": False,
+                    "full_content": "".join(chunks)
+                }
+                await websocket.send_text(json.dumps(response_data))
+            full_response = "".join(chunks)
             
-            # Send chunk to client
-            response_data = {
-                "content": chunk,
-                "finished": False,
+            # Send final message
+            final_response = {
+                "content": "",
+                "finished": True,
                 "full_content": full_response
             }
-            await websocket.send_text(json.dumps(response_data))
+            await websocket.send_text(json.dumps(final_response))
         
-        # Send final message
-        final_response = {
-            "content": "",
-            "finished": True,
-            "full_content": full_response
-        }
-        await websocket.send_text(json.dumps(final_response))
+        stream_timer.finish()
         
         # Save the complete assistant message to thread
         assistant_message = Message(
@@ -253,27 +495,40 @@ async def websocket_stream(websocket: WebSocket, thread_id: str, message_id: str
         await storage_service.add_message_to_thread(thread_id, assistant_message)
         
     except WebSocketDisconnect:
-        print(f"WebSocket disconnected for thread {thread_id}")
+        logger.info("WebSocket disconnected for thread %s", thread_id)
     except Exception as e:
+        if delta_stream:
+            await delta_stream.error(str(e))
+            return
         await websocket.send_text(json.dumps({
             "content": f"Error: {str(e)}",
             "finished": True
         }))
 
 @app.get("/threads")
-async def get_threads():
-    """Get all threads ordered by most recent activity"""
+async def get_threads(response: Response, limit: int = Query(50, ge=1, le=200), cursor: Optional[str] = None,
+                      fields: Optional[str] = None):
+    """Get threads ordered by most recent activity.
+    
+    `fields=summary` returns lightweight summaries for the sidebar; the cursor for
+    the next page (if any) is returned in the X-Next-Cursor header.
+    """
     try:
-        threads = await storage_service.get_all_threads()
+        if fields == "summary":
+            threads, next_cursor = await storage_service.get_thread_summaries(limit, cursor)
+        else:
+            threads, next_cursor = await storage_service.get_all_threads(limit, cursor)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         return [thread.model_dump() for thread in threads]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get threads: {str(e)}")
 
 @app.get("/threads/{thread_id}")
-async def get_thread(thread_id: str):
-    """Get a specific thread by ID"""
+async def get_thread(thread_id: str, offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1)):
+    """Get a specific thread by ID, optionally a page of its messages"""
     try:
-        thread = await storage_service.get_thread(thread_id)
+        thread = await storage_service.get_thread(thread_id, offset=offset, limit=limit)
         if not thread:
             raise HTTPException(status_code=404, detail="Thread not found")
         return thread.model_dump()
@@ -368,7 +623,10 @@ async def notion_oauth_callback(code: str, state: str):
         })
         
         if not stored:
-            print("Warning: Could not store token in Redis, but OAuth completed successfully")
+            logger.warning("Could not store token in Redis, but OAuth completed successfully")
+        else:
+            # Warm the corpus and profile now instead of on the first search
+            notion_sync_worker.schedule_user(user_id)
         
         return {
             "success": True,
@@ -378,8 +636,8 @@ async def notion_oauth_callback(code: str, state: str):
         }
         
     except Exception as e:
-        print(f"Notion OAuth callback error: {e}")
-        print(f"DEBUG: code={code[:10] if code else 'None'}..., state={state}")
+        logger.error("Notion OAuth callback error: %s", e)
+        logger.debug("code=%s..., state=%s", code[:10] if code else 'None', state)
         raise HTTPException(status_code=500, detail=f"Failed to complete Notion OAuth: {str(e)}")
 
 @app.get("/notion/status")
@@ -403,10 +661,25 @@ async def disconnect_notion(user_id: str = "default_user"):
     """Disconnect Notion integration"""
     try:
         await storage_service.delete_notion_token(user_id)
+        await storage_service.delete_notion_corpus(user_id)
         return {"success": True, "message": "Notion disconnected successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to disconnect Notion: {str(e)}")
 
+@app.post("/notion/sync")
+async def sync_notion(user_id: str = "default_user"):
+    """Refresh the stored Notion corpus, fetching only pages edited since the last sync"""
+    try:
+        token_data = await storage_service.get_notion_token(user_id)
+        if not token_data or not token_data.get("access_token"):
+            raise HTTPException(status_code=401, detail="Notion not connected")
+        
+        return await notion_index.sync(user_id, token_data["access_token"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to sync Notion: {str(e)}")
+
 @app.post("/notion/search")
 async def search_notion(query: str, user_id: str = "default_user", limit: int = 5):
     """Search user's Notion content"""
@@ -428,7 +701,7 @@ async def search_notion(query: str, user_id: str = "default_user", limit: int =
         raise HTTPException(status_code=500, detail=f"Failed to search Notion: {str(e)}")
 
 @app.get("/notion/debug/pages")
-async def debug_notion_pages(user_id: str = "default_user"):
+async def debug_notion_pages(user_id: str = "default_user", include_content: bool = False):
     """Debug endpoint to see what pages the integration can access"""
     try:
         token_data = await storage_service.get_notion_token(user_id)
@@ -438,6 +711,12 @@ async def debug_notion_pages(user_id: str = "default_user"):
         # Get all accessible pages
         all_pages = await notion_service.get_all_accessible_pages(token_data["access_token"], limit=20)
         
+        # Optionally fetch page content through the rate-limited scheduler
+        page_contents = {}
+        if include_content:
+            async for page, content_data in notion_service.iter_page_contents(token_data["access_token"], all_pages):
+                page_contents[page.get("id")] = content_data or {}
+        
         debug_info = {
             "total_pages": len(all_pages),
             "pages": []
@@ -452,6 +731,10 @@ async def debug_notion_pages(user_id: str = "default_user"):
                 "url": page.get("url"),
                 "properties_keys": list(page.get("properties", {}).keys()) if page.get("properties") else []
             }
+            if include_content:
+                blocks = page_contents.get(page.get("id"), {}).get("results", [])
+                page_info["block_count"] = len(blocks)
+                page_info["content_preview"] = notion_service.extract_text_from_blocks(blocks)[:200]
             debug_info["pages"].append(page_info)
         
         return debug_info
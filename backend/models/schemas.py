@@ -29,6 +29,14 @@ class Thread(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+class ThreadSummary(BaseModel):
+    id: str
+    title: str
+    created_at: datetime
+    updated_at: datetime
+    message_count: int = 0
+    last_snippet: str = ""
+
 class StreamingResponse(BaseModel):
     content: str
     finished: bool
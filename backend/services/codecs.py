@@ -0,0 +1,97 @@
+import json
+import os
+import zlib
+from typing import Any, Union
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Every encoded value starts with one header byte: the low bits name the
+# serialization format and the high bits the compression applied on top.
+# Values without a header (legacy plain JSON) start with "{" or "[".
+FORMAT_JSON = 0x01
+FORMAT_MSGPACK = 0x02
+FORMAT_MASK = 0x0F
+
+COMPRESSION_ZLIB = 0x40
+COMPRESSION_ZSTD = 0x80
+COMPRESSION_MASK = 0xC0
+
+LEGACY_JSON_PREFIXES = (ord("{"), ord("["))
+
+
+class Codec:
+    """Versioned, optionally compressed encoding for values stored in Redis"""
+
+    def __init__(self, format_name: str = None, compression: str = None, compress_min_bytes: int = None):
+        format_name = (format_name or os.getenv("STORAGE_CODEC", "auto")).lower()
+        compression = (compression or os.getenv("STORAGE_COMPRESSION", "auto")).lower()
+
+        if format_name == "auto":
+            format_name = "msgpack" if msgpack else "json"
+        if format_name == "msgpack" and not msgpack:
+            raise ImportError("STORAGE_CODEC=msgpack requires the msgpack package")
+        if compression == "auto":
+            compression = "zstd" if zstandard else "zlib"
+        if compression == "zstd" and not zstandard:
+            raise ImportError("STORAGE_COMPRESSION=zstd requires the zstandard package")
+
+        self.format_name = format_name
+        self.compression = compression
+        self.compress_min_bytes = compress_min_bytes if compress_min_bytes is not None else int(
+            os.getenv("STORAGE_COMPRESS_MIN_BYTES", "1024")
+        )
+        self._zstd_compressor = zstandard.ZstdCompressor(level=3) if zstandard else None
+        self._zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+    def encode(self, value: Any) -> bytes:
+        if self.format_name == "msgpack":
+            header, payload = FORMAT_MSGPACK, msgpack.packb(value, use_bin_type=True)
+        else:
+            header, payload = FORMAT_JSON, orjson.dumps(value) if orjson else json.dumps(value, separators=(",", ":")).encode()
+
+        if len(payload) >= self.compress_min_bytes:
+            if self.compression == "zstd":
+                header, payload = header | COMPRESSION_ZSTD, self._zstd_compressor.compress(payload)
+            elif self.compression == "zlib":
+                header, payload = header | COMPRESSION_ZLIB, zlib.compress(payload)
+
+        return bytes([header]) + payload
+
+    def decode(self, data: Union[bytes, str]) -> Any:
+        if isinstance(data, str):
+            data = data.encode()
+        if not data:
+            raise ValueError("Cannot decode an empty value")
+        if data[0] in LEGACY_JSON_PREFIXES:
+            return orjson.loads(data) if orjson else json.loads(data)
+
+        header, payload = data[0], data[1:]
+        compression = header & COMPRESSION_MASK
+        if compression == COMPRESSION_ZSTD:
+            if not self._zstd_decompressor:
+                raise ImportError("Reading zstd-compressed values requires the zstandard package")
+            payload = self._zstd_decompressor.decompress(payload)
+        elif compression == COMPRESSION_ZLIB:
+            payload = zlib.decompress(payload)
+
+        data_format = header & FORMAT_MASK
+        if data_format == FORMAT_MSGPACK:
+            if not msgpack:
+                raise ImportError("Reading msgpack values requires the msgpack package")
+            return msgpack.unpackb(payload, raw=False)
+        if data_format == FORMAT_JSON:
+            return orjson.loads(payload) if orjson else json.loads(payload)
+        raise ValueError(f"Unknown codec header byte: {header:#04x}")
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from models.schemas import SearchResult
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n+")
+
+# Rough characters-per-token ratio for English text when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+
+# None until loaded, False when loading failed (estimates are used from then on)
+_encoding = None
+_encoding_load: Optional[asyncio.Future] = None
+
+
+def _load_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.encoding_for_model("gpt-4") if tiktoken else False
+        except Exception as e:
+            # The encoding file is fetched on first use; fall back to estimates offline
+            logger.warning("tiktoken unavailable, estimating token counts: %s", e)
+            _encoding = False
+    return _encoding or None
+
+
+async def load_encoding():
+    """Load the tiktoken encoding in a thread; the first load may download it"""
+    global _encoding_load
+    if _encoding is None:
+        if _encoding_load is None:
+            _encoding_load = asyncio.get_running_loop().run_in_executor(None, _load_encoding)
+        await _encoding_load
+    return _encoding or None
+
+
+def _get_encoding():
+    if _encoding is None:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return _load_encoding()
+        # Never block the event loop on the download: estimate until the load finishes
+        if _encoding_load is None:
+            asyncio.ensure_future(load_encoding())
+        return None
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    """Number of GPT-4 tokens in text (estimated when tiktoken is not installed)"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of whole sentences that fits in max_tokens.
+
+    Falls back to cutting at a word boundary when even the first sentence
+    does not fit.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    kept: List[str] = []
+    used = 0
+    for sentence in SENTENCE_PATTERN.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence) + 1
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        used += tokens
+
+    if kept:
+        return " ".join(kept)
+
+    cut = text[:max_tokens * CHARS_PER_TOKEN]
+    while cut and count_tokens(cut) > max_tokens:
+        cut = cut[:int(len(cut) * 0.9)]
+    cut = cut.rsplit(" ", 1)[0] if " " in cut else cut
+    return cut + "..." if cut else ""
+
+
+@dataclass
+class PackedSource:
+    result: SearchResult
+    content: str
+    tokens: int
+    original_tokens: int
+
+    @property
+    def trimmed(self) -> bool:
+        return self.tokens < self.original_tokens
+
+
+@dataclass
+class PackingReport:
+    budget: int
+    used_tokens: int = 0
+    included: int = 0
+    trimmed: List[Dict[str, Any]] = field(default_factory=list)
+    dropped: List[Dict[str, Any]] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "budget": self.budget,
+            "used_tokens": self.used_tokens,
+            "included": self.included,
+            "trimmed": self.trimmed,
+            "dropped": self.dropped
+        }
+
+
+class ContextPacker:
+    """Fits search result contents into a token budget for the LLM prompt.
+
+    Results are assumed to be ordered by relevance. Each gets a share of the
+    budget weighted by 1 / (rank + 1); sources shorter than their share give
+    the remainder back to the others, and sources whose share would fall
+    below `min_source_tokens` are dropped, least relevant first.
+    """
+
+    def __init__(self, budget: Optional[int] = None, min_source_tokens: Optional[int] = None):
+        self.budget = budget if budget is not None else int(os.getenv("LLM_CONTEXT_TOKEN_BUDGET", "4000"))
+        self.min_source_tokens = min_source_tokens if min_source_tokens is not None else int(
+            os.getenv("LLM_CONTEXT_MIN_SOURCE_TOKENS", "60")
+        )
+
+    def _allocate(self, needs: List[int]) -> Tuple[Dict[int, int], List[int]]:
+        """Token quota per source index, and the indexes that had to be dropped"""
+        active = list(range(len(needs)))
+        quotas: Dict[int, int] = {}
+        dropped: List[int] = []
+        remaining = self.budget
+
+        while active:
+            total_weight = sum(1 / (rank + 1) for rank in active)
+            shares = {rank: int(remaining * (1 / (rank + 1)) / total_weight) for rank in active}
+
+            satisfied = [rank for rank in active if needs[rank] <= shares[rank]]
+            if satisfied:
+                for rank in satisfied:
+                    quotas[rank] = needs[rank]
+                    remaining -= needs[rank]
+                    active.remove(rank)
+                continue
+
+            least_relevant = active[-1]
+            if shares[least_relevant] < self.min_source_tokens:
+                dropped.append(least_relevant)
+                active.remove(least_relevant)
+                continue
+
+            quotas.update(shares)
+            break
+
+        return quotas, sorted(dropped)
+
+    def pack(self, results: List[SearchResult]) -> Tuple[List[PackedSource], PackingReport]:
+        contents = [result.content or result.snippet or "" for result in results]
+        needs = [count_tokens(content) for content in contents]
+        quotas, dropped = self._allocate(needs)
+        report = PackingReport(budget=self.budget)
+
+        packed = []
+        for rank, result in enumerate(results):
+            if rank in dropped:
+                report.dropped.append({"title": result.title, "url": result.url, "tokens": needs[rank]})
+                continue
+
+            content = contents[rank] if needs[rank] <= quotas[rank] else trim_to_tokens(contents[rank], quotas[rank])
+            source = PackedSource(result=result, content=content, tokens=count_tokens(content),
+                                  original_tokens=needs[rank])
+            if source.trimmed:
+                report.trimmed.append({
+                    "title": result.title,
+                    "url": result.url,
+                    "tokens": source.original_tokens,
+                    "kept_tokens": source.tokens
+                })
+            report.used_tokens += source.tokens
+            packed.append(source)
+
+        report.included = len(packed)
+        return packed, report
@@ -0,0 +1,106 @@
+import httpx
+import logging
+import os
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  (HTTP/2 support for httpx is optional)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class HTTPClientPool:
+    """Application-lifetime pool of httpx clients, one per upstream host.
+
+    Each upstream (Brave, Exa, Notion, ...) gets its own AsyncClient so that
+    connection limits apply per host and keep-alive connections are reused
+    across requests instead of paying a new TCP+TLS handshake every call.
+    """
+
+    def __init__(self):
+        self.max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+        self.max_keepalive_connections = int(os.getenv("HTTP_MAX_KEEPALIVE_PER_HOST", "10"))
+        self.keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+        self.http2 = os.getenv("HTTP2_ENABLED", "false").lower() == "true" and HTTP2_AVAILABLE
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._request_counts: Dict[str, int] = {}
+
+    def _create_client(self, name: str) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry
+        )
+
+        async def count_request(request: httpx.Request):
+            self._request_counts[name] = self._request_counts.get(name, 0) + 1
+
+        return httpx.AsyncClient(
+            limits=limits,
+            http2=self.http2,
+            timeout=10.0,
+            event_hooks={"request": [count_request]}
+        )
+
+    def client(self, name: str) -> httpx.AsyncClient:
+        """Get the shared client for an upstream, creating it on first use"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create_client(name)
+            self._clients[name] = client
+        return client
+
+    async def start(self, names=("brave", "exa", "notion", "supermemory")):
+        """Create the clients for the known upstreams up front"""
+        for name in names:
+            self.client(name)
+        logger.info("✅ HTTP client pool ready (%s, http2=%s)", ', '.join(names), self.http2)
+
+    async def close(self):
+        """Close every pooled client and release their connections"""
+        for client in self._clients.values():
+            if not client.is_closed:
+                await client.aclose()
+        self._clients.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Connection pool statistics per upstream"""
+        upstreams = {}
+        for name, client in self._clients.items():
+            upstreams[name] = {
+                "requests": self._request_counts.get(name, 0),
+                "closed": client.is_closed,
+                **self._connection_stats(client)
+            }
+
+        return {
+            "http2": self.http2,
+            "limits": {
+                "max_connections_per_host": self.max_connections,
+                "max_keepalive_per_host": self.max_keepalive_connections,
+                "keepalive_expiry": self.keepalive_expiry
+            },
+            "upstreams": upstreams
+        }
+
+    def _connection_stats(self, client: httpx.AsyncClient) -> Dict[str, Optional[int]]:
+        # httpx does not expose pool state publicly, so look at the httpcore pool
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return {"connections": None, "idle_connections": None}
+
+        idle = 0
+        for connection in connections:
+            try:
+                if connection.is_idle():
+                    idle += 1
+            except Exception:
+                continue
+        return {"connections": len(connections), "idle_connections": idle}
+
+
+http_pool = HTTPClientPool()
@@ -0,0 +1,81 @@
+import bisect
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, float("inf")]
+
+
+class LatencyHistogram:
+    """Latency histogram with a sliding window of recent samples for percentiles"""
+
+    def __init__(self, window: int = 500):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.outcomes: Dict[str, int] = {}
+
+    def observe(self, seconds: float, outcome: str = "ok"):
+        self.samples.append(seconds)
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Percentile (0-1) over the recent window, or None without samples"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "window": len(self.samples),
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "outcomes": dict(self.outcomes),
+            "buckets": {
+                ("+Inf" if bound == float("inf") else str(bound)): count
+                for bound, count in zip(LATENCY_BUCKETS, self.bucket_counts)
+            }
+        }
+
+
+class LatencyTracker:
+    """Per-upstream latency histograms (e.g. "brave", "exa")"""
+
+    def __init__(self):
+        self._histograms: Dict[str, LatencyHistogram] = {}
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            self._histograms[name] = histogram
+        return histogram
+
+    def observe(self, name: str, seconds: float, outcome: str = "ok"):
+        self.histogram(name).observe(seconds, outcome)
+
+    def percentile(self, name: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """Percentile for an upstream, or None until `min_samples` have been observed"""
+        histogram = self._histograms.get(name)
+        if histogram is None or len(histogram.samples) < min_samples:
+            return None
+        return histogram.percentile(q)
+
+    def snapshot(self, names: Optional[List[str]] = None) -> Dict[str, Any]:
+        return {
+            name: histogram.snapshot()
+            for name, histogram in self._histograms.items()
+            if names is None or name in names
+        }
+
+
+latency_tracker = LatencyTracker()
@@ -0,0 +1,235 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from services.latency_tracker import LatencyHistogram
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Lower values are served first
+PRIORITY_ANSWER = 0        # streamed answers the user is watching
+PRIORITY_SEARCH = 1        # personalization on the /search path
+PRIORITY_BACKGROUND = 2    # profile rebuilds and other background work
+
+PRIORITY_NAMES = {PRIORITY_ANSWER: "answer", PRIORITY_SEARCH: "search", PRIORITY_BACKGROUND: "background"}
+
+LLM_QUEUE_WAIT = metrics.histogram(
+    "farfalle_llm_queue_wait_seconds", "Time OpenAI calls waited for the LLM scheduler", ["priority"]
+)
+LLM_QUEUE_DEPTH = metrics.gauge(
+    "farfalle_llm_queue_depth", "OpenAI calls waiting for the LLM scheduler", ["priority"]
+)
+LLM_IN_FLIGHT = metrics.gauge("farfalle_llm_in_flight", "OpenAI calls currently running")
+LLM_QUEUE_REJECTIONS = metrics.counter(
+    "farfalle_llm_queue_rejections_total", "OpenAI calls the LLM scheduler turned away", ["priority", "reason"]
+)
+
+
+class LLMQueueError(Exception):
+    """The scheduler turned a call away before it reached OpenAI"""
+
+
+class LLMQueueFullError(LLMQueueError):
+    """The scheduler queue is at its maximum depth"""
+
+
+class LLMQueueTimeoutError(LLMQueueError):
+    """A call waited longer than the queue allows"""
+
+
+class RateBudget:
+    """Per-minute budget refilled continuously, allowing bursts of `burst_seconds` worth.
+
+    A limit of 0 disables the budget.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.available = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be taken; requests larger than a burst wait for a full bucket.
+
+        The full amount is charged either way, so a large call leaves the
+        bucket in debt and later calls wait for it to be paid back.
+        """
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        missing = min(amount, self.capacity) - self.available
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float):
+        if self.rate > 0:
+            self.available -= amount
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    tokens: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class LLMScheduler:
+    """Process-wide governor for OpenAI calls.
+
+    Calls wait in a priority queue until they fit the requests-per-minute and
+    tokens-per-minute budgets and a concurrency slot is free. Waiting is
+    bounded by `max_wait`, and the queue by `max_depth`. Budgets are per
+    process; divide the account limits by the number of workers.
+    """
+
+    def __init__(self):
+        burst_seconds = float(os.getenv("OPENAI_BURST_SECONDS", "10"))
+        self.rpm_limit = float(os.getenv("OPENAI_RPM_LIMIT", "500"))
+        self.tpm_limit = float(os.getenv("OPENAI_TPM_LIMIT", "80000"))
+        self.requests = RateBudget(self.rpm_limit, burst_seconds)
+        self.tokens = RateBudget(self.tpm_limit, burst_seconds)
+        self.max_concurrency = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+        self.max_wait = float(os.getenv("LLM_QUEUE_MAX_WAIT", "20"))
+        self.max_depth = int(os.getenv("LLM_QUEUE_MAX_DEPTH", "256"))
+        self.in_flight = 0
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._waits = {priority: LatencyHistogram() for priority in PRIORITY_NAMES}
+        self.counts = {"granted": 0, "rejected": 0, "timed_out": 0}
+
+    @asynccontextmanager
+    async def slot(self, priority: int, tokens: int) -> AsyncIterator[Callable[[], None]]:
+        """Hold an OpenAI call slot for the duration of the block.
+
+        Yields a callable that frees the concurrency slot early; streaming
+        callers use it once the first chunk arrives, since the rate budgets
+        were already charged and the rest of the stream only reads a response.
+        """
+        await self.acquire(priority, tokens)
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.release()
+
+        try:
+            yield release
+        finally:
+            release()
+
+    async def acquire(self, priority: int, tokens: int):
+        """Wait for a slot; `tokens` is the prompt size plus max_tokens"""
+        if sum(1 for waiter in self._queue if not waiter.future.done()) >= self.max_depth:
+            self.counts["rejected"] += 1
+            LLM_QUEUE_REJECTIONS.inc(priority=PRIORITY_NAMES.get(priority, str(priority)), reason="queue_full")
+            raise LLMQueueFullError(f"LLM queue is full ({self.max_depth} waiting)")
+
+        waiter = _Waiter(priority, next(self._seq), tokens, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, waiter)
+        enqueued_at = time.perf_counter()
+        self._dispatch()
+        try:
+            await asyncio.wait_for(waiter.future, timeout=self.max_wait)
+        except BaseException as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as we gave up: hand the slot back
+                self.release()
+            else:
+                waiter.future.cancel()
+                self._dispatch()
+            if isinstance(e, asyncio.TimeoutError):
+                self.counts["timed_out"] += 1
+                LLM_QUEUE_REJECTIONS.inc(priority=PRIORITY_NAMES.get(priority, str(priority)), reason="timeout")
+                raise LLMQueueTimeoutError(
+                    f"Waited more than {self.max_wait}s for an LLM slot ({PRIORITY_NAMES.get(priority)})"
+                ) from None
+            raise
+        finally:
+            waited = time.perf_counter() - enqueued_at
+            self._waits.setdefault(priority, LatencyHistogram()).observe(waited)
+            LLM_QUEUE_WAIT.observe(waited, priority=PRIORITY_NAMES.get(priority, str(priority)))
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Grant slots to queued calls in priority order while budgets allow"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._queue:
+            head = self._queue[0]
+            if head.future.done():
+                heapq.heappop(self._queue)
+                continue
+            if self.in_flight >= self.max_concurrency:
+                break
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(head.tokens))
+            if wait > 0:
+                # Lower priorities never overtake the head, so large calls are not starved
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                break
+            heapq.heappop(self._queue)
+            self.requests.take(1)
+            self.tokens.take(head.tokens)
+            self.in_flight += 1
+            self.counts["granted"] += 1
+            head.future.set_result(None)
+
+        self._update_gauges()
+
+    def _queue_depths(self) -> Dict[str, int]:
+        depths = {name: 0 for name in PRIORITY_NAMES.values()}
+        for waiter in self._queue:
+            if not waiter.future.done():
+                name = PRIORITY_NAMES.get(waiter.priority, str(waiter.priority))
+                depths[name] = depths.get(name, 0) + 1
+        return depths
+
+    def _update_gauges(self):
+        for name, depth in self._queue_depths().items():
+            LLM_QUEUE_DEPTH.set(depth, priority=name)
+        LLM_IN_FLIGHT.set(self.in_flight)
+
+    def stats(self) -> Dict[str, Any]:
+        self.requests._refill()
+        self.tokens._refill()
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self._queue_depths(),
+            "rpm_limit": self.rpm_limit,
+            "tpm_limit": self.tpm_limit,
+            "requests_available": round(self.requests.available, 1) if self.rpm_limit else None,
+            "tokens_available": round(self.tokens.available, 1) if self.tpm_limit else None,
+            "wait_seconds": {
+                PRIORITY_NAMES[priority]: {
+                    "p50": histogram.percentile(0.50),
+                    "p95": histogram.percentile(0.95),
+                    "count": histogram.count
+                }
+                for priority, histogram in self._waits.items() if priority in PRIORITY_NAMES
+            },
+            **self.counts
+        }
+
+
+llm_scheduler = LLMScheduler()
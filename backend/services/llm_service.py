@@ -1,24 +1,52 @@
+import logging
 import openai
 import os
+import time
 from typing import List, AsyncGenerator
 from models.schemas import SearchResult
+from services.context_packer import ContextPacker, count_tokens
+from services.http_client import http_pool
+from services.llm_scheduler import PRIORITY_ANSWER, LLMQueueError, llm_scheduler
+from services.metrics import STAGE_SECONDS, record_upstream_error
+from services.tracing import span, start_span
+from services.upstream_health import upstream_health
+
+logger = logging.getLogger(__name__)
 
 class LLMService:
     def __init__(self):
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
-        self.client = openai.AsyncOpenAI(api_key=self.openai_api_key)
+        self.client = openai.AsyncOpenAI(
+            api_key=self.openai_api_key,
+            base_url=os.getenv("OPENAI_BASE_URL"),
+            http_client=http_pool.client("openai"),
+            # Failures and retries are handled by the upstream health layer
+            max_retries=0
+        )
+        # Source contents are packed into a token budget to bound prompt size
+        self.context_packer = ContextPacker()
         
     def create_context_prompt(self, query: str, search_results: List[SearchResult]) -> str:
         """Create a context-aware prompt with search results"""
+        # Fit source contents into the token budget, most relevant first
+        with STAGE_SECONDS.time(stage="context_packing"), span("llm.context_packing") as packing_span:
+            packed_sources, report = self.context_packer.pack(search_results)
+            if packing_span:
+                packing_span.set(**report.to_dict())
+        logger.debug("Packed %s sources into %s/%s tokens (%s trimmed, %s dropped)",
+                     report.included, report.used_tokens, report.budget, len(report.trimmed), len(report.dropped))
+        for dropped in report.dropped:
+            logger.debug("Dropped source from context: %s (%s tokens)", dropped['title'], dropped['tokens'])
+        
         # Separate Notion content from web results
         notion_results = []
         web_results = []
         
-        for result in search_results:
-            if result.source == "notion":
-                notion_results.append(result)
+        for source in packed_sources:
+            if source.result.source == "notion":
+                notion_results.append(source)
             else:
-                web_results.append(result)
+                web_results.append(source)
         
         context = "You are a personalized research assistant with access to the user's personal knowledge base.\n\n"
         
@@ -29,14 +57,15 @@ class LLMService:
         # Add user's personal context first
         if notion_results:
             context += "🧠 PERSONAL NOTION PAGES:\n"
-            for result in notion_results:
+            for source in notion_results:
+                result = source.result
                 source_mapping[source_counter] = {
                     "url": result.url,
                     "title": result.title,
                     "type": "notion",
                     "image_url": result.image_url
                 }
-                context += f"[{source_counter}] {result.title}\n{result.content or result.snippet}\nURL: {result.url}\n"
+                context += f"[{source_counter}] {result.title}\n{source.content}\nURL: {result.url}\n"
                 if result.image_url:
                     context += f"Image: {result.image_url}\n"
                 context += "\n"
@@ -45,7 +74,8 @@ class LLMService:
         # Add web results with context
         if web_results:
             context += "🌐 WEB SEARCH RESULTS:\n"
-            for result in web_results:
+            for source in web_results:
+                result = source.result
                 source_mapping[source_counter] = {
                     "url": result.url,
                     "title": result.title,
@@ -53,7 +83,7 @@ class LLMService:
                     "image_url": result.image_url,
                     "favicon_url": result.favicon_url
                 }
-                context += f"[{source_counter}] {result.title}\n{result.content or result.snippet}\nURL: {result.url}\n"
+                context += f"[{source_counter}] {result.title}\n{source.content}\nURL: {result.url}\n"
                 if result.image_url:
                     context += f"Image: {result.image_url}\n"
                 context += "\n"
@@ -64,8 +94,8 @@ class LLMService:
         if notion_results:
             # Extract user's main interests for personalized opening
             user_topics = []
-            for result in notion_results:
-                topic = result.title.replace('📄 ', '').strip()
+            for source in notion_results:
+                topic = source.result.title.replace('📄 ', '').strip()
                 user_topics.append(topic)
             
             context += f"""📝 PERSONALIZED RESPONSE INSTRUCTIONS:
@@ -95,24 +125,41 @@ Provide a comprehensive answer based on the search results above. Use citations
     
     async def generate_response(self, query: str, search_results: List[SearchResult]) -> AsyncGenerator[str, None]:
         """Generate streaming response using OpenAI GPT"""
+        # Not made current: the span stays open across the yields to the consumer
+        generate_span = start_span("llm.generate", sources=len(search_results))
+        tokens = 0
         try:
             prompt, source_mapping = self.create_context_prompt(query, search_results)
             
-            stream = await self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a personalized AI research assistant. You have access to the user's personal knowledge base (Notion pages) and can provide contextual, personalized responses that connect their interests with current information. Always acknowledge their existing knowledge and interests when relevant."},
-                    {"role": "user", "content": prompt}
-                ],
-                stream=True,
-                temperature=0.1,
-                max_tokens=1000
-            )
+            async with llm_scheduler.slot(PRIORITY_ANSWER, count_tokens(prompt) + 1000) as release_slot:
+                stream = await upstream_health.call("openai", lambda timeout: self.client.chat.completions.create(
+                    model="gpt-4",
+                    messages=[
+                        {"role": "system", "content": "You are a personalized AI research assistant. You have access to the user's personal knowledge base (Notion pages) and can provide contextual, personalized responses that connect their interests with current information. Always acknowledge their existing knowledge and interests when relevant."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    stream=True,
+                    temperature=0.1,
+                    max_tokens=1000,
+                    timeout=timeout
+                ), operation="stream")
             
-            async for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+                async for chunk in stream:
+                    release_slot()
+                    if chunk.choices[0].delta.content:
+                        if generate_span and not tokens:
+                            generate_span.set(first_token_ms=round((time.perf_counter() - generate_span.start) * 1000, 2))
+                        tokens += 1
+                        yield chunk.choices[0].delta.content
                     
+        except LLMQueueError as e:
+            logger.warning("LLM generation not scheduled: %s", e)
+            yield f"Sorry, I encountered an error while generating the response: {str(e)}"
         except Exception as e:
-            print(f"LLM generation error: {e}")
+            logger.error("LLM generation error: %s", e)
+            record_upstream_error("openai", e)
             yield f"Sorry, I encountered an error while generating the response: {str(e)}"
+        finally:
+            if generate_span:
+                generate_span.set(tokens=tokens)
+                generate_span.finish()
@@ -0,0 +1,214 @@
+import fnmatch
+import time
+from typing import Any, Dict, List, Optional
+
+
+def _value(value: Any):
+    # Redis stores bytes as-is and everything else as its string form
+    return value if isinstance(value, (bytes, str)) else str(value)
+
+
+class InMemoryRedis:
+    """In-process stand-in for the subset of the async Redis API StorageService uses.
+
+    Used when Redis is unreachable so threads, tokens and caches keep working
+    for the lifetime of the worker instead of silently disappearing.
+    """
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+
+    def _alive(self, name: str) -> bool:
+        expires_at = self._expires.get(name)
+        if expires_at is not None and expires_at <= time.time():
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+        return name in self._data
+
+    def _get(self, name: str, default_factory=None):
+        if not self._alive(name):
+            if default_factory is None:
+                return None
+            self._data[name] = default_factory()
+        return self._data[name]
+
+    async def ping(self) -> bool:
+        return True
+
+    def pipeline(self, transaction: bool = True) -> "InMemoryPipeline":
+        return InMemoryPipeline(self)
+
+    async def aclose(self):
+        pass
+
+    # Keys
+    async def delete(self, *names: str) -> int:
+        deleted = 0
+        for name in names:
+            if self._alive(name):
+                deleted += 1
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+        return deleted
+
+    async def exists(self, *names: str) -> int:
+        return sum(1 for name in names if self._alive(name))
+
+    async def expire(self, name: str, seconds: int) -> bool:
+        if not self._alive(name):
+            return False
+        self._expires[name] = time.time() + seconds
+        return True
+
+    async def keys(self, pattern: str = "*") -> List[str]:
+        return [name for name in list(self._data) if self._alive(name) and fnmatch.fnmatchcase(name, pattern)]
+
+    async def scan_iter(self, match: str = "*", count: Optional[int] = None):
+        for name in await self.keys(match):
+            yield name
+
+    # Strings
+    async def get(self, name: str) -> Optional[str]:
+        return self._get(name)
+
+    async def mget(self, names: List[str]) -> List[Optional[str]]:
+        return [self._get(name) for name in names]
+
+    async def set(self, name: str, value: Any, ex: Optional[int] = None, px: Optional[int] = None,
+                  nx: bool = False) -> Optional[bool]:
+        if nx and self._alive(name):
+            return None
+        self._data[name] = _value(value)
+        self._expires.pop(name, None)
+        if ex is not None:
+            self._expires[name] = time.time() + ex
+        elif px is not None:
+            self._expires[name] = time.time() + px / 1000
+        return True
+
+    async def setex(self, name: str, time_seconds: int, value: Any) -> bool:
+        return await self.set(name, value, ex=time_seconds)
+
+    async def getdel(self, name: str) -> Optional[str]:
+        value = self._get(name)
+        await self.delete(name)
+        return value
+
+    # Hashes
+    async def hget(self, name: str, key: str) -> Optional[str]:
+        return (self._get(name) or {}).get(key)
+
+    async def hset(self, name: str, key: Optional[str] = None, value: Any = None,
+                   mapping: Optional[dict] = None) -> int:
+        hash_value = self._get(name, dict)
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        added = sum(1 for field in items if field not in hash_value)
+        hash_value.update({field: _value(field_value) for field, field_value in items.items()})
+        return added
+
+    async def hgetall(self, name: str) -> Dict[str, str]:
+        return dict(self._get(name) or {})
+
+    async def hincrby(self, name: str, key: str, amount: int = 1) -> int:
+        hash_value = self._get(name, dict)
+        hash_value[key] = str(int(hash_value.get(key, 0)) + amount)
+        return int(hash_value[key])
+
+    async def hkeys(self, name: str) -> List[str]:
+        return list(self._get(name) or {})
+
+    async def hdel(self, name: str, *keys: str) -> int:
+        hash_value = self._get(name) or {}
+        return sum(1 for key in keys if hash_value.pop(key, None) is not None)
+
+    # Sorted sets
+    async def zadd(self, name: str, mapping: Dict[str, float]) -> int:
+        zset = self._get(name, dict)
+        added = sum(1 for member in mapping if member not in zset)
+        zset.update({member: float(score) for member, score in mapping.items()})
+        return added
+
+    async def zrem(self, name: str, *members: str) -> int:
+        zset = self._get(name) or {}
+        return sum(1 for member in members if zset.pop(member, None) is not None)
+
+    async def zrevrangebyscore(self, name: str, max: Any, min: Any, start: Optional[int] = None,
+                               num: Optional[int] = None, withscores: bool = False) -> List[Any]:
+        def bound(value: Any):
+            value = str(value)
+            if value.startswith("("):
+                return float(value[1:]), True
+            return float(value.replace("+inf", "inf")), False
+
+        (high, high_open), (low, low_open) = bound(max), bound(min)
+        zset = self._get(name) or {}
+        ordered = [
+            (member, score)
+            for member, score in sorted(zset.items(), key=lambda item: (item[1], item[0]), reverse=True)
+            if (score < high if high_open else score <= high) and (score > low if low_open else score >= low)
+        ]
+        if start is not None and num is not None:
+            ordered = ordered[start:start + num]
+        return ordered if withscores else [member for member, _ in ordered]
+
+    async def zrevrange(self, name: str, start: int, end: int) -> List[str]:
+        zset = self._get(name) or {}
+        ordered = [member for member, _ in sorted(zset.items(), key=lambda item: (item[1], item[0]), reverse=True)]
+        return ordered[start:] if end == -1 else ordered[start:end + 1]
+
+    # Lists
+    async def rpush(self, name: str, *values: Any) -> int:
+        items = self._get(name, list)
+        items.extend(_value(value) for value in values)
+        return len(items)
+
+    async def llen(self, name: str) -> int:
+        return len(self._get(name) or [])
+
+    async def lrange(self, name: str, start: int, end: int) -> List[str]:
+        items = self._get(name) or []
+        return items[start:] if end == -1 else items[start:end + 1]
+
+
+class InMemoryPipeline:
+    """Queues commands and runs them in order on execute(), like a Redis pipeline"""
+
+    def __init__(self, store: InMemoryRedis):
+        self._store = store
+        self._commands = []
+        self._immediate = False
+
+    def __getattr__(self, name: str):
+        command = getattr(self._store, name)
+        if self._immediate:
+            return command
+
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+
+        return queue
+
+    async def watch(self, *names: str):
+        """Run commands immediately until multi(), like a watching Redis pipeline.
+
+        Nothing is actually watched: the store lives in one event loop and a
+        queued transaction runs without yielding to it.
+        """
+        self._immediate = True
+
+    def multi(self):
+        self._immediate = False
+
+    async def execute(self) -> List[Any]:
+        commands, self._commands = self._commands, []
+        return [await command(*args, **kwargs) for command, args, kwargs in commands]
+
+    async def __aenter__(self) -> "InMemoryPipeline":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._commands = []
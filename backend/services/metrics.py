@@ -0,0 +1,209 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from services.latency_tracker import LATENCY_BUCKETS
+
+# Metrics are kept per process; with several workers each one exposes its own
+# /metrics and Prometheus aggregates them.
+
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 40, 60, 80, 120, 160, 240, 320)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Dict[LabelValues, float]:
+        return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str):
+        self._values[tuple(str(labels[name]) for name in self.labelnames)] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(bound for bound in sorted(buckets) if bound != float("inf"))
+        # Per label set: per-bucket counts (non-cumulative, last slot is +Inf), sum
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key in sorted(self._counts):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), self._counts[key]):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(self._sums[key])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._metrics.setdefault(name, Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        lines.extend(_render_cache_hit_ratios())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "farfalle_search_stage_seconds", "Duration of each stage of a personalized search", ["stage"]
+)
+SEARCH_PROVIDER_SECONDS = metrics.histogram(
+    "farfalle_search_provider_seconds", "Web search provider request latency", ["provider", "outcome"]
+)
+STREAM_TIME_TO_FIRST_TOKEN = metrics.histogram(
+    "farfalle_stream_time_to_first_token_seconds", "Time from stream start to the first answer token", ["transport"]
+)
+STREAM_TOKENS_PER_SECOND = metrics.histogram(
+    "farfalle_stream_tokens_per_second", "Answer streaming rate after the first token", ["transport"],
+    buckets=TOKENS_PER_SECOND_BUCKETS
+)
+CACHE_REQUESTS = metrics.counter(
+    "farfalle_cache_requests_total", "Cache lookups by outcome (hit, stale_hit, miss)", ["cache", "outcome"]
+)
+UPSTREAM_ERRORS = metrics.counter(
+    "farfalle_upstream_errors_total", "Failed calls to upstream services", ["upstream", "kind"]
+)
+
+
+def _render_cache_hit_ratios() -> List[str]:
+    totals: Dict[str, Dict[str, float]] = {}
+    for (cache, outcome), value in CACHE_REQUESTS.samples().items():
+        totals.setdefault(cache, {})[outcome] = value
+
+    name = "farfalle_cache_hit_ratio"
+    lines = [f"# HELP {name} Share of cache lookups served from the cache", f"# TYPE {name} gauge"]
+    for cache, outcomes in sorted(totals.items()):
+        lookups = sum(outcomes.values())
+        hits = outcomes.get("hit", 0) + outcomes.get("stale_hit", 0)
+        if lookups:
+            lines.append(f"{name}{_format_labels(('cache',), (cache,))} {_format_value(hits / lookups)}")
+    return lines
+
+
+def record_upstream_error(upstream: str, error: Exception):
+    """Count a failed upstream call, classified by HTTP status or exception type"""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    kind = f"http_{status}" if status else type(error).__name__
+    UPSTREAM_ERRORS.inc(upstream=upstream, kind=kind)
+
+
+class StreamTimer:
+    """Records time-to-first-token and tokens/sec for one streamed answer"""
+
+    def __init__(self, transport: str):
+        self.transport = transport
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.tokens = 0
+
+    def token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            STREAM_TIME_TO_FIRST_TOKEN.observe(self.first_token_at - self.started_at, transport=self.transport)
+        self.tokens += 1
+
+    def finish(self):
+        if self.first_token_at is None or self.tokens < 2:
+            return
+        elapsed = time.perf_counter() - self.first_token_at
+        if elapsed > 0:
+            STREAM_TOKENS_PER_SECOND.observe((self.tokens - 1) / elapsed, transport=self.transport)
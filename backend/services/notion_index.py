@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from models.schemas import SearchResult
+from services.passage_index import PassageIndex
+from services.tracing import background_task, traced
+
+logger = logging.getLogger(__name__)
+
+# Most recently edited pages used to build the personal profile
+PROFILE_PAGES = 20
+
+
+class NotionIndex:
+    """Per-user store of extracted Notion page text, synced incrementally.
+
+    Pages are kept in Redis through StorageService and only re-fetched when
+    their `last_edited_time` moves, so the search hot path reads the stored
+    corpus instead of calling Notion for every page on every query.
+    """
+
+    def __init__(self, notion_service, storage_service):
+        self.notion_service = notion_service
+        self.storage_service = storage_service
+        self.max_pages = int(os.getenv("NOTION_INDEX_MAX_PAGES", "100"))
+        self.refresh_interval = float(os.getenv("NOTION_INDEX_REFRESH_SECONDS", "300"))
+        self.passage_words = int(os.getenv("NOTION_PASSAGE_WORDS", "120"))
+        self._passage_indexes: Dict[str, PassageIndex] = {}
+        self._sync_locks: Dict[str, asyncio.Lock] = {}
+        self._background_syncs: Dict[str, asyncio.Task] = {}
+        # With the background sync worker running, searches never sync inline
+        self.background_sync = os.getenv("NOTION_SYNC_WORKER", "app") != "off"
+        self.sync_lock_ttl = max(60.0, self.refresh_interval)
+
+    def _lock(self, user_id: str) -> asyncio.Lock:
+        lock = self._sync_locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._sync_locks[user_id] = lock
+        return lock
+
+    async def sync(self, user_id: str, access_token: str) -> Dict[str, Any]:
+        """Bring the stored corpus up to date, fetching only new or edited pages"""
+        state, _ = await self._sync(user_id, access_token)
+        return state
+
+    async def _sync(self, user_id: str, access_token: str):
+        async with self._lock(user_id):
+            stored_pages = await self.storage_service.get_notion_pages(user_id)
+            all_pages = await self.notion_service.get_all_accessible_pages(access_token, limit=self.max_pages)
+
+            changed_pages = [
+                page for page in all_pages
+                if page.get("id") not in stored_pages
+                or stored_pages[page.get("id")].get("last_edited_time") != page.get("last_edited_time")
+            ]
+
+            updated = {}
+            failed = 0
+            async for page, content_data in self.notion_service.iter_page_contents(access_token, changed_pages):
+                page_id = page.get("id")
+                if not page_id:
+                    continue
+                if content_data is None:
+                    # Keep the previous entry so the next sync retries the page. A new page is
+                    # stored by title only, without an edit time, so it is retried as well.
+                    failed += 1
+                    if page_id in stored_pages:
+                        continue
+                updated[page_id] = {
+                    "id": page_id,
+                    "title": self.notion_service.get_page_title(page),
+                    "url": page.get("url", f"https://notion.so/{page_id}"),
+                    "last_edited_time": page.get("last_edited_time") if content_data is not None else None,
+                    "text": self.notion_service.extract_text_from_blocks((content_data or {}).get("results", []))
+                }
+            await self.storage_service.store_notion_pages(user_id, updated)
+
+            # Drop pages the integration can no longer see (only when listing succeeded)
+            removed = []
+            if all_pages:
+                live_ids = {page.get("id") for page in all_pages}
+                removed = [page_id for page_id in stored_pages if page_id not in live_ids]
+                await self.storage_service.delete_notion_pages(user_id, removed)
+
+            state = {
+                "last_synced_at": time.time(),
+                "page_count": len(all_pages) if all_pages else len(stored_pages),
+                "fetched": len(changed_pages) - failed,
+                "failed": failed,
+                "removed": len(removed)
+            }
+            await self.storage_service.store_notion_sync_state(user_id, state)
+            logger.debug("Notion sync for %s: %s fetched, %s failed, %s removed, %s listed",
+                         user_id, state["fetched"], failed, len(removed), len(all_pages))
+
+            pages = {page_id: page for page_id, page in stored_pages.items() if page_id not in removed}
+            pages.update(updated)
+            return state, pages
+
+    @staticmethod
+    def sync_lock_key(user_id: str) -> str:
+        """Redis lock held by whichever process (API or sync worker) is syncing a user"""
+        return f"notion_sync_lock:{user_id}"
+
+    def schedule_sync(self, user_id: str, access_token: str) -> Optional[asyncio.Task]:
+        """Start a background sync for a user unless one is already running here or elsewhere"""
+        task = self._background_syncs.get(user_id)
+        if task and not task.done():
+            return task
+
+        async def run():
+            lock_key, lock_token = self.sync_lock_key(user_id), uuid.uuid4().hex
+            if not await self.storage_service.acquire_lock(lock_key, lock_token, ttl=self.sync_lock_ttl):
+                return
+            try:
+                await self.sync(user_id, access_token)
+            except Exception as e:
+                logger.error("Background Notion sync failed for %s: %s", user_id, e)
+            finally:
+                await self.storage_service.release_lock(lock_key, lock_token)
+
+        task = background_task(run(), "notion.background_sync")
+        self._background_syncs[user_id] = task
+        return task
+
+    @traced("notion.get_pages")
+    async def get_pages(self, user_id: str, access_token: str) -> List[Dict[str, Any]]:
+        """Get the user's stored pages, syncing inline only when nothing has been stored yet.
+
+        With the sync worker enabled, stale pages are left for the worker to refresh.
+        """
+        state = await self.storage_service.get_notion_sync_state(user_id)
+        pages = await self.storage_service.get_notion_pages(user_id)
+
+        if not state and not pages:
+            if self.background_sync:
+                # Answer without Notion context this once rather than wait for the first sync
+                self.schedule_sync(user_id, access_token)
+                return []
+            _, pages = await self._sync(user_id, access_token)
+        elif not self.background_sync and (
+            not state or time.time() - state.get("last_synced_at", 0) > self.refresh_interval
+        ):
+            # Serve what we have and refresh in the background
+            self.schedule_sync(user_id, access_token)
+
+        return sorted(pages.values(), key=lambda page: page.get("last_edited_time") or "", reverse=True)
+
+    @staticmethod
+    def profile_results(pages: List[Dict[str, Any]]) -> List[SearchResult]:
+        """The pages the personal profile is built from, as search results"""
+        results = []
+        for page in pages[:PROFILE_PAGES]:
+            page_title = page.get("title", "")
+            content_text = page.get("text", "")
+            results.append(SearchResult(
+                title=f"📄 {page_title.strip()}",
+                url=page.get("url", f"https://notion.so/{page.get('id')}"),
+                content=content_text if content_text.strip() else f"Content from Notion page: {page_title}",
+                snippet=content_text[:200] if content_text.strip() else f"Your personal Notion page: {page_title}",
+                source="notion"
+            ))
+        return results
+
+    def passage_index(self, user_id: str, pages: List[Dict[str, Any]]) -> PassageIndex:
+        """Get the user's in-memory BM25 passage index, reindexing only pages that changed"""
+        index = self._passage_indexes.get(user_id)
+        if index is None:
+            index = PassageIndex(max_words=self.passage_words)
+            self._passage_indexes[user_id] = index
+
+        live_ids = set()
+        for page in pages:
+            page_id = page.get("id")
+            live_ids.add(page_id)
+            version = page.get("last_edited_time")
+            if page_id in index.doc_versions and index.doc_versions[page_id] == version:
+                continue
+            index.add_document(
+                page_id,
+                page.get("title", ""),
+                page.get("text", ""),
+                version=version,
+                metadata={"url": page.get("url", f"https://notion.so/{page_id}")}
+            )
+
+        for page_id in list(index.doc_versions):
+            if page_id not in live_ids:
+                index.remove_document(page_id)
+
+        return index
+
+    async def search_passages(self, user_id: str, access_token: str, query: str, k: int = 8) -> List[Dict[str, Any]]:
+        """Top-k BM25 passages from the user's Notion corpus"""
+        pages = await self.get_pages(user_id, access_token)
+        return self.passage_index(user_id, pages).search(query, k)
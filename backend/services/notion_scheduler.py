@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second with bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block_for(self, seconds: float):
+        """Stop handing out tokens for `seconds` (used for 429 Retry-After)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class NotionFetchScheduler:
+    """Rate-limit-aware scheduler for Notion API calls.
+
+    Notion allows roughly 3 requests per second per integration, so every
+    access token gets its own token bucket. Page fetches run concurrently
+    up to `max_concurrency` and are handed back as they complete.
+    """
+
+    def __init__(self):
+        self.rate = float(os.getenv("NOTION_RATE_LIMIT_PER_SECOND", "3"))
+        self.burst = float(os.getenv("NOTION_RATE_LIMIT_BURST", "3"))
+        self.max_concurrency = int(os.getenv("NOTION_FETCH_CONCURRENCY", "3"))
+        self.max_retries = int(os.getenv("NOTION_MAX_RETRIES", "3"))
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def _bucket(self, access_token: str) -> TokenBucket:
+        bucket = self._buckets.get(access_token)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets[access_token] = bucket
+        return bucket
+
+    async def acquire(self, access_token: str):
+        """Wait for a request slot for this access token"""
+        await self._bucket(access_token).acquire()
+
+    def retry_after(self, access_token: str, seconds: Optional[float]):
+        """Pause all requests for this access token after a 429 response"""
+        self._bucket(access_token).block_for(seconds if seconds and seconds > 0 else 1.0)
+
+    async def fetch_pages(self, pages: List[Dict[str, Any]],
+                          fetch: Callable[[Dict[str, Any]], Awaitable[Any]]) -> AsyncGenerator[Tuple[Dict[str, Any], Any], None]:
+        """Run `fetch(page)` concurrently for each page, yielding (page, result) as each completes.
+
+        A failed fetch yields None as its result so callers can skip it.
+        """
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+
+        async def run(page: Dict[str, Any]) -> Tuple[Dict[str, Any], Any]:
+            async with semaphore:
+                try:
+                    return page, await fetch(page)
+                except Exception as e:
+                    logger.error("Error fetching Notion page %s: %s", page.get('id'), e)
+                    return page, None
+
+        tasks = [asyncio.create_task(run(page)) for page in pages]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
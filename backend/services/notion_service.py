@@ -1,16 +1,81 @@
+import hashlib
 import httpx
+import logging
 import os
 import base64
 from typing import List, Dict, Any, Optional
 from models.schemas import SearchResult
+from services.http_client import http_pool
+from services.metrics import STAGE_SECONDS, UPSTREAM_ERRORS, record_upstream_error
+from services.notion_scheduler import NotionFetchScheduler
+from services.passage_index import PassageIndex, group_by_document
+from services.single_flight import SingleFlight
+from services.tracing import span
+from services.upstream_health import upstream_health
+
+logger = logging.getLogger(__name__)
+
+# Largest page_size the Notion API accepts
+NOTION_MAX_PAGE_SIZE = 100
 
 class NotionService:
     def __init__(self):
         self.client_id = os.getenv("NOTION_CLIENT_ID")
         self.client_secret = os.getenv("NOTION_CLIENT_SECRET")
-        self.base_url = "https://api.notion.com/v1"
-        self.oauth_url = "https://api.notion.com/v1/oauth"
+        self.base_url = os.getenv("NOTION_BASE_URL", "https://api.notion.com/v1")
+        self.oauth_url = f"{self.base_url}/oauth"
+        self.scheduler = NotionFetchScheduler()
+        # Identical concurrent listings/fetches for the same workspace share one request
+        self.page_list_flights = SingleFlight("notion_pages")
+        self.page_content_flights = SingleFlight("notion_page_content")
+        
+    async def _request(self, method: str, url: str, access_token: str, **kwargs) -> httpx.Response:
+        """Make a rate-limited Notion API request, retrying on 429 per Retry-After.
+        
+        Only reads (GET and the search endpoint) go through here, so transient
+        failures are retried as well. Every HTTP attempt, retries included,
+        takes a token from the access token's rate limit bucket.
+        """
+        client = http_pool.client("notion")
         
+        async def wait_for_token():
+            with span("notion.rate_limit_wait"):
+                await self.scheduler.acquire(access_token)
+        
+        for attempt in range(self.scheduler.max_retries + 1):
+            with span("notion.request", method=method, path=url.replace(self.base_url, ""), attempt=attempt) as request_span:
+                response = await upstream_health.call(
+                    "notion",
+                    lambda timeout: client.request(method, url, timeout=timeout, **kwargs),
+                    idempotent=True,
+                    before_attempt=wait_for_token
+                )
+                if request_span:
+                    request_span.set(status=response.status_code)
+            if response.status_code != 429 or attempt == self.scheduler.max_retries:
+                return response
+            
+            try:
+                retry_after = float(response.headers.get("Retry-After", "1"))
+            except ValueError:
+                retry_after = 1.0
+            logger.warning("Notion rate limited, retrying in %ss", retry_after)
+            UPSTREAM_ERRORS.inc(upstream="notion", kind="http_429")
+            self.scheduler.retry_after(access_token, retry_after)
+        
+        return response
+    
+    async def iter_page_contents(self, access_token: str, pages: List[Dict[str, Any]]):
+        """Fetch block content for many pages concurrently, yielding (page, content_data) as each completes.
+        
+        content_data is None when the page could not be fetched.
+        """
+        async def fetch(page: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            return await self.get_page_content(access_token, page["id"])
+        
+        async for page, content_data in self.scheduler.fetch_pages(pages, fetch):
+            yield page, content_data
+    
     def create_oauth_url(self, redirect_uri: str, state: str) -> str:
         """Create Notion OAuth authorization URL"""
         return (
@@ -45,30 +110,31 @@ class NotionService:
             "Authorization": f"Basic {encoded_credentials}"
         }
         
-        async with httpx.AsyncClient() as client:
-            try:
-                print(f"DEBUG: Exchanging code for token at {url}")
-                print(f"DEBUG: Using Basic auth with client_id: {self.client_id[:8]}...")
-                response = await client.post(
-                    url,
-                    headers=headers,
-                    data=data,
-                    timeout=10.0
-                )
-                print(f"DEBUG: Token exchange response status: {response.status_code}")
+        client = http_pool.client("notion")
+        try:
+            logger.debug("Exchanging code for token at %s", url)
+            logger.debug("Using Basic auth with client_id: %s...", self.client_id[:8])
+            # Authorization codes are single use, so this is never retried
+            response = await upstream_health.call("notion", lambda timeout: client.post(
+                url,
+                headers=headers,
+                data=data,
+                timeout=timeout
+            ))
+            logger.debug("Token exchange response status: %s", response.status_code)
                 
-                if response.status_code != 200:
-                    error_text = await response.aread()
-                    print(f"DEBUG: Token exchange error: {error_text}")
-                    raise Exception(f"Token exchange failed: {response.status_code} - {error_text}")
+            if response.status_code != 200:
+                error_text = await response.aread()
+                logger.debug("Token exchange error: %s", error_text)
+                raise Exception(f"Token exchange failed: {response.status_code} - {error_text}")
                 
-                result = response.json()
-                print(f"DEBUG: Token exchange successful")
-                return result
+            result = response.json()
+            logger.debug("Token exchange successful")
+            return result
                 
-            except Exception as e:
-                print(f"Notion token exchange error: {e}")
-                raise e
+        except Exception as e:
+            logger.error("Notion token exchange error: %s", e)
+            raise e
     
     async def get_user_info(self, access_token: str) -> Dict[str, Any]:
         """Get user information using access token"""
@@ -78,17 +144,26 @@ class NotionService:
             "Notion-Version": "2022-06-28"
         }
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(url, headers=headers, timeout=10.0)
-                response.raise_for_status()
-                return response.json()
-            except Exception as e:
-                print(f"Failed to get user info: {e}")
-                raise e
+        try:
+            response = await self._request("GET", url, access_token, headers=headers)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            logger.error("Failed to get user info: %s", e)
+            record_upstream_error("notion", e)
+            raise e
+    
+    def _token_key(self, access_token: str) -> str:
+        return hashlib.sha256(access_token.encode()).hexdigest()[:16]
     
     async def get_all_accessible_pages(self, access_token: str, limit: int = 10) -> List[Dict[str, Any]]:
         """Get all pages accessible to the integration (no query filter)"""
+        return await self.page_list_flights.do(
+            f"{self._token_key(access_token)}:{limit}",
+            lambda: self._get_all_accessible_pages(access_token, limit)
+        )
+    
+    async def _get_all_accessible_pages(self, access_token: str, limit: int) -> List[Dict[str, Any]]:
         url = f"{self.base_url}/search"
         headers = {
             "Authorization": f"Bearer {access_token}",
@@ -100,26 +175,38 @@ class NotionService:
             "filter": {
                 "value": "page",
                 "property": "object"
-            },
-            "page_size": limit
+            }
         }
         
-        async with httpx.AsyncClient() as client:
-            try:
-                print(f"DEBUG: Getting all accessible pages")
-                response = await client.post(url, headers=headers, json=payload, timeout=10.0)
-                print(f"DEBUG: All pages response status: {response.status_code}")
-                
-                if response.status_code != 200:
-                    error_text = await response.aread()
-                    print(f"DEBUG: Error getting pages: {error_text}")
-                
-                response.raise_for_status()
-                data = response.json()
-                return data.get("results", [])
-            except Exception as e:
-                print(f"Failed to get accessible pages: {e}")
-                return []
+        # Notion returns at most 100 results per call, so follow next_cursor up to `limit`
+        pages: List[Dict[str, Any]] = []
+        try:
+            logger.debug("Getting all accessible pages")
+            with STAGE_SECONDS.time(stage="notion_listing"):
+                while True:
+                    payload["page_size"] = min(NOTION_MAX_PAGE_SIZE, limit - len(pages))
+                    response = await self._request("POST", url, access_token, headers=headers, json=payload)
+                    logger.debug("All pages response status: %s", response.status_code)
+                    
+                    if response.status_code != 200:
+                        error_text = await response.aread()
+                        logger.debug("Error getting pages: %s", error_text)
+                    
+                    response.raise_for_status()
+                    data = response.json()
+                    pages.extend(data.get("results", []))
+                    if not data.get("has_more") or not data.get("next_cursor"):
+                        break
+                    if len(pages) >= limit:
+                        logger.info("Notion workspace has more than %s pages; listing truncated", limit)
+                        break
+                    payload["start_cursor"] = data["next_cursor"]
+            return pages[:limit]
+        except Exception as e:
+            # A partial listing would look like deleted pages to the sync, so fail it as a whole
+            logger.error("Failed to get accessible pages: %s", e)
+            record_upstream_error("notion", e)
+            return []
 
     def get_page_title(self, page: Dict[str, Any]) -> str:
         """Extract title from a Notion page object"""
@@ -141,7 +228,7 @@ class NotionService:
             return f"Untitled Page ({page.get('id', 'Unknown')})"
             
         except Exception as e:
-            print(f"Error extracting title: {e}")
+            logger.error("Error extracting title: %s", e)
             return "Unknown Title"
 
     async def search_pages(self, access_token: str, query: str, limit: int = 10) -> List[Dict[str, Any]]:
@@ -162,44 +249,51 @@ class NotionService:
             "page_size": limit
         }
         
-        async with httpx.AsyncClient() as client:
-            try:
-                print(f"DEBUG: Notion search URL: {url}")
-                print(f"DEBUG: Notion search payload: {payload}")
-                response = await client.post(url, headers=headers, json=payload, timeout=10.0)
-                print(f"DEBUG: Notion search response status: {response.status_code}")
+        try:
+            logger.debug("Notion search URL: %s", url)
+            logger.debug("Notion search payload: %s", payload)
+            response = await self._request("POST", url, access_token, headers=headers, json=payload)
+            logger.debug("Notion search response status: %s", response.status_code)
                 
-                if response.status_code != 200:
-                    error_text = await response.aread()
-                    print(f"DEBUG: Notion search error response: {error_text}")
+            if response.status_code != 200:
+                error_text = await response.aread()
+                logger.debug("Notion search error response: %s", error_text)
                 
-                response.raise_for_status()
-                data = response.json()
-                print(f"DEBUG: Notion search returned {len(data.get('results', []))} results")
-                if data.get("results"):
-                    for i, result in enumerate(data["results"][:2]):  # Log first 2 results
-                        print(f"DEBUG: Result {i+1} - ID: {result.get('id')}, Object: {result.get('object')}")
-                return data.get("results", [])
-            except Exception as e:
-                print(f"Failed to search pages: {e}")
-                return []
+            response.raise_for_status()
+            data = response.json()
+            logger.debug("Notion search returned %s results", len(data.get('results', [])))
+            if data.get("results"):
+                for i, result in enumerate(data["results"][:2]):  # Log first 2 results
+                    logger.debug("Result %s - ID: %s, Object: %s", i + 1, result.get('id'), result.get('object'))
+            return data.get("results", [])
+        except Exception as e:
+            logger.error("Failed to search pages: %s", e)
+            record_upstream_error("notion", e)
+            return []
     
-    async def get_page_content(self, access_token: str, page_id: str) -> Dict[str, Any]:
-        """Get content of a specific page"""
+    async def get_page_content(self, access_token: str, page_id: str) -> Optional[Dict[str, Any]]:
+        """Get content of a specific page, or None when it could not be fetched"""
+        return await self.page_content_flights.do(
+            f"{self._token_key(access_token)}:{page_id}",
+            lambda: self._get_page_content(access_token, page_id)
+        )
+    
+    async def _get_page_content(self, access_token: str, page_id: str) -> Optional[Dict[str, Any]]:
         url = f"{self.base_url}/blocks/{page_id}/children"
         headers = {
             "Authorization": f"Bearer {access_token}",
             "Notion-Version": "2022-06-28"
         }
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(url, headers=headers, timeout=10.0)
-                response.raise_for_status()
-                return response.json()
-            except Exception as e:
-                print(f"Failed to get page content: {e}")
-                return {"results": []}
+        try:
+            with STAGE_SECONDS.time(stage="notion_page_fetch"):
+                response = await self._request("GET", url, access_token, headers=headers)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            logger.error("Failed to get page content: %s", e)
+            record_upstream_error("notion", e)
+            return None
     
     def extract_text_from_blocks(self, blocks: List[Dict[str, Any]]) -> str:
         """Extract plain text from Notion blocks"""
@@ -221,59 +315,51 @@ class NotionService:
     async def search_notion_content(self, access_token: str, query: str, limit: int = 5) -> List[SearchResult]:
         """Search Notion content and return SearchResult objects"""
         try:
-            print(f"DEBUG: Starting real Notion search for query: '{query}'")
+            logger.debug("Starting real Notion search for query: '%s'", query)
             
             # First, let's see ALL pages the integration has access to (no query filter)
             all_pages = await self.get_all_accessible_pages(access_token)
-            print(f"DEBUG: Integration has access to {len(all_pages)} total pages")
+            logger.debug("Integration has access to %s total pages", len(all_pages))
             for i, page in enumerate(all_pages[:3]):  # Show first 3 pages
                 title = self.get_page_title(page)
-                print(f"DEBUG: Page {i+1}: '{title}' (ID: {page.get('id', 'Unknown')})")
+                logger.debug("Page %s: '%s' (ID: %s)", i + 1, title, page.get('id', 'Unknown'))
             
             # Notion's search API is limited, so let's do our own filtering
-            # Get page content for each accessible page and search within it
-            results = []
-            query_lower = query.lower()
+            # Index the passages of each accessible page and rank them with BM25
+            index = PassageIndex()
             
-            for page in all_pages[:limit]:  # Limit to avoid too many API calls
-                try:
-                    page_id = page["id"]
-                    page_title = self.get_page_title(page)
-                    
-                    # Get page content
-                    content_data = await self.get_page_content(access_token, page_id)
-                    content_text = self.extract_text_from_blocks(content_data.get("results", []))
-                    
-                    # Check if query matches title or content
-                    full_text = f"{page_title} {content_text}".lower()
-                    if query_lower in full_text:
-                        print(f"DEBUG: Found match in page '{page_title}' - query '{query}' found in content")
-                        print(f"DEBUG: Content preview: {content_text[:100]}...")
-                        
-                        # Ensure content is not empty
-                        final_content = content_text if content_text.strip() else f"Content from Notion page: {page_title}"
-                        final_snippet = content_text[:200] if content_text.strip() else f"Your personal Notion page: {page_title}"
-                        
-                        # Create search result
-                        result = SearchResult(
-                            title=f"📄 {page_title.strip()}",
-                            url=page.get("url", f"https://notion.so/{page_id}"),
-                            content=final_content[:500] + "..." if len(final_content) > 500 else final_content,
-                            snippet=f"From your personal Notion page: {final_snippet}",
-                            source="notion"
-                        )
-                        results.append(result)
-                        print(f"DEBUG: Added Notion result: {result.title}")
-                    else:
-                        print(f"DEBUG: No match in page '{page_title}' for query '{query}'")
-                        
-                except Exception as e:
-                    print(f"DEBUG: Error processing page {page.get('id')}: {e}")
+            # Fetch page content concurrently (limit to avoid too many API calls)
+            pages = all_pages[:limit]
+            async for page, content_data in self.iter_page_contents(access_token, pages):
+                page_id = page.get("id")
+                if not page_id:
                     continue
+                index.add_document(
+                    page_id,
+                    self.get_page_title(page),
+                    self.extract_text_from_blocks((content_data or {}).get("results", [])),
+                    metadata={"url": page.get("url", f"https://notion.so/{page_id}")}
+                )
+            
+            results = []
+            for document in group_by_document(index.search(query, k=limit * 3))[:limit]:
+                page_title = document["title"]
+                final_content = document["text"] or f"Content from Notion page: {page_title}"
+                final_snippet = document["best_passage"][:200] or f"Your personal Notion page: {page_title}"
+                
+                result = SearchResult(
+                    title=f"📄 {page_title.strip()}",
+                    url=document["metadata"]["url"],
+                    content=final_content[:500] + "..." if len(final_content) > 500 else final_content,
+                    snippet=f"From your personal Notion page: {final_snippet}",
+                    source="notion"
+                )
+                results.append(result)
+                logger.debug("Added Notion result: %s (score %.2f)", result.title, document['score'])
             
-            print(f"DEBUG: Returning {len(results)} Notion results for query '{query}'")
+            logger.debug("Returning %s Notion results for query '%s'", len(results), query)
             return results
             
         except Exception as e:
-            print(f"Error searching Notion content: {e}")
+            logger.error("Error searching Notion content: %s", e)
             return []
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.metrics import STAGE_SECONDS
+from services.notion_index import NotionIndex
+from services.tracing import background_task
+from services.personalization_service import PersonalizationService
+
+logger = logging.getLogger(__name__)
+
+
+class NotionSyncWorker:
+    """Keeps every connected user's Notion corpus and personal profile warm.
+
+    Every `tick` seconds the worker lists users from the `notion_token:*` keys
+    and syncs those whose last sync is older than `interval` (jittered once
+    per user per sync so users spread out). Syncs go through NotionIndex, so only edited
+    pages are fetched and the per-token Notion rate limits apply. After the
+    pages are synced, the profile is rebuilt at background LLM priority.
+    The per-user Redis lock shared with NotionIndex keeps API processes and
+    workers from syncing the same user at once.
+
+    Runs inside the API process (NOTION_SYNC_WORKER=app, the default) or as a
+    separate process with `python -m services.notion_sync_worker`
+    (NOTION_SYNC_WORKER=external in the API).
+    """
+
+    def __init__(self, notion_index: NotionIndex, storage_service, warm_passage_index: bool = True):
+        self.notion_index = notion_index
+        self.storage_service = storage_service
+        # Passage indexes live in memory, so only warm them inside the API process
+        self.warm_passage_index = warm_passage_index
+        self.interval = float(os.getenv("NOTION_SYNC_INTERVAL", str(notion_index.refresh_interval)))
+        self.jitter = float(os.getenv("NOTION_SYNC_JITTER", "0.2"))
+        self.tick = float(os.getenv("NOTION_SYNC_TICK_SECONDS", "30"))
+        self.concurrency = int(os.getenv("NOTION_SYNC_CONCURRENCY", "2"))
+        self._task: Optional[asyncio.Task] = None
+        self._user_syncs: Dict[str, asyncio.Task] = {}
+        # user -> (last_synced_at, seconds after it the user is due)
+        self._due_after: Dict[str, Tuple[float, float]] = {}
+        self.counts = {"cycles": 0, "synced": 0, "failed": 0, "skipped_locked": 0, "profiles_rebuilt": 0}
+        self.last_cycle_at: Optional[float] = None
+
+    async def connected_users(self) -> List[str]:
+        return await self.storage_service.list_notion_users()
+
+    async def is_due(self, user_id: str) -> bool:
+        state = await self.storage_service.get_notion_sync_state(user_id)
+        if not state:
+            return True
+        last_synced_at = state.get("last_synced_at", 0)
+        # Draw the jitter once per sync; redrawing every tick would bias towards the early bound
+        drawn = self._due_after.get(user_id)
+        if drawn is None or drawn[0] != last_synced_at:
+            drawn = (last_synced_at, self.interval * (1 + random.uniform(-self.jitter, self.jitter)))
+            self._due_after[user_id] = drawn
+        return time.time() - last_synced_at >= drawn[1]
+
+    async def sync_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Sync one user's pages, then refresh the derived profile and passage index"""
+        token_data = await self.storage_service.get_notion_token(user_id)
+        if not token_data or not token_data.get("access_token"):
+            return None
+
+        lock_key, lock_token = self.notion_index.sync_lock_key(user_id), uuid.uuid4().hex
+        if not await self.storage_service.acquire_lock(lock_key, lock_token, ttl=self.notion_index.sync_lock_ttl):
+            self.counts["skipped_locked"] += 1
+            return None
+
+        try:
+            with STAGE_SECONDS.time(stage="notion_background_sync"):
+                state = await self.notion_index.sync(user_id, token_data["access_token"])
+                pages = sorted(
+                    (await self.storage_service.get_notion_pages(user_id)).values(),
+                    key=lambda page: page.get("last_edited_time") or "",
+                    reverse=True
+                )
+
+                personalization = PersonalizationService(self.storage_service)
+                if await personalization.refresh_profile(user_id, self.notion_index.profile_results(pages)):
+                    self.counts["profiles_rebuilt"] += 1
+                if self.warm_passage_index:
+                    self.notion_index.passage_index(user_id, pages)
+
+            self.counts["synced"] += 1
+            return state
+        except Exception as e:
+            self.counts["failed"] += 1
+            logger.error("Background Notion sync failed for %s: %s", user_id, e)
+            return None
+        finally:
+            await self.storage_service.release_lock(lock_key, lock_token)
+
+    def schedule_user(self, user_id: str) -> asyncio.Task:
+        """Sync one user in the background now, e.g. right after Notion was connected"""
+        task = self._user_syncs.get(user_id)
+        if task is None or task.done():
+            task = background_task(self.sync_user(user_id), "notion_sync.user")
+            self._user_syncs[user_id] = task
+        return task
+
+    async def run_once(self):
+        """One pass over all connected users, syncing those that are due"""
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+
+        async def sync_if_due(user_id: str):
+            async with semaphore:
+                if await self.is_due(user_id):
+                    await self.sync_user(user_id)
+
+        users = await self.connected_users()
+        for user_id in set(self._due_after) - set(users):
+            del self._due_after[user_id]
+        await asyncio.gather(*(sync_if_due(user_id) for user_id in users))
+        self.counts["cycles"] += 1
+        self.last_cycle_at = time.time()
+
+    async def run_forever(self):
+        # Stagger the first pass so restarted workers do not all start together
+        await asyncio.sleep(random.uniform(0, self.tick * self.jitter))
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error("Notion sync cycle failed: %s", e)
+            await asyncio.sleep(self.tick * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            # Detached, not traced: a trace that never ends would sit in the buffer forever
+            self._task = background_task(self.run_forever())
+            logger.info("✅ Notion sync worker started (every %ss)", self.interval)
+        return self._task
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval": self.interval,
+            "tick": self.tick,
+            "last_cycle_at": self.last_cycle_at,
+            **self.counts
+        }
+
+
+async def main():
+    from dotenv import load_dotenv
+
+    from services.http_client import http_pool
+    from services.notion_service import NotionService
+    from services.storage_service import StorageService
+
+    load_dotenv()
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    for noisy_logger in ("httpx", "httpcore"):
+        logging.getLogger(noisy_logger).setLevel(logging.WARNING)
+
+    storage_service = StorageService()
+    if not await storage_service.connect():
+        # The in-memory fallback is private to this process, so syncing into it is pointless
+        logger.error("The standalone Notion sync worker needs Redis (REDIS_URL)")
+        return
+
+    await http_pool.start()
+    worker = NotionSyncWorker(NotionIndex(NotionService(), storage_service), storage_service,
+                              warm_passage_index=False)
+    try:
+        await worker.run_forever()
+    finally:
+        await http_pool.close()
+        await storage_service.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,174 @@
+import heapq
+import math
+import re
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+STOP_WORDS = {
+    "a", "about", "after", "all", "also", "an", "and", "any", "are", "as", "at", "be", "been",
+    "but", "by", "can", "could", "did", "do", "does", "for", "from", "had", "has", "have", "how",
+    "i", "if", "in", "into", "is", "it", "its", "just", "me", "my", "no", "not", "of", "on", "or",
+    "our", "so", "some", "than", "that", "the", "their", "them", "then", "there", "these", "they",
+    "this", "to", "up", "was", "we", "were", "what", "when", "where", "which", "who", "why", "will",
+    "with", "would", "you", "your"
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with stop words removed"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+
+def split_passages(text: str, max_words: int = 120) -> List[str]:
+    """Split text into passages of whole sentences, each up to roughly `max_words` words"""
+    passages = []
+    current: List[str] = []
+    current_words = 0
+
+    for sentence in SENTENCE_PATTERN.split(text):
+        words = sentence.split()
+        if not words:
+            continue
+        # Hard-wrap sentences that are longer than a whole passage
+        while len(words) > max_words:
+            if current:
+                passages.append(" ".join(current))
+                current, current_words = [], 0
+            passages.append(" ".join(words[:max_words]))
+            words = words[max_words:]
+        if current_words + len(words) > max_words and current:
+            passages.append(" ".join(current))
+            current, current_words = [], 0
+        current.append(" ".join(words))
+        current_words += len(words)
+
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+class PassageIndex:
+    """In-memory inverted index over document passages with BM25 scoring"""
+
+    def __init__(self, max_words: int = 120, k1: float = 1.5, b: float = 0.75):
+        self.max_words = max_words
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self.passages: Dict[int, Dict[str, Any]] = {}
+        self.doc_passages: Dict[str, List[int]] = {}
+        self.doc_versions: Dict[str, Any] = {}
+        self.total_length = 0
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def add_document(self, doc_id: str, title: str, text: str,
+                     version: Any = None, metadata: Optional[Dict[str, Any]] = None):
+        """Index a document's passages, replacing any previous version of it"""
+        self.remove_document(doc_id)
+        title_tokens = tokenize(title)
+        passage_ids = []
+
+        for position, passage_text in enumerate(split_passages(text, self.max_words) or [""]):
+            # Title terms count towards every passage of the page
+            tokens = title_tokens + tokenize(passage_text)
+            if not tokens:
+                continue
+
+            passage_id = self._next_id
+            self._next_id += 1
+            term_counts: Dict[str, int] = defaultdict(int)
+            for token in tokens:
+                term_counts[token] += 1
+            for term, count in term_counts.items():
+                self.postings[term][passage_id] = count
+
+            self.passages[passage_id] = {
+                "doc_id": doc_id,
+                "title": title,
+                "text": passage_text,
+                "position": position,
+                "length": len(tokens),
+                "terms": list(term_counts),
+                "metadata": metadata or {}
+            }
+            self.total_length += len(tokens)
+            passage_ids.append(passage_id)
+
+        self.doc_passages[doc_id] = passage_ids
+        self.doc_versions[doc_id] = version
+
+    def remove_document(self, doc_id: str):
+        """Remove all passages of a document from the index"""
+        for passage_id in self.doc_passages.pop(doc_id, []):
+            passage = self.passages.pop(passage_id)
+            self.total_length -= passage["length"]
+            for term in passage["terms"]:
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(passage_id, None)
+                    if not postings:
+                        del self.postings[term]
+        self.doc_versions.pop(doc_id, None)
+
+    def search(self, query: str, k: int = 8) -> List[Dict[str, Any]]:
+        """Top-k passages for a query by BM25 score"""
+        if not self.passages:
+            return []
+
+        passage_count = len(self.passages)
+        average_length = self.total_length / passage_count
+        scores: Dict[int, float] = defaultdict(float)
+
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (passage_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for passage_id, tf in postings.items():
+                length = self.passages[passage_id]["length"]
+                norm = tf + self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[passage_id] += idf * tf * (self.k1 + 1) / norm
+
+        top = heapq.nsmallest(k, scores.items(), key=lambda item: (-item[1], item[0]))
+        return [
+            {
+                "doc_id": self.passages[passage_id]["doc_id"],
+                "title": self.passages[passage_id]["title"],
+                "text": self.passages[passage_id]["text"],
+                "position": self.passages[passage_id]["position"],
+                "score": score,
+                "metadata": self.passages[passage_id]["metadata"]
+            }
+            for passage_id, score in top
+        ]
+
+
+def group_by_document(passages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Group ranked passages by document, ordered by each document's best passage score"""
+    documents: Dict[str, Dict[str, Any]] = {}
+    for passage in passages:
+        document = documents.get(passage["doc_id"])
+        if document is None:
+            document = {
+                "doc_id": passage["doc_id"],
+                "title": passage["title"],
+                "score": passage["score"],
+                "best_passage": passage["text"],
+                "passages": [],
+                "metadata": passage["metadata"]
+            }
+            documents[passage["doc_id"]] = document
+        document["passages"].append(passage)
+
+    for document in documents.values():
+        # Keep matched passages in reading order within a document
+        document["passages"].sort(key=lambda passage: passage["position"])
+        document["text"] = "\n\n".join(passage["text"] for passage in document["passages"] if passage["text"])
+
+    return sorted(documents.values(), key=lambda document: -document["score"])
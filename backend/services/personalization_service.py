@@ -1,18 +1,274 @@
+import asyncio
+import hashlib
+import json
+import logging
 import openai
 import os
-from typing import List, Dict, Any
+import re
+import time
+from collections import Counter
+from typing import List, Dict, Any, Optional
 from models.schemas import SearchResult
+from services.context_packer import count_tokens
+from services.http_client import http_pool
+from services.llm_scheduler import PRIORITY_BACKGROUND, PRIORITY_SEARCH, LLMQueueError, llm_scheduler
+from services.metrics import CACHE_REQUESTS, STAGE_SECONDS, record_upstream_error
+from services.single_flight import SingleFlight
+from services.tracing import background_task, span, traced
+from services.upstream_health import upstream_health
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FIELDS = ["interests", "expertise_areas", "research_focus", "keywords"]
+
+JSON_FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+# Stored profiles are rebuilt in the background, one task per user
+_profile_rebuilds: Dict[str, asyncio.Task] = {}
+
+# Identical in-flight LLM calls are shared across requests (services are created per request)
+_summary_flights = SingleFlight("page_summary")
+_analysis_flights = SingleFlight("personal_analysis")
+_query_flights = SingleFlight("personalized_queries")
+
+
+def parse_json_response(text: str) -> Any:
+    """Parse JSON from a model reply, tolerating code fences and surrounding prose"""
+    text = (text or "").strip()
+    fenced = JSON_FENCE_PATTERN.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        # Fall back to the outermost object or list in the reply
+        starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+        if not starts:
+            raise
+        start = min(starts)
+        end = text.rfind("}" if text[start] == "{" else "]")
+        return json.loads(text[start:end + 1])
 
 class PersonalizationService:
-    def __init__(self):
+    def __init__(self, storage_service=None):
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
-        self.client = openai.AsyncOpenAI(api_key=self.openai_api_key)
+        self.client = openai.AsyncOpenAI(
+            api_key=self.openai_api_key,
+            base_url=os.getenv("OPENAI_BASE_URL"),
+            http_client=http_pool.client("openai"),
+            # Failures and retries are handled by the upstream health layer
+            max_retries=0
+        )
+        self.storage_service = storage_service
+        self.summary_concurrency = int(os.getenv("PERSONALIZATION_SUMMARY_CONCURRENCY", "4"))
+        self.summary_max_chars = int(os.getenv("PERSONALIZATION_SUMMARY_MAX_CHARS", "6000"))
+        # Pages whose summary failed are retried after a backoff that doubles per failure
+        self.failure_backoff = float(os.getenv("PERSONALIZATION_SUMMARY_RETRY_SECONDS", "300"))
+        self.failure_backoff_max = float(os.getenv("PERSONALIZATION_SUMMARY_RETRY_MAX_SECONDS", "86400"))
+        # Page summaries are stored by content hash, so workers can coalesce them through Redis
+        if storage_service and _summary_flights.storage_service is None:
+            _summary_flights.storage_service = storage_service
+    
+    @staticmethod
+    def page_hash(page: Dict[str, Any]) -> str:
+        """Content hash identifying one version of a page"""
+        return hashlib.sha256(f"{page.get('title', '')}\n{page.get('content', '')}".encode()).hexdigest()
+    
+    @traced("personalization.summarize_page")
+    async def summarize_page(self, page: Dict[str, Any], priority: int = PRIORITY_SEARCH) -> Dict[str, Any]:
+        """Map step: extract interests and a short summary from a single page"""
+        summary_prompt = f"""
+        Analyze the following page from a personal knowledge base:
+
+        Page: {page.get("title", "")}
+        Content: {page.get("content", "")[:self.summary_max_chars]}
+
+        Please provide a JSON response with:
+        1. "interests": Main topics/subjects this page shows interest in
+        2. "expertise_areas": Specific domains where the author shows knowledge/experience
+        3. "research_focus": Research interests or learning goals on this page
+        4. "keywords": Important technical terms and concepts used
+        5. "summary": One or two sentences summarizing the page
+
+        Format as valid JSON only, no other text.
+        """
+        
+        async with llm_scheduler.slot(priority, count_tokens(summary_prompt) + 400):
+            response = await upstream_health.call("openai", lambda timeout: self.client.chat.completions.create(
+                model="gpt-4",
+                messages=[
+                    {"role": "system", "content": "You are an expert at analyzing personal knowledge bases and extracting user interests. Return only valid JSON."},
+                    {"role": "user", "content": summary_prompt}
+                ],
+                temperature=0.1,
+                max_tokens=400,
+                timeout=timeout
+            ), operation="json")
+        return parse_json_response(response.choices[0].message.content)
+    
+    async def summarize_pages(self, pages: Dict[str, Dict[str, Any]],
+                              priority: int = PRIORITY_SEARCH) -> Dict[str, Dict[str, Any]]:
+        """Summarize pages in parallel, reusing summaries cached by content hash.
+        
+        Pages whose summary failed recently are skipped until their backoff ends.
+        """
+        summaries = await self.storage_service.get_page_summaries(list(pages)) if self.storage_service else {}
+        backing_off = await self.failed_pages([page_hash for page_hash in pages if page_hash not in summaries])
+        missing = [page_hash for page_hash in pages if page_hash not in summaries and page_hash not in backing_off]
+        CACHE_REQUESTS.inc(len(pages) - len(missing), cache="page_summary", outcome="hit")
+        CACHE_REQUESTS.inc(len(missing), cache="page_summary", outcome="miss")
+        semaphore = asyncio.Semaphore(max(1, self.summary_concurrency))
+        
+        async def summarize(page_hash: str):
+            async with semaphore:
+                try:
+                    summaries[page_hash] = await _summary_flights.do(
+                        page_hash, lambda: self._summarize_and_store(page_hash, pages[page_hash], priority)
+                    )
+                except LLMQueueError as e:
+                    logger.warning("Summary of page %s not scheduled: %s", pages[page_hash].get('title'), e)
+                except Exception as e:
+                    logger.error("Error summarizing page %s: %s", pages[page_hash].get('title'), e)
+                    record_upstream_error("openai", e)
+        
+        if missing:
+            logger.debug("Summarizing %s new or changed pages (%s cached)", len(missing), len(pages) - len(missing))
+            await asyncio.gather(*(summarize(page_hash) for page_hash in missing))
+        return summaries
+    
+    async def failed_pages(self, page_hashes: List[str]) -> set:
+        """Page hashes whose last summary attempt failed and are still backing off"""
+        if not self.storage_service:
+            return set()
+        failures = await self.storage_service.get_page_summary_failures(page_hashes)
+        now = time.time()
+        return {page_hash for page_hash, failure in failures.items() if failure.get("retry_at", 0) > now}
+    
+    async def _record_failure(self, page_hash: str):
+        if not self.storage_service:
+            return
+        previous = (await self.storage_service.get_page_summary_failures([page_hash])).get(page_hash, {})
+        attempts = previous.get("attempts", 0) + 1
+        backoff = min(self.failure_backoff_max, self.failure_backoff * 2 ** (attempts - 1))
+        # Keep the record past its retry time so the attempt count keeps growing the backoff
+        await self.storage_service.store_page_summary_failure(
+            page_hash, {"attempts": attempts, "retry_at": time.time() + backoff}, ttl=int(backoff * 2) + 1
+        )
+    
+    async def _summarize_and_store(self, page_hash: str, page: Dict[str, Any], priority: int) -> Dict[str, Any]:
+        # Another worker may have stored this summary while we waited for its lock
+        if self.storage_service:
+            cached = await self.storage_service.get_page_summaries([page_hash])
+            if page_hash in cached:
+                return cached[page_hash]
+        
+        try:
+            summary = await self.summarize_page(page, priority)
+        except LLMQueueError:
+            # Load shedding, not a problem with the page: retry on the next build
+            raise
+        except Exception:
+            # Recorded here rather than per caller: concurrent callers share this flight
+            await self._record_failure(page_hash)
+            raise
+        if self.storage_service:
+            await self.storage_service.store_page_summary(page_hash, summary)
+            await self.storage_service.delete_page_summary_failure(page_hash)
+        return summary
+    
+    def merge_summaries(self, summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Reduce step: combine per-page summaries into one profile, most common terms first"""
+        profile: Dict[str, Any] = {}
+        for field in PROFILE_FIELDS:
+            counts = Counter()
+            display = {}
+            for summary in summaries:
+                values = summary.get(field) or []
+                if isinstance(values, str):
+                    values = [values]
+                for value in values:
+                    key = str(value).strip().lower()
+                    if key:
+                        counts[key] += 1
+                        display.setdefault(key, str(value).strip())
+            profile[field] = [display[key] for key, _ in counts.most_common(15)]
+        
+        profile["context_summary"] = " ".join(
+            summary.get("summary", "") for summary in summaries if summary.get("summary")
+        )[:1500]
+        return profile
+    
+    async def build_profile(self, notion_pages: List[Dict[str, Any]], priority: int = PRIORITY_SEARCH) -> Dict[str, Any]:
+        """Build a profile by summarizing each page separately and merging the summaries.
+
+        The fingerprint covers the pages that were summarized and those whose
+        summary failed and is backing off, so the profile is rebuilt (and the
+        failed pages retried) once a backoff ends, not on every call.
+        """
+        pages = {self.page_hash(page): page for page in notion_pages}
+        summaries = await self.summarize_pages(pages, priority)
+        summarized = sorted(h for h in pages if h in summaries)
+        backing_off = await self.failed_pages([h for h in pages if h not in summaries])
+        profile = self.merge_summaries([summaries[h] for h in summarized])
+        return {
+            "fingerprint": hashlib.sha256("".join(sorted(set(summarized) | backing_off)).encode()).hexdigest(),
+            "profile": profile,
+            "page_count": len(pages),
+            "summarized_count": len(summarized),
+            "updated_at": time.time()
+        }
+    
+    async def get_personal_profile(self, user_id: str, notion_pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Get the user's stored profile, rebuilding only the pages that changed.
+
+        A stale stored profile is served as-is while it is rebuilt in the background;
+        the map-reduce runs inline only when the user has no profile yet.
+        """
+        if not notion_pages:
+            return {"interests": [], "expertise_areas": [], "research_focus": [], "keywords": [], "context_summary": ""}
+        
+        fingerprint = self.profile_fingerprint(notion_pages)
+        stored = await self.storage_service.get_personal_profile(user_id) if self.storage_service else None
+        if stored and stored.get("fingerprint") == fingerprint:
+            return stored["profile"]
+        
+        if stored:
+            self.schedule_profile_rebuild(user_id, notion_pages)
+            return stored["profile"]
+        
+        built = await self.build_profile(notion_pages)
+        if self.storage_service:
+            await self.storage_service.store_personal_profile(user_id, built)
+        return built["profile"]
+    
+    def schedule_profile_rebuild(self, user_id: str, notion_pages: List[Dict[str, Any]]) -> asyncio.Task:
+        """Rebuild a user's profile in the background unless a rebuild is already running"""
+        task = _profile_rebuilds.get(user_id)
+        if task and not task.done():
+            return task
+        
+        async def rebuild():
+            try:
+                # Nobody is waiting on a rebuild, so it yields to interactive LLM calls
+                built = await self.build_profile(notion_pages, PRIORITY_BACKGROUND)
+                if self.storage_service:
+                    await self.storage_service.store_personal_profile(user_id, built)
+            except Exception as e:
+                logger.error("Background profile rebuild failed for %s: %s", user_id, e)
+        
+        task = background_task(rebuild(), "personalization.profile_rebuild")
+        _profile_rebuilds[user_id] = task
+        return task
     
     async def analyze_personal_knowledge(self, notion_pages: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Analyze user's Notion content to extract interests, expertise, and focus areas"""
         if not notion_pages:
             return {"interests": [], "expertise_areas": [], "research_focus": []}
         
+        key = self.profile_fingerprint(notion_pages)
+        return await _analysis_flights.do(key, lambda: self._analyze_personal_knowledge(notion_pages))
+    
+    async def _analyze_personal_knowledge(self, notion_pages: List[Dict[str, Any]]) -> Dict[str, Any]:
         # Combine all Notion content for analysis
         combined_content = ""
         for page in notion_pages:
@@ -37,22 +293,27 @@ class PersonalizationService:
         """
         
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are an expert at analyzing personal knowledge bases and extracting user interests. Return only valid JSON."},
-                    {"role": "user", "content": analysis_prompt}
-                ],
-                temperature=0.1,
-                max_tokens=800
-            )
+            async with llm_scheduler.slot(PRIORITY_SEARCH, count_tokens(analysis_prompt) + 800):
+                response = await upstream_health.call("openai", lambda timeout: self.client.chat.completions.create(
+                    model="gpt-4",
+                    messages=[
+                        {"role": "system", "content": "You are an expert at analyzing personal knowledge bases and extracting user interests. Return only valid JSON."},
+                        {"role": "user", "content": analysis_prompt}
+                    ],
+                    temperature=0.1,
+                    max_tokens=800,
+                    timeout=timeout
+                ), operation="json")
             
-            import json
-            analysis = json.loads(response.choices[0].message.content)
+            analysis = parse_json_response(response.choices[0].message.content)
             return analysis
             
+        except LLMQueueError as e:
+            logger.warning("Personal knowledge analysis not scheduled: %s", e)
+            return {"interests": [], "expertise_areas": [], "research_focus": [], "keywords": [], "context_summary": ""}
         except Exception as e:
-            print(f"Error analyzing personal knowledge: {e}")
+            logger.error("Error analyzing personal knowledge: %s", e)
+            record_upstream_error("openai", e)
             return {"interests": [], "expertise_areas": [], "research_focus": [], "keywords": [], "context_summary": ""}
     
     async def generate_personalized_search_queries(self, user_query: str, personal_analysis: Dict[str, Any]) -> List[str]:
@@ -61,6 +322,12 @@ class PersonalizationService:
         if not personal_analysis.get("interests"):
             return [user_query]  # Fallback to original query
         
+        key = hashlib.sha256(f"{user_query}\n{json.dumps(personal_analysis, sort_keys=True)}".encode()).hexdigest()
+        return list(await _query_flights.do(
+            key, lambda: self._generate_personalized_search_queries(user_query, personal_analysis)
+        ))
+    
+    async def _generate_personalized_search_queries(self, user_query: str, personal_analysis: Dict[str, Any]) -> List[str]:
         query_generation_prompt = f"""
         USER'S PERSONAL KNOWLEDGE PROFILE:
         - Interests: {personal_analysis.get('interests', [])}
@@ -84,43 +351,75 @@ class PersonalizationService:
         """
         
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are an expert at generating personalized search queries. Return only valid JSON."},
-                    {"role": "user", "content": query_generation_prompt}
-                ],
-                temperature=0.2,
-                max_tokens=400
-            )
+            async with llm_scheduler.slot(PRIORITY_SEARCH, count_tokens(query_generation_prompt) + 400):
+                response = await upstream_health.call("openai", lambda timeout: self.client.chat.completions.create(
+                    model="gpt-4",
+                    messages=[
+                        {"role": "system", "content": "You are an expert at generating personalized search queries. Return only valid JSON."},
+                        {"role": "user", "content": query_generation_prompt}
+                    ],
+                    temperature=0.2,
+                    max_tokens=400,
+                    timeout=timeout
+                ), operation="json")
             
-            import json
-            queries = json.loads(response.choices[0].message.content)
+            queries = parse_json_response(response.choices[0].message.content)
             return queries if isinstance(queries, list) else [user_query]
             
+        except LLMQueueError as e:
+            logger.warning("Personalized queries not scheduled: %s", e)
+            return [user_query]
         except Exception as e:
-            print(f"Error generating personalized queries: {e}")
+            logger.error("Error generating personalized queries: %s", e)
+            record_upstream_error("openai", e)
             return [user_query]
     
-    async def create_personalized_search_strategy(self, user_query: str, notion_results: List[SearchResult]) -> Dict[str, Any]:
+    @classmethod
+    def profile_fingerprint(cls, notion_pages: List[Dict[str, Any]]) -> str:
+        """Identifies the set of page versions a profile was built from"""
+        return hashlib.sha256("".join(sorted({cls.page_hash(page) for page in notion_pages})).encode()).hexdigest()
+    
+    @staticmethod
+    def pages_from_results(notion_results: List[SearchResult]) -> List[Dict[str, Any]]:
+        """Convert SearchResult objects to dict format for analysis"""
+        return [
+            {"title": result.title, "content": result.content, "snippet": result.snippet}
+            for result in notion_results
+        ]
+    
+    async def refresh_profile(self, user_id: str, notion_results: List[SearchResult]) -> bool:
+        """Rebuild the stored profile if the pages changed; used to pre-warm it off the request path"""
+        notion_pages = self.pages_from_results(notion_results)
+        if not notion_pages or not self.storage_service:
+            return False
+        
+        fingerprint = self.profile_fingerprint(notion_pages)
+        stored = await self.storage_service.get_personal_profile(user_id)
+        if stored and stored.get("fingerprint") == fingerprint:
+            return False
+        
+        built = await self.build_profile(notion_pages, PRIORITY_BACKGROUND)
+        await self.storage_service.store_personal_profile(user_id, built)
+        return True
+    
+    async def create_personalized_search_strategy(self, user_query: str, notion_results: List[SearchResult],
+                                                  user_id: Optional[str] = None) -> Dict[str, Any]:
         """Create a complete personalized search strategy"""
         
-        # Convert SearchResult objects to dict format for analysis
-        notion_pages = []
-        for result in notion_results:
-            notion_pages.append({
-                "title": result.title,
-                "content": result.content,
-                "snippet": result.snippet
-            })
+        notion_pages = self.pages_from_results(notion_results)
         
-        # Step 1: Analyze personal knowledge
-        personal_analysis = await self.analyze_personal_knowledge(notion_pages)
-        print(f"DEBUG: Personal analysis: {personal_analysis}")
+        # Step 1: Analyze personal knowledge (stored per user when we know who is asking)
+        with STAGE_SECONDS.time(stage="personalization_analysis"), span("personalization.analysis"):
+            if user_id and self.storage_service:
+                personal_analysis = await self.get_personal_profile(user_id, notion_pages)
+            else:
+                personal_analysis = await self.analyze_personal_knowledge(notion_pages)
+        logger.debug("Personal analysis: %s", personal_analysis)
         
         # Step 2: Generate personalized search queries
-        personalized_queries = await self.generate_personalized_search_queries(user_query, personal_analysis)
-        print(f"DEBUG: Generated personalized queries: {personalized_queries}")
+        with STAGE_SECONDS.time(stage="query_generation"), span("personalization.query_generation"):
+            personalized_queries = await self.generate_personalized_search_queries(user_query, personal_analysis)
+        logger.debug("Generated personalized queries: %s", personalized_queries)
         
         return {
             "original_query": user_query,
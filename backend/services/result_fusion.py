@@ -0,0 +1,78 @@
+from typing import Dict, List
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from models.schemas import SearchResult
+
+# Query parameters that only identify where a click came from
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid",
+    "ref", "ref_src", "ref_url", "spm", "_hsenc", "_hsmi", "vero_id"
+}
+TRACKING_PREFIXES = ("utm_",)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonical_url(url: str) -> str:
+    """Canonical form of a URL used to detect the same page returned under different spellings.
+
+    Lowercases the scheme and host, treats http and https as the same, drops
+    "www.", default ports, fragments, tracking parameters and trailing slashes,
+    and sorts the remaining query parameters.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url.strip()
+    if not parts.netloc:
+        return url.strip()
+
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    )
+    path = parts.path.rstrip("/")
+    return urlunsplit(("https" if scheme in DEFAULT_PORTS else scheme, host, path, urlencode(query), ""))
+
+
+def _merge(kept: SearchResult, duplicate: SearchResult) -> SearchResult:
+    """Fill in what the kept copy of a page is missing from a duplicate"""
+    updates = {}
+    if len(duplicate.content or "") > len(kept.content or ""):
+        updates["content"] = duplicate.content
+    for field in ("snippet", "image_url", "favicon_url"):
+        if not getattr(kept, field) and getattr(duplicate, field):
+            updates[field] = getattr(duplicate, field)
+    return kept.model_copy(update=updates) if updates else kept
+
+
+def reciprocal_rank_fusion(rankings: List[List[SearchResult]], k: int = 60) -> List[SearchResult]:
+    """Merge several ranked result lists into one, deduplicated by canonical URL.
+
+    Each page scores sum(1 / (k + rank)) over the lists it appears in, so pages
+    returned by several queries rise to the top regardless of which query ran
+    first. Ties keep first-seen order.
+    """
+    scores: Dict[str, float] = {}
+    merged: Dict[str, SearchResult] = {}
+
+    for ranking in rankings:
+        seen_in_ranking = set()
+        for rank, result in enumerate(ranking, start=1):
+            key = canonical_url(result.url)
+            # A page listed twice by one query only counts once for that query
+            if key in seen_in_ranking:
+                continue
+            seen_in_ranking.add(key)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            merged[key] = _merge(merged[key], result) if key in merged else result
+
+    order = {key: position for position, key in enumerate(merged)}
+    return [merged[key] for key in sorted(merged, key=lambda key: (-scores[key], order[key]))]
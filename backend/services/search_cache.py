@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from models.schemas import SearchResult
+from services.metrics import CACHE_REQUESTS
+from services.tracing import background_task
+
+logger = logging.getLogger(__name__)
+
+# Stats keys -> farfalle_cache_requests_total outcome labels
+METRIC_OUTCOMES = {"hits": "hit", "stale_hits": "stale_hit", "misses": "miss"}
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so trivially different spellings share a cache entry"""
+    query = re.sub(r"\s+", " ", query.lower()).strip()
+    return query.strip(" ?!.,;:\"'")
+
+
+class SearchCache:
+    """Web search result cache: in-process LRU backed by Redis.
+
+    Entries are fresh for `ttl` seconds; after that they are still served for
+    up to `stale_ttl` more seconds while a background refresh fetches new
+    results (stale-while-revalidate).
+    """
+
+    def __init__(self, storage_service=None):
+        self.storage_service = storage_service
+        self.max_entries = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1000"))
+        self.ttl = float(os.getenv("SEARCH_CACHE_TTL", "600"))
+        self.stale_ttl = float(os.getenv("SEARCH_CACHE_STALE_TTL", "3600"))
+        self.enabled = os.getenv("SEARCH_CACHE_ENABLED", "true").lower() == "true"
+        self._entries: "OrderedDict[str, Tuple[float, List[SearchResult]]]" = OrderedDict()
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def key(self, provider: str, query: str, count: int) -> str:
+        digest = hashlib.sha1(normalize_query(query).encode()).hexdigest()
+        return f"search_cache:{provider}:{count}:{digest}"
+
+    def _count(self, provider: str, outcome: str):
+        stats = self._stats.setdefault(provider, {})
+        stats[outcome] = stats.get(outcome, 0) + 1
+        if outcome in METRIC_OUTCOMES:
+            CACHE_REQUESTS.inc(cache=f"search_{provider}", outcome=METRIC_OUTCOMES[outcome])
+
+    def _remember(self, key: str, stored_at: float, results: List[SearchResult]):
+        self._entries[key] = (stored_at, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _lookup(self, key: str) -> Optional[Tuple[float, List[SearchResult]]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+
+        if self.storage_service:
+            cached = await self.storage_service.get_cached_search(key)
+            if cached:
+                entry = (cached["stored_at"], [SearchResult(**result) for result in cached["results"]])
+                self._remember(key, *entry)
+                return entry
+        return None
+
+    async def _store(self, key: str, results: List[SearchResult]):
+        stored_at = time.time()
+        self._remember(key, stored_at, results)
+        if self.storage_service:
+            await self.storage_service.store_cached_search(key, {
+                "stored_at": stored_at,
+                "results": [result.model_dump() for result in results]
+            }, ttl=int(self.ttl + self.stale_ttl))
+
+    def _refresh(self, provider: str, key: str, fetch: Callable[[], Awaitable[List[SearchResult]]]):
+        task = self._refreshing.get(key)
+        if task and not task.done():
+            return
+
+        async def refresh():
+            try:
+                results = await fetch()
+                if results:
+                    await self._store(key, results)
+                self._count(provider, "refreshes")
+            except Exception as e:
+                self._count(provider, "refresh_errors")
+                logger.error("Search cache refresh failed for %s: %s", key, e)
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = background_task(refresh(), "search_cache.refresh")
+
+    async def get_or_fetch(self, provider: str, query: str, count: int,
+                           fetch: Callable[[], Awaitable[List[SearchResult]]]) -> List[SearchResult]:
+        """Serve results from the cache, calling `fetch` on a miss (empty results are not cached)"""
+        if not self.enabled:
+            return await fetch()
+
+        key = self.key(provider, query, count)
+        entry = await self._lookup(key)
+        if entry is not None:
+            age = time.time() - entry[0]
+            if age <= self.ttl:
+                self._count(provider, "hits")
+                return entry[1]
+            if age <= self.ttl + self.stale_ttl:
+                self._count(provider, "stale_hits")
+                self._refresh(provider, key, fetch)
+                return entry[1]
+
+        self._count(provider, "misses")
+        results = await fetch()
+        if results:
+            await self._store(key, results)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        providers = {}
+        for provider, stats in self._stats.items():
+            hits = stats.get("hits", 0) + stats.get("stale_hits", 0)
+            lookups = hits + stats.get("misses", 0)
+            providers[provider] = {**stats, "hit_ratio": hits / lookups if lookups else None}
+
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "refreshing": len(self._refreshing),
+            "providers": providers
+        }
@@ -1,19 +1,59 @@
-import httpx
+import asyncio
+import hashlib
+import logging
 import os
-from typing import List, Dict, Any, Optional
+import time
+from typing import List, Dict, Any, AsyncIterator, Tuple
 from models.schemas import SearchResult
+from services.http_client import http_pool
+from services.latency_tracker import latency_tracker
+from services.metrics import SEARCH_PROVIDER_SECONDS, STAGE_SECONDS, record_upstream_error
+from services.passage_index import group_by_document
+from services.result_fusion import canonical_url, reciprocal_rank_fusion
+from services.search_cache import SearchCache, normalize_query
+from services.single_flight import SingleFlight
+from services.tracing import span, start_span
+from services.upstream_health import upstream_health
+
+logger = logging.getLogger(__name__)
 
 class SearchService:
-    def __init__(self):
+    def __init__(self, storage_service=None):
         self.brave_api_key = os.getenv("BRAVE_API_KEY")
         self.exa_api_key = os.getenv("EXA_API_KEY")
+        # Overridable so benchmarks can point the service at local stand-ins
+        self.brave_base_url = os.getenv("BRAVE_BASE_URL", "https://api.search.brave.com/res/v1")
+        self.exa_base_url = os.getenv("EXA_BASE_URL", "https://api.exa.ai")
+        # Personalized queries are searched concurrently, bounded by these limits
+        self.fanout_concurrency = int(os.getenv("SEARCH_FANOUT_CONCURRENCY", "4"))
+        self.query_timeout = float(os.getenv("SEARCH_QUERY_TIMEOUT", "8"))
+        # Hedged search: start Exa if Brave has not answered within its learned p95
+        self.hedging_enabled = os.getenv("SEARCH_HEDGING", "true").lower() == "true"
+        self.hedge_default_delay = float(os.getenv("SEARCH_HEDGE_DEFAULT_DELAY", "1.5"))
+        self.hedge_min_delay = float(os.getenv("SEARCH_HEDGE_MIN_DELAY", "0.2"))
+        self.hedge_min_samples = int(os.getenv("SEARCH_HEDGE_MIN_SAMPLES", "20"))
+        # Number of BM25 passages taken from the user's Notion corpus per query
+        self.notion_passage_top_k = int(os.getenv("NOTION_PASSAGE_TOP_K", "8"))
+        # Reciprocal-rank fusion constant for merging multi-query results
+        self.rrf_k = int(os.getenv("SEARCH_RRF_K", "60"))
+        self.cache = SearchCache(storage_service)
+        # Identical concurrent searches (here or, via a Redis lock, on other workers) share one upstream call
+        self.single_flight = SingleFlight("search", storage_service)
         
     async def search_brave(self, query: str, count: int = 10) -> List[SearchResult]:
-        """Search using Brave Search API"""
+        """Search using Brave Search API (cached)"""
+        return await self.cache.get_or_fetch("brave", query, count, lambda: self._timed_fetch("brave", query, count))
+    
+    async def search_exa(self, query: str, count: int = 10) -> List[SearchResult]:
+        """Search using Exa API (cached)"""
+        return await self.cache.get_or_fetch("exa", query, count, lambda: self._timed_fetch("exa", query, count))
+    
+    async def _fetch_brave(self, query: str, count: int = 10) -> List[SearchResult]:
+        """Call the Brave Search API"""
         if not self.brave_api_key:
             return []
             
-        url = "https://api.search.brave.com/res/v1/web/search"
+        url = f"{self.brave_base_url}/web/search"
         headers = {
             "Accept": "application/json",
             "Accept-Encoding": "gzip",
@@ -28,42 +68,47 @@ class SearchService:
             "safesearch": "moderate"
         }
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(url, headers=headers, params=params, timeout=10.0)
-                response.raise_for_status()
-                data = response.json()
+        client = http_pool.client("brave")
+        try:
+            response = await upstream_health.call(
+                "brave",
+                lambda timeout: client.get(url, headers=headers, params=params, timeout=timeout),
+                idempotent=True
+            )
+            response.raise_for_status()
+            data = response.json()
                 
-                results = []
-                for item in data.get("web", {}).get("results", []):
-                    # Extract image URL if available
-                    image_url = None
-                    if "thumbnail" in item and item["thumbnail"] and "src" in item["thumbnail"]:
-                        image_url = item["thumbnail"]["src"]
+            results = []
+            for item in data.get("web", {}).get("results", []):
+                # Extract image URL if available
+                image_url = None
+                if "thumbnail" in item and item["thumbnail"] and "src" in item["thumbnail"]:
+                    image_url = item["thumbnail"]["src"]
                     
-                    # Extract favicon
-                    favicon_url = item.get("profile", {}).get("img") if "profile" in item else None
+                # Extract favicon
+                favicon_url = item.get("profile", {}).get("img") if "profile" in item else None
                     
-                    results.append(SearchResult(
-                        title=item.get("title", ""),
-                        url=item.get("url", ""),
-                        content=item.get("description", ""),
-                        snippet=item.get("description", ""),
-                        source="web",
-                        image_url=image_url,
-                        favicon_url=favicon_url
-                    ))
-                return results
-            except Exception as e:
-                print(f"Brave search error: {e}")
-                return []
+                results.append(SearchResult(
+                    title=item.get("title", ""),
+                    url=item.get("url", ""),
+                    content=item.get("description", ""),
+                    snippet=item.get("description", ""),
+                    source="web",
+                    image_url=image_url,
+                    favicon_url=favicon_url
+                ))
+            return results
+        except Exception as e:
+            logger.error("Brave search error: %s", e)
+            record_upstream_error("brave", e)
+            return []
     
-    async def search_exa(self, query: str, count: int = 10) -> List[SearchResult]:
-        """Search using Exa API"""
+    async def _fetch_exa(self, query: str, count: int = 10) -> List[SearchResult]:
+        """Call the Exa search API"""
         if not self.exa_api_key:
             return []
             
-        url = "https://api.exa.ai/search"
+        url = f"{self.exa_base_url}/search"
         headers = {
             "accept": "application/json",
             "content-type": "application/json",
@@ -78,122 +123,258 @@ class SearchService:
             "type": "neural"
         }
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(url, headers=headers, json=payload, timeout=10.0)
-                response.raise_for_status()
-                data = response.json()
+        client = http_pool.client("exa")
+        try:
+            # A read-only search, so safe to retry despite being a POST
+            response = await upstream_health.call(
+                "exa",
+                lambda timeout: client.post(url, headers=headers, json=payload, timeout=timeout),
+                idempotent=True
+            )
+            response.raise_for_status()
+            data = response.json()
                 
-                results = []
-                for item in data.get("results", []):
-                    text_content = item.get("text", "") or item.get("snippet", "") or ""
+            results = []
+            for item in data.get("results", []):
+                text_content = item.get("text", "") or item.get("snippet", "") or ""
                     
-                    # Extract favicon from URL domain
-                    url = item.get("url", "")
-                    favicon_url = None
-                    if url:
-                        from urllib.parse import urlparse
-                        domain = urlparse(url).netloc
-                        favicon_url = f"https://{domain}/favicon.ico"
+                # Extract favicon from URL domain
+                url = item.get("url", "")
+                favicon_url = None
+                if url:
+                    from urllib.parse import urlparse
+                    domain = urlparse(url).netloc
+                    favicon_url = f"https://{domain}/favicon.ico"
                     
-                    results.append(SearchResult(
-                        title=item.get("title", ""),
-                        url=url,
-                        content=text_content[:500] + "..." if len(text_content) > 500 else text_content,
-                        snippet=text_content[:200] + "..." if len(text_content) > 200 else text_content,
-                        source="web",
-                        image_url=None,  # Exa doesn't typically return images
-                        favicon_url=favicon_url
-                    ))
-                return results
-            except Exception as e:
-                print(f"Exa search error: {e}")
-                return []
+                results.append(SearchResult(
+                    title=item.get("title", ""),
+                    url=url,
+                    content=text_content[:500] + "..." if len(text_content) > 500 else text_content,
+                    snippet=text_content[:200] + "..." if len(text_content) > 200 else text_content,
+                    source="web",
+                    image_url=None,  # Exa doesn't typically return images
+                    favicon_url=favicon_url
+                ))
+            return results
+        except Exception as e:
+            logger.error("Exa search error: %s", e)
+            record_upstream_error("exa", e)
+            return []
     
     async def search_with_personal_content(self, query: str, count: int = 10, 
                                           notion_service=None, storage_service=None, 
-                                          user_id: str = "default_user") -> Dict[str, Any]:
+                                          user_id: str = "default_user", notion_index=None) -> Dict[str, Any]:
         """Proactive personalized search: analyze Notion content first, then search strategically"""
+        final = {}
+        async for event, data in self.stream_personal_content(
+            query, count, notion_service, storage_service, user_id, notion_index
+        ):
+            if event == "results":
+                final = data
+        return final
+    
+    async def stream_personal_content(self, query: str, count: int = 10,
+                                      notion_service=None, storage_service=None,
+                                      user_id: str = "default_user",
+                                      notion_index=None) -> AsyncIterator[Tuple[str, Any]]:
+        """Personalized search as (event, data) pairs, emitted as each stage completes.
+        
+        Events: "notion" (matching Notion pages), "strategy" (the personalized
+        search strategy), "web" (one per personalized query, in completion
+        order) and finally "results" (the combined response).
+        """
         
         # Step 1: Get user's personal knowledge from Notion
         notion_results = []
+        notion_passages = []
+        notion_started_at = time.perf_counter()
         if notion_service and storage_service:
             try:
                 token_data = await storage_service.get_notion_token(user_id)
                 if token_data and token_data.get("access_token"):
-                    print(f"DEBUG: Getting ALL user's Notion content for analysis")
-                    # Get ALL accessible pages for analysis, not just query matches
-                    all_pages = await notion_service.get_all_accessible_pages(token_data["access_token"], limit=20)
+                    logger.debug("Getting ALL user's Notion content for analysis")
+                    # Read the incrementally synced corpus instead of calling Notion per page
+                    if notion_index is None:
+                        from .notion_index import NotionIndex
+                        notion_index = NotionIndex(notion_service, storage_service)
+                    with span("notion.corpus"):
+                        pages = await notion_index.get_pages(user_id, token_data["access_token"])
+                    with span("notion.passage_search"):
+                        notion_passages = notion_index.passage_index(user_id, pages).search(query, self.notion_passage_top_k)
                     
                     # Convert pages to SearchResult format for analysis
-                    for page in all_pages:
-                        try:
-                            page_id = page["id"]
-                            page_title = notion_service.get_page_title(page)
-                            content_data = await notion_service.get_page_content(token_data["access_token"], page_id)
-                            content_text = notion_service.extract_text_from_blocks(content_data.get("results", []))
-                            
-                            result = SearchResult(
-                                title=f"📄 {page_title.strip()}",
-                                url=page.get("url", f"https://notion.so/{page_id}"),
-                                content=content_text if content_text.strip() else f"Content from Notion page: {page_title}",
-                                snippet=content_text[:200] if content_text.strip() else f"Your personal Notion page: {page_title}",
-                                source="notion"
-                            )
-                            notion_results.append(result)
-                        except Exception as e:
-                            print(f"Error processing page {page.get('id')}: {e}")
-                            continue
+                    notion_results = notion_index.profile_results(pages)
                     
-                    print(f"DEBUG: Loaded {len(notion_results)} Notion pages for personalization")
+                    logger.debug("Loaded %s Notion pages for personalization", len(notion_results))
             except Exception as e:
-                print(f"Error getting Notion content: {e}")
+                logger.error("Error getting Notion content: %s", e)
         
-        # Step 2: Use personalization service to create search strategy
-        from .personalization_service import PersonalizationService
-        personalization_service = PersonalizationService()
+        # Step 2: Keep only the Notion pages whose passages match the original query (BM25)
+        relevant_notion_results = []
+        for document in group_by_document(notion_passages):
+            relevant_notion_results.append(SearchResult(
+                title=f"📄 {document['title'].strip()}",
+                url=document["metadata"].get("url", f"https://notion.so/{document['doc_id']}"),
+                content=document["text"] or f"Content from Notion page: {document['title']}",
+                snippet=document["best_passage"][:200] or f"Your personal Notion page: {document['title']}",
+                source="notion"
+            ))
         
-        search_strategy = await personalization_service.create_personalized_search_strategy(
-            query, notion_results
-        )
+        logger.debug("Found %s relevant Notion results", len(relevant_notion_results))
+        STAGE_SECONDS.observe(time.perf_counter() - notion_started_at, stage="notion_corpus")
+        yield "notion", relevant_notion_results
         
-        # Step 3: Execute personalized searches
-        all_web_results = []
-        personalized_queries = search_strategy.get("personalized_queries", [query])
+        # Step 3: Use personalization service to create search strategy
+        from .personalization_service import PersonalizationService
+        personalization_service = PersonalizationService(storage_service)
         
-        print(f"DEBUG: Executing {len(personalized_queries)} personalized searches")
-        for pq in personalized_queries:
-            print(f"DEBUG: Searching for: '{pq}'")
-            results = await self.search(pq, max(2, count // len(personalized_queries)))
-            all_web_results.extend(results)
+        with span("personalization.strategy"):
+            search_strategy = await personalization_service.create_personalized_search_strategy(
+                query, notion_results, user_id=user_id
+            )
+        yield "strategy", search_strategy
         
-        # Step 4: Filter Notion results based on relevance to the original query
-        relevant_notion_results = []
-        query_lower = query.lower()
-        for notion_result in notion_results:
-            full_text = f"{notion_result.title} {notion_result.content}".lower()
-            if any(word in full_text for word in query_lower.split()) or len(query_lower) > 20:
-                relevant_notion_results.append(notion_result)
+        # Step 4: Execute personalized searches, emitting each as it completes
+        personalized_queries = search_strategy.get("personalized_queries", [query])
+        web_results_by_query: List[List[SearchResult]] = [[] for _ in personalized_queries]
         
-        print(f"DEBUG: Found {len(relevant_notion_results)} relevant Notion results")
+        logger.debug("Executing %s personalized searches", len(personalized_queries))
+        per_query_count = max(2, count // len(personalized_queries))
+        web_started_at = time.perf_counter()
+        async for index, results in self.iter_search_many(personalized_queries, per_query_count):
+            web_results_by_query[index] = results
+            yield "web", {"query": personalized_queries[index], "results": results}
+        STAGE_SECONDS.observe(time.perf_counter() - web_started_at, stage="web_search")
         
-        # Step 5: Combine and prioritize results
+        # Step 5: Deduplicate by canonical URL, rank web results by reciprocal-rank
+        # fusion across queries and put the user's Notion pages first
+        with STAGE_SECONDS.time(stage="fusion"), span("fusion"):
+            notion_urls = {canonical_url(result.url) for result in relevant_notion_results}
+            all_web_results = [
+                result for result in reciprocal_rank_fusion(web_results_by_query, self.rrf_k)
+                if canonical_url(result.url) not in notion_urls
+            ]
         final_results = relevant_notion_results + all_web_results[:count-len(relevant_notion_results)]
         
-        return {
+        yield "results", {
             "results": final_results[:count],
             "search_strategy": search_strategy,
             "notion_results_count": len(relevant_notion_results),
             "web_results_count": len(all_web_results)
         }
     
+    async def search_many(self, queries: List[str], count: int = 10) -> List[List[SearchResult]]:
+        """Run several searches concurrently, returning results in the same order as queries"""
+        ordered: List[List[SearchResult]] = [[] for _ in queries]
+        async for index, results in self.iter_search_many(queries, count):
+            ordered[index] = results
+        return ordered
+    
+    async def iter_search_many(self, queries: List[str], count: int = 10) -> AsyncIterator[Tuple[int, List[SearchResult]]]:
+        """Run several searches concurrently, yielding (query index, results) as each completes"""
+        semaphore = asyncio.Semaphore(max(1, self.fanout_concurrency))
+        # Not made current: the span stays open across the yields to the consumer
+        fanout_span = start_span("web_search", queries=len(queries))
+        
+        async def run_query(index: int, pq: str) -> Tuple[int, List[SearchResult]]:
+            async with semaphore:
+                logger.debug("Searching for: '%s'", pq)
+                try:
+                    with span("web_query", parent=fanout_span, query=pq):
+                        return index, await asyncio.wait_for(self.search(pq, count), timeout=self.query_timeout)
+                except asyncio.TimeoutError:
+                    logger.warning("Search for '%s' exceeded %ss deadline", pq, self.query_timeout)
+                    return index, []
+                except Exception as e:
+                    logger.error("Search error for '%s': %s", pq, e)
+                    return index, []
+        
+        tasks = [asyncio.create_task(run_query(index, pq)) for index, pq in enumerate(queries)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # The consumer went away (e.g. a closed stream): stop outstanding searches
+            for task in tasks:
+                task.cancel()
+            if fanout_span:
+                fanout_span.finish()
+    
+    async def _timed_fetch(self, provider: str, query: str, count: int) -> List[SearchResult]:
+        """Call one provider's API and record its latency"""
+        search_fn = self._fetch_brave if provider == "brave" else self._fetch_exa
+        started_at = time.perf_counter()
+        try:
+            with span(f"search.{provider}", query=query):
+                results = await search_fn(query, count)
+        except asyncio.CancelledError:
+            # A cancelled hedge loser took at least this long; keep it so p95 is not biased low
+            latency_tracker.observe(provider, time.perf_counter() - started_at, "cancelled")
+            SEARCH_PROVIDER_SECONDS.observe(time.perf_counter() - started_at, provider=provider, outcome="cancelled")
+            raise
+        outcome = "ok" if results else "empty"
+        latency_tracker.observe(provider, time.perf_counter() - started_at, outcome)
+        SEARCH_PROVIDER_SECONDS.observe(time.perf_counter() - started_at, provider=provider, outcome=outcome)
+        return results
+    
+    def hedge_delay(self) -> float:
+        """How long to wait for Brave before also asking Exa"""
+        p95 = latency_tracker.percentile("brave", 0.95, min_samples=self.hedge_min_samples)
+        if p95 is None:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, p95)
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss statistics for the web search result cache and request coalescing"""
+        return {**self.cache.stats(), "single_flight": self.single_flight.stats()}
+    
+    def provider_latency(self) -> Dict[str, Any]:
+        """Latency histograms for the search providers plus the current hedge delay"""
+        return {
+            "hedging_enabled": self.hedging_enabled,
+            "hedge_delay": self.hedge_delay(),
+            "providers": latency_tracker.snapshot(["brave", "exa"])
+        }
+    
     async def search(self, query: str, count: int = 10) -> List[SearchResult]:
+        """Search using available search APIs, sharing identical in-flight searches"""
+        key = f"{count}:{hashlib.sha1(normalize_query(query).encode()).hexdigest()}"
+        return list(await self.single_flight.do(key, lambda: self._search(query, count)))
+    
+    async def _search(self, query: str, count: int = 10) -> List[SearchResult]:
         """Search using available search APIs (fallback to Exa if Brave fails)"""
-        # Try Brave first
-        results = await self.search_brave(query, count)
+        if not self.hedging_enabled or not (self.brave_api_key and self.exa_api_key):
+            # Try Brave first
+            results = await self.search_brave(query, count) if self.brave_api_key else []
+            
+            # If Brave fails or returns no results, try Exa
+            if not results:
+                results = await self.search_exa(query, count) if self.exa_api_key else []
+                
+            return results[:count]
         
-        # If Brave fails or returns no results, try Exa
-        if not results:
-            results = await self.search_exa(query, count)
+        return (await self.search_hedged(query, count))[:count]
+    
+    async def search_hedged(self, query: str, count: int = 10) -> List[SearchResult]:
+        """Fire Brave, hedge with Exa after the learned delay, and take the first non-empty answer"""
+        brave_task = asyncio.create_task(self.search_brave(query, count))
+        pending = {brave_task}
+        
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_delay())
+            if brave_task in done and brave_task.result():
+                return brave_task.result()
             
-        return results[:count]
+            # Brave is slow, failed or came back empty: race Exa against it
+            pending = {task for task in pending if not task.done()}
+            pending.add(asyncio.create_task(self.search_exa(query, count)))
+            
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result():
+                        return task.result()
+            return []
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """Collapses identical concurrent calls into one.
+
+    The first caller for a key runs the work; callers arriving while it is in
+    flight await the same task and get the same result (or exception). The
+    task is shielded, so a caller that gives up does not cancel the work for
+    the others.
+
+    With `storage_service` connected to Redis, the first worker to take the
+    key's lock runs the work while other workers wait for the lock to be
+    released and then call it themselves. That is only useful for work that
+    reads a shared cache first (the search cache, stored page summaries), so
+    the waiting workers get a cache hit instead of a second upstream call.
+    """
+
+    def __init__(self, name: str, storage_service=None):
+        self.name = name
+        self.storage_service = storage_service
+        self.use_redis_lock = os.getenv("SINGLE_FLIGHT_REDIS_LOCK", "true").lower() == "true"
+        self.lock_ttl = float(os.getenv("SINGLE_FLIGHT_LOCK_TTL", "30"))
+        self.wait_timeout = float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", "10"))
+        self.poll_interval = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", "0.05"))
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._stats = {"calls": 0, "shared": 0, "lock_waits": 0}
+
+    def _redis_lock_enabled(self) -> bool:
+        return bool(self.use_redis_lock and self.storage_service and self.storage_service.redis_available)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn() once for all concurrent callers with the same key"""
+        task = self._calls.get(key)
+        if task is None:
+            self._stats["calls"] += 1
+            task = asyncio.create_task(self._run(key, fn))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self._stats["shared"] += 1
+        return await asyncio.shield(task)
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if not self._redis_lock_enabled():
+            return await fn()
+
+        lock_key = f"single_flight:{self.name}:{key}"
+        token = uuid.uuid4().hex
+        if not await self.storage_service.acquire_lock(lock_key, token, self.lock_ttl):
+            # Another worker is doing this work; wait for it, then read its result through fn()
+            self._stats["lock_waits"] += 1
+            await self._wait_for_release(lock_key)
+            return await fn()
+
+        try:
+            return await fn()
+        finally:
+            await self.storage_service.release_lock(lock_key, token)
+
+    async def _wait_for_release(self, lock_key: str):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        while loop.time() < deadline and await self.storage_service.lock_held(lock_key):
+            await asyncio.sleep(self.poll_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "in_flight": len(self._calls), "redis_lock": self._redis_lock_enabled()}
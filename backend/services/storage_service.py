@@ -1,206 +1,673 @@
-import redis
+import logging
+import redis.asyncio as redis
 import json
 import uuid
 import os
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
-from models.schemas import Thread, Message, SearchResult
+from models.schemas import Thread, ThreadSummary, Message, SearchResult
+from services.codecs import Codec
+from services.memory_store import InMemoryRedis
+
+logger = logging.getLogger(__name__)
+
+# Positional layouts used by the codec; the leading element is the layout version
+MESSAGE_LAYOUT = 1
+THREAD_LAYOUT = 1
+SOURCE_FIELDS = ("title", "url", "content", "snippet", "source", "image_url", "favicon_url")
 
 class StorageService:
     def __init__(self):
-        redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
+        self.redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
+        self.max_connections = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+        # One non-blocking client backed by a single connection pool; swapped
+        # for an in-memory backend by connect() when Redis cannot be reached,
+        # or used from the start with REDIS_URL=memory://.
+        # Thread data is codec-encoded bytes, so responses are not decoded;
+        # text values are JSON (json.loads takes bytes) or go through _text().
+        # binary_client names the same client at the call sites that store bytes.
+        if self.redis_url.startswith("memory://"):
+            self.redis_client = self.binary_client = InMemoryRedis()
+        else:
+            self.redis_client = self.binary_client = redis.from_url(
+                self.redis_url,
+                decode_responses=False,
+                max_connections=self.max_connections
+            )
+        self.codec = Codec()
+        self.search_handoff_ttl = int(os.getenv("SEARCH_HANDOFF_TTL", "300"))
+        self.redis_available = False
+    
+    async def connect(self) -> bool:
+        """Check the Redis connection, falling back to in-memory storage when unavailable"""
+        if isinstance(self.redis_client, InMemoryRedis):
+            logger.info("Using in-memory storage")
+            return False
         try:
-            self.redis_client = redis.from_url(redis_url, decode_responses=True)
-            # Test connection
-            self.redis_client.ping()
+            await self.redis_client.ping()
             self.redis_available = True
-            print("✅ Redis connected successfully")
+            logger.info("✅ Redis connected successfully")
         except Exception as e:
-            print(f"⚠️  Redis not available: {e}")
-            self.redis_client = None
+            logger.warning("⚠️  Redis not available, using in-memory storage: %s", e)
+            await self.close()
+            self.redis_client = self.binary_client = InMemoryRedis()
             self.redis_available = False
+        return self.redis_available
+    
+    async def close(self):
+        """Release the Redis connection pool"""
+        await self.redis_client.aclose()
+    
+    def backend_info(self) -> dict:
+        """Which storage backend and codec are in use"""
+        return {
+            "backend": "redis" if self.redis_available else "memory",
+            "max_connections": self.max_connections,
+            "codec": self.codec.format_name,
+            "compression": self.codec.compression
+        }
+    
+    def _text(self, value) -> str:
+        return value.decode() if isinstance(value, bytes) else value
         
-    def _serialize_thread(self, thread: Thread) -> str:
-        """Serialize thread to JSON string"""
-        return json.dumps({
-            "id": thread.id,
-            "title": thread.title,
-            "messages": [
-                {
-                    "id": msg.id,
-                    "content": msg.content,
-                    "role": msg.role,
-                    "timestamp": msg.timestamp.isoformat(),
-                    "sources": [
-                        {
-                            "title": src.title,
-                            "url": src.url,
-                            "content": src.content,
-                            "snippet": src.snippet
-                        } for src in (msg.sources or [])
-                    ]
-                } for msg in thread.messages
-            ],
-            "created_at": thread.created_at.isoformat(),
-            "updated_at": thread.updated_at.isoformat()
-        })
-    
-    def _deserialize_thread(self, data: str) -> Thread:
-        """Deserialize JSON string to Thread"""
-        thread_data = json.loads(data)
-        messages = []
+    def _message_to_dict(self, msg: Message) -> dict:
+        return {
+            "id": msg.id,
+            "content": msg.content,
+            "role": msg.role,
+            "timestamp": msg.timestamp.isoformat(),
+            "sources": [src.model_dump() for src in (msg.sources or [])]
+        }
+    
+    def _message_from_dict(self, msg_data: dict) -> Message:
+        sources = None
+        if msg_data.get("sources"):
+            sources = [
+                SearchResult(**src) for src in msg_data["sources"]
+            ]
         
-        for msg_data in thread_data["messages"]:
-            sources = None
-            if msg_data.get("sources"):
-                sources = [
-                    SearchResult(**src) for src in msg_data["sources"]
-                ]
-            
-            messages.append(Message(
-                id=msg_data["id"],
-                content=msg_data["content"],
-                role=msg_data["role"],
-                timestamp=datetime.fromisoformat(msg_data["timestamp"]),
-                sources=sources
-            ))
+        return Message(
+            id=msg_data["id"],
+            content=msg_data["content"],
+            role=msg_data["role"],
+            timestamp=datetime.fromisoformat(msg_data["timestamp"]),
+            sources=sources
+        )
+    
+    def _message_to_row(self, msg: Message) -> list:
+        return [
+            MESSAGE_LAYOUT,
+            msg.id,
+            msg.content,
+            msg.role,
+            msg.timestamp.isoformat(),
+            [[getattr(src, field) for field in SOURCE_FIELDS] for src in (msg.sources or [])]
+        ]
+    
+    def _message_from_row(self, row) -> Message:
+        # Older values are JSON objects keyed by field name
+        if isinstance(row, dict):
+            return self._message_from_dict(row)
+        
+        _, msg_id, content, role, timestamp, sources = row
+        return Message.model_construct(
+            id=msg_id,
+            content=content,
+            role=role,
+            timestamp=datetime.fromisoformat(timestamp),
+            sources=[
+                SearchResult.model_construct(**dict(zip(SOURCE_FIELDS, src))) for src in sources
+            ] or None
+        )
+    
+    def _serialize_message(self, message: Message) -> bytes:
+        """Serialize one message for the per-thread message log"""
+        return self.codec.encode(self._message_to_row(message))
+    
+    def _deserialize_message(self, data) -> Message:
+        """Deserialize one message from the per-thread message log"""
+        return self._message_from_row(self.codec.decode(data))
+    
+    def _serialize_thread(self, thread: Thread) -> bytes:
+        """Serialize a whole thread with the storage codec"""
+        return self.codec.encode([
+            THREAD_LAYOUT,
+            thread.id,
+            thread.title,
+            thread.created_at.isoformat(),
+            thread.updated_at.isoformat(),
+            [self._message_to_row(msg) for msg in thread.messages]
+        ])
+    
+    def _deserialize_thread(self, data) -> Thread:
+        """Deserialize a thread written by _serialize_thread or a legacy JSON blob"""
+        thread_data = self.codec.decode(data)
+        if isinstance(thread_data, dict):
+            messages = [self._message_from_dict(msg_data) for msg_data in thread_data["messages"]]
+            thread_id, title = thread_data["id"], thread_data["title"]
+            created_at, updated_at = thread_data["created_at"], thread_data["updated_at"]
+        else:
+            _, thread_id, title, created_at, updated_at, rows = thread_data
+            messages = [self._message_from_row(row) for row in rows]
         
         return Thread(
-            id=thread_data["id"],
-            title=thread_data["title"],
+            id=thread_id,
+            title=title,
             messages=messages,
-            created_at=datetime.fromisoformat(thread_data["created_at"]),
-            updated_at=datetime.fromisoformat(thread_data["updated_at"])
+            created_at=datetime.fromisoformat(created_at),
+            updated_at=datetime.fromisoformat(updated_at)
         )
     
+    # Threads are stored as a metadata hash (thread_meta:<id>) plus an
+    # append-only message list (thread_messages:<id>). The metadata hash also
+    # carries message_count and last_snippet so it doubles as the summary
+    # index used for listing. Threads written by older versions live as whole
+    # JSON blobs in the "threads" hash and are migrated to this layout on
+    # first access or by migrate_legacy_threads(). Messages are encoded with
+    # self.codec, so thread keys are read through the binary client and
+    # metadata is decoded to str here.
+    def _meta_key(self, thread_id: str) -> str:
+        return f"thread_meta:{thread_id}"
+    
+    def _messages_key(self, thread_id: str) -> str:
+        return f"thread_messages:{thread_id}"
+    
+    def _snippet(self, content: str, length: int = 160) -> str:
+        content = " ".join(content.split())
+        return content[:length] + "..." if len(content) > length else content
+    
+    def _decode_meta(self, meta: dict) -> dict:
+        return {self._text(field): self._text(value) for field, value in meta.items()}
+    
+    def _summary_from_meta(self, meta: dict) -> ThreadSummary:
+        return ThreadSummary(
+            id=meta["id"],
+            title=meta["title"],
+            created_at=datetime.fromisoformat(meta["created_at"]),
+            updated_at=datetime.fromisoformat(meta["updated_at"]),
+            message_count=int(meta.get("message_count", 0)),
+            last_snippet=meta.get("last_snippet", "")
+        )
+    
+    def _summaries_from_metas(self, metas: List[dict]) -> List[ThreadSummary]:
+        """Thread summaries for stored metadata, skipping (and logging) malformed entries"""
+        summaries = []
+        for meta in metas:
+            if not meta:
+                continue
+            meta = self._decode_meta(meta)
+            try:
+                summaries.append(self._summary_from_meta(meta))
+            except Exception as e:
+                logger.error("Skipping malformed thread metadata %s: %s", meta.get("id"), e)
+        return summaries
+    
     async def create_thread(self, title: str) -> str:
         """Create a new thread and return its ID"""
         thread_id = str(uuid.uuid4())
         now = datetime.now()
         
-        thread = Thread(
-            id=thread_id,
-            title=title,
-            messages=[],
-            created_at=now,
-            updated_at=now
-        )
-        
-        if self.redis_available:
-            try:
-                self.redis_client.hset("threads", thread_id, self._serialize_thread(thread))
-                self.redis_client.zadd("thread_timestamps", {thread_id: now.timestamp()})
-            except Exception as e:
-                print(f"Redis error in create_thread: {e}")
+        try:
+            async with self.binary_client.pipeline(transaction=False) as pipe:
+                pipe.hset(self._meta_key(thread_id), mapping={
+                    "id": thread_id,
+                    "title": title,
+                    "created_at": now.isoformat(),
+                    "updated_at": now.isoformat(),
+                    "message_count": 0,
+                    "last_snippet": ""
+                })
+                pipe.zadd("thread_timestamps", {thread_id: now.timestamp()})
+                await pipe.execute()
+        except Exception as e:
+            logger.error("Redis error in create_thread: %s", e)
         
         return thread_id
     
-    async def get_thread(self, thread_id: str) -> Optional[Thread]:
-        """Get a thread by ID"""
-        if not self.redis_available:
-            return None
-            
+    async def _migrate_legacy_thread(self, thread_id: str) -> bool:
+        """Move a legacy JSON blob from the "threads" hash into the append-only layout.
+
+        Returns whether the thread is now in the append-only layout. The blob,
+        message log and metadata are watched, so a concurrent migration or
+        append makes the transaction retry instead of overwriting messages.
+        """
+        while True:
+            async with self.binary_client.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch("threads", self._messages_key(thread_id), self._meta_key(thread_id))
+                    thread_data = await pipe.hget("threads", thread_id)
+                    if not thread_data:
+                        # Never legacy, or already migrated by someone else
+                        return bool(await pipe.exists(self._meta_key(thread_id)))
+                    
+                    thread = self._deserialize_thread(thread_data)
+                    pipe.multi()
+                    pipe.delete(self._messages_key(thread_id))
+                    if thread.messages:
+                        pipe.rpush(self._messages_key(thread_id), *[self._serialize_message(msg) for msg in thread.messages])
+                    pipe.hset(self._meta_key(thread_id), mapping={
+                        "id": thread.id,
+                        "title": thread.title,
+                        "created_at": thread.created_at.isoformat(),
+                        "updated_at": thread.updated_at.isoformat(),
+                        "message_count": len(thread.messages),
+                        "last_snippet": self._snippet(thread.messages[-1].content) if thread.messages else ""
+                    })
+                    pipe.hdel("threads", thread_id)
+                    await pipe.execute()
+                    return True
+                except redis.WatchError:
+                    continue
+    
+    async def migrate_legacy_threads(self) -> int:
+        """Migrate every thread still stored in the legacy "threads" hash"""
+        migrated = 0
         try:
-            thread_data = self.redis_client.hget("threads", thread_id)
-            if thread_data:
-                return self._deserialize_thread(thread_data)
-            return None
+            for thread_id in map(self._text, await self.binary_client.hkeys("threads")):
+                try:
+                    if await self._migrate_legacy_thread(thread_id):
+                        migrated += 1
+                except Exception as e:
+                    logger.error("Error migrating thread %s: %s", thread_id, e)
         except Exception as e:
-            print(f"Error getting thread {thread_id}: {e}")
+            logger.error("Error listing legacy threads: %s", e)
+        
+        if migrated:
+            logger.info("✅ Migrated %s threads to the append-only message log", migrated)
+        return migrated
+    
+    async def get_thread(self, thread_id: str, offset: int = 0, limit: Optional[int] = None) -> Optional[Thread]:
+        """Get a thread by ID, optionally only a page of its messages"""
+        if offset < 0 or (limit is not None and limit < 1):
+            raise ValueError(f"Invalid message page: offset={offset}, limit={limit}")
+        try:
+            end = -1 if limit is None else offset + limit - 1
+            async with self.binary_client.pipeline(transaction=False) as pipe:
+                pipe.hgetall(self._meta_key(thread_id))
+                pipe.lrange(self._messages_key(thread_id), offset, end)
+                meta, raw_messages = await pipe.execute()
+            
+            meta = self._decode_meta(meta)
+            if not meta:
+                if not await self._migrate_legacy_thread(thread_id):
+                    return None
+                return await self.get_thread(thread_id, offset, limit)
+            
+            return Thread(
+                id=meta["id"],
+                title=meta["title"],
+                messages=[self._deserialize_message(data) for data in raw_messages],
+                created_at=datetime.fromisoformat(meta["created_at"]),
+                updated_at=datetime.fromisoformat(meta["updated_at"])
+            )
+        except Exception as e:
+            logger.error("Error getting thread %s: %s", thread_id, e)
             return None
     
     async def add_message_to_thread(self, thread_id: str, message: Message) -> bool:
-        """Add a message to a thread"""
-        if not self.redis_available:
-            return True  # Return True to not break the flow when Redis is unavailable
-            
+        """Append a message to a thread"""
         try:
-            thread = await self.get_thread(thread_id)
-            if not thread:
-                return False
-                
-            thread.messages.append(message)
-            thread.updated_at = datetime.now()
+            if not await self.binary_client.exists(self._meta_key(thread_id)):
+                if not await self._migrate_legacy_thread(thread_id):
+                    return False
             
-            self.redis_client.hset("threads", thread_id, self._serialize_thread(thread))
-            self.redis_client.zadd("thread_timestamps", {thread_id: thread.updated_at.timestamp()})
+            updated_at = datetime.now()
+            async with self.binary_client.pipeline(transaction=False) as pipe:
+                pipe.rpush(self._messages_key(thread_id), self._serialize_message(message))
+                pipe.hset(self._meta_key(thread_id), mapping={
+                    "updated_at": updated_at.isoformat(),
+                    "last_snippet": self._snippet(message.content)
+                })
+                pipe.hincrby(self._meta_key(thread_id), "message_count", 1)
+                pipe.zadd("thread_timestamps", {thread_id: updated_at.timestamp()})
+                await pipe.execute()
             
             return True
         except Exception as e:
-            print(f"Error adding message to thread {thread_id}: {e}")
+            logger.error("Error adding message to thread %s: %s", thread_id, e)
             return False
     
-    async def get_all_threads(self, limit: int = 50) -> List[Thread]:
-        """Get all threads ordered by most recent activity"""
-        if not self.redis_available:
-            return []
+    async def _page_thread_ids(self, limit: int, cursor: Optional[str]) -> Tuple[List[str], Optional[str]]:
+        """One page of thread IDs, most recent first, and the cursor for the next page.
+        
+        The cursor is "<score>:<thread id>" of the last thread returned. Threads
+        sharing that score are ordered by ID (descending, as Redis does), so the
+        next page resumes after the cursor's ID instead of skipping the ties.
+        """
+        if not cursor:
+            entries = await self.binary_client.zrevrangebyscore(
+                "thread_timestamps", "+inf", "-inf", start=0, num=limit, withscores=True
+            )
+        else:
+            score, _, last_id = cursor.partition(":")
+            async with self.binary_client.pipeline(transaction=False) as pipe:
+                pipe.zrevrangebyscore("thread_timestamps", score, score, withscores=True)
+                pipe.zrevrangebyscore("thread_timestamps", f"({score}", "-inf", start=0, num=limit, withscores=True)
+                ties, older = await pipe.execute()
+            # A cursor without an ID (older clients) resumes strictly below its score
+            ties = [(member, value) for member, value in ties if last_id and self._text(member) < last_id]
+            entries = (ties + older)[:limit]
+        
+        next_cursor = f"{entries[-1][1]!r}:{self._text(entries[-1][0])}" if len(entries) == limit else None
+        return [self._text(thread_id) for thread_id, _ in entries], next_cursor
+    
+    async def get_thread_summaries(self, limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[ThreadSummary], Optional[str]]:
+        """Get thread summaries ordered by most recent activity, with a cursor for the next page"""
+        if limit < 1:
+            raise ValueError(f"Invalid thread page size: {limit}")
+        try:
+            thread_ids, next_cursor = await self._page_thread_ids(limit, cursor)
+            
+            # Fetch every summary in one pipelined round-trip
+            async with self.binary_client.pipeline(transaction=False) as pipe:
+                for thread_id in thread_ids:
+                    pipe.hgetall(self._meta_key(thread_id))
+                metas = await pipe.execute() if thread_ids else []
             
+            return self._summaries_from_metas(metas), next_cursor
+        except Exception as e:
+            logger.error("Error getting thread summaries: %s", e)
+            return [], None
+    
+    async def get_all_threads(self, limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Thread], Optional[str]]:
+        """Get full threads ordered by most recent activity, with a cursor for the next page"""
+        if limit < 1:
+            raise ValueError(f"Invalid thread page size: {limit}")
         try:
-            # Get thread IDs ordered by timestamp (most recent first)
-            thread_ids = self.redis_client.zrevrange("thread_timestamps", 0, limit - 1)
+            thread_ids, next_cursor = await self._page_thread_ids(limit, cursor)
+            
+            async with self.binary_client.pipeline(transaction=False) as pipe:
+                for thread_id in thread_ids:
+                    pipe.hgetall(self._meta_key(thread_id))
+                    pipe.lrange(self._messages_key(thread_id), 0, -1)
+                results = await pipe.execute() if thread_ids else []
             
             threads = []
-            for thread_id in thread_ids:
-                thread = await self.get_thread(thread_id)
-                if thread:
-                    threads.append(thread)
+            for meta, raw_messages in zip(results[::2], results[1::2]):
+                if not meta:
+                    continue
+                meta = self._decode_meta(meta)
+                try:
+                    threads.append(Thread(
+                        id=meta["id"],
+                        title=meta["title"],
+                        messages=[self._deserialize_message(data) for data in raw_messages],
+                        created_at=datetime.fromisoformat(meta["created_at"]),
+                        updated_at=datetime.fromisoformat(meta["updated_at"])
+                    ))
+                except Exception as e:
+                    logger.error("Skipping malformed thread %s: %s", meta.get("id"), e)
             
-            return threads
+            return threads, next_cursor
         except Exception as e:
-            print(f"Error getting all threads: {e}")
-            return []
+            logger.error("Error getting all threads: %s", e)
+            return [], None
     
     async def delete_thread(self, thread_id: str) -> bool:
         """Delete a thread"""
-        if not self.redis_available:
-            return True
-            
         try:
-            self.redis_client.hdel("threads", thread_id)
-            self.redis_client.zrem("thread_timestamps", thread_id)
+            async with self.binary_client.pipeline(transaction=False) as pipe:
+                pipe.delete(self._meta_key(thread_id), self._messages_key(thread_id))
+                pipe.hdel("threads", thread_id)
+                pipe.zrem("thread_timestamps", thread_id)
+                await pipe.execute()
             return True
         except Exception as e:
-            print(f"Error deleting thread {thread_id}: {e}")
+            logger.error("Error deleting thread %s: %s", thread_id, e)
             return False
     
     # Notion token management
     async def store_notion_token(self, user_id: str, token_data: dict) -> bool:
         """Store Notion OAuth token for a user"""
-        if not self.redis_available:
-            return False
-            
         try:
             key = f"notion_token:{user_id}"
-            self.redis_client.setex(key, 86400, json.dumps(token_data))  # 24 hours expiry
+            await self.redis_client.setex(key, 86400, json.dumps(token_data))  # 24 hours expiry
             return True
         except Exception as e:
-            print(f"Error storing Notion token for user {user_id}: {e}")
+            logger.error("Error storing Notion token for user %s: %s", user_id, e)
             return False
     
     async def get_notion_token(self, user_id: str) -> Optional[dict]:
         """Get Notion OAuth token for a user"""
-        if not self.redis_available:
-            return None
-            
         try:
             key = f"notion_token:{user_id}"
-            token_data = self.redis_client.get(key)
+            token_data = await self.redis_client.get(key)
             if token_data:
                 return json.loads(token_data)
             return None
         except Exception as e:
-            print(f"Error getting Notion token for user {user_id}: {e}")
+            logger.error("Error getting Notion token for user %s: %s", user_id, e)
             return None
     
     async def delete_notion_token(self, user_id: str) -> bool:
         """Delete Notion OAuth token for a user"""
-        if not self.redis_available:
+        try:
+            key = f"notion_token:{user_id}"
+            await self.redis_client.delete(key)
             return True
+        except Exception as e:
+            logger.error("Error deleting Notion token for user %s: %s", user_id, e)
+            return False
+    
+    async def list_notion_users(self) -> List[str]:
+        """IDs of users with a stored Notion token"""
+        try:
+            users = []
+            async for key in self.redis_client.scan_iter(match="notion_token:*", count=100):
+                users.append(self._text(key)[len("notion_token:"):])
+            return users
+        except Exception as e:
+            logger.error("Error listing Notion users: %s", e)
+            return []
+    
+    # Notion corpus (extracted page text, synced incrementally)
+    async def get_notion_pages(self, user_id: str) -> Dict[str, dict]:
+        """Get all stored Notion pages for a user keyed by page ID"""
+        try:
+            pages = await self.redis_client.hgetall(f"notion_corpus:{user_id}")
+            return {self._text(page_id): json.loads(data) for page_id, data in pages.items()}
+        except Exception as e:
+            logger.error("Error getting Notion pages for user %s: %s", user_id, e)
+            return {}
+    
+    async def store_notion_pages(self, user_id: str, pages: Dict[str, dict]) -> bool:
+        """Store (or overwrite) Notion pages for a user"""
+        if not pages:
+            return False
             
         try:
-            key = f"notion_token:{user_id}"
-            self.redis_client.delete(key)
+            await self.redis_client.hset(
+                f"notion_corpus:{user_id}",
+                mapping={page_id: json.dumps(page) for page_id, page in pages.items()}
+            )
+            return True
+        except Exception as e:
+            logger.error("Error storing Notion pages for user %s: %s", user_id, e)
+            return False
+    
+    async def delete_notion_pages(self, user_id: str, page_ids: List[str]) -> bool:
+        """Remove pages that are no longer accessible from a user's corpus"""
+        if not page_ids:
+            return False
+            
+        try:
+            await self.redis_client.hdel(f"notion_corpus:{user_id}", *page_ids)
+            return True
+        except Exception as e:
+            logger.error("Error deleting Notion pages for user %s: %s", user_id, e)
+            return False
+    
+    async def get_notion_sync_state(self, user_id: str) -> Optional[dict]:
+        """Get the last Notion sync state for a user"""
+        try:
+            state = await self.redis_client.get(f"notion_sync:{user_id}")
+            return json.loads(state) if state else None
+        except Exception as e:
+            logger.error("Error getting Notion sync state for user %s: %s", user_id, e)
+            return None
+    
+    async def store_notion_sync_state(self, user_id: str, state: dict) -> bool:
+        """Store the Notion sync state for a user"""
+        try:
+            await self.redis_client.set(f"notion_sync:{user_id}", json.dumps(state))
+            return True
+        except Exception as e:
+            logger.error("Error storing Notion sync state for user %s: %s", user_id, e)
+            return False
+    
+    async def delete_notion_corpus(self, user_id: str) -> bool:
+        """Delete all stored Notion content for a user"""
+        try:
+            await self.redis_client.delete(f"notion_corpus:{user_id}", f"notion_sync:{user_id}", f"personal_profile:{user_id}")
+            return True
+        except Exception as e:
+            logger.error("Error deleting Notion corpus for user %s: %s", user_id, e)
+            return False
+    
+    # Personalization profile and per-page summaries
+    async def get_page_summaries(self, content_hashes: List[str]) -> Dict[str, dict]:
+        """Get cached page summaries keyed by page content hash"""
+        if not content_hashes:
+            return {}
+            
+        try:
+            values = await self.redis_client.mget([f"page_summary:{h}" for h in content_hashes])
+            return {h: json.loads(v) for h, v in zip(content_hashes, values) if v}
+        except Exception as e:
+            logger.error("Error getting page summaries: %s", e)
+            return {}
+    
+    async def store_page_summary(self, content_hash: str, summary: dict, ttl: int = 30 * 86400) -> bool:
+        """Cache a page summary by page content hash"""
+        try:
+            await self.redis_client.setex(f"page_summary:{content_hash}", ttl, json.dumps(summary))
+            return True
+        except Exception as e:
+            logger.error("Error storing page summary: %s", e)
+            return False
+    
+    async def get_page_summary_failures(self, content_hashes: List[str]) -> Dict[str, dict]:
+        """Recorded summary failures ({"attempts", "retry_at"}) keyed by page content hash"""
+        if not content_hashes:
+            return {}
+        
+        try:
+            values = await self.redis_client.mget([f"page_summary_failed:{h}" for h in content_hashes])
+            return {h: json.loads(v) for h, v in zip(content_hashes, values) if v}
+        except Exception as e:
+            logger.error("Error getting page summary failures: %s", e)
+            return {}
+    
+    async def store_page_summary_failure(self, content_hash: str, failure: dict, ttl: int) -> bool:
+        """Record that summarizing a page failed, so it is not retried before failure["retry_at"]"""
+        try:
+            await self.redis_client.setex(f"page_summary_failed:{content_hash}", ttl, json.dumps(failure))
+            return True
+        except Exception as e:
+            logger.error("Error storing page summary failure: %s", e)
+            return False
+    
+    async def delete_page_summary_failure(self, content_hash: str) -> bool:
+        """Forget a page's summary failures once it has been summarized"""
+        try:
+            await self.redis_client.delete(f"page_summary_failed:{content_hash}")
             return True
         except Exception as e:
-            print(f"Error deleting Notion token for user {user_id}: {e}")
-            return False
\ No newline at end of file
+            logger.error("Error deleting page summary failure: %s", e)
+            return False
+    
+    async def get_personal_profile(self, user_id: str) -> Optional[dict]:
+        """Get the stored personalization profile for a user"""
+        try:
+            profile = await self.redis_client.get(f"personal_profile:{user_id}")
+            return json.loads(profile) if profile else None
+        except Exception as e:
+            logger.error("Error getting personal profile for user %s: %s", user_id, e)
+            return None
+    
+    async def store_personal_profile(self, user_id: str, profile: dict) -> bool:
+        """Store the personalization profile for a user"""
+        try:
+            await self.redis_client.set(f"personal_profile:{user_id}", json.dumps(profile))
+            return True
+        except Exception as e:
+            logger.error("Error storing personal profile for user %s: %s", user_id, e)
+            return False
+    
+    # Web search result cache
+    async def get_cached_search(self, key: str) -> Optional[dict]:
+        """Get a cached web search entry"""
+        try:
+            cached = await self.redis_client.get(key)
+            return json.loads(cached) if cached else None
+        except Exception as e:
+            logger.error("Error getting cached search %s: %s", key, e)
+            return None
+    
+    async def store_cached_search(self, key: str, entry: dict, ttl: int) -> bool:
+        """Store a web search entry with an expiry"""
+        try:
+            await self.redis_client.setex(key, ttl, json.dumps(entry))
+            return True
+        except Exception as e:
+            logger.error("Error storing cached search %s: %s", key, e)
+            return False
+    
+    # Search result handoff from /search to the websocket stream, keyed by the
+    # assistant message ID so any worker can pick it up exactly once
+    async def store_search_handoff(self, message_id: str, thread_id: str, sources: List[SearchResult]) -> bool:
+        """Store the sources computed for an assistant message that is about to be streamed"""
+        try:
+            await self.redis_client.setex(f"search_handoff:{message_id}", self.search_handoff_ttl, json.dumps({
+                "thread_id": thread_id,
+                "sources": [source.model_dump() for source in sources]
+            }))
+            return True
+        except Exception as e:
+            logger.error("Error storing search handoff for message %s: %s", message_id, e)
+            return False
+    
+    async def pop_search_handoff(self, message_id: str) -> Optional[dict]:
+        """Atomically read and delete the handed-off sources for an assistant message"""
+        try:
+            handoff = await self.redis_client.getdel(f"search_handoff:{message_id}")
+            if not handoff:
+                return None
+            handoff = json.loads(handoff)
+            handoff["sources"] = [SearchResult(**source) for source in handoff["sources"]]
+            return handoff
+        except Exception as e:
+            logger.error("Error getting search handoff for message %s: %s", message_id, e)
+            return None
+    
+    # Short-lived locks used to coalesce identical work across workers
+    async def acquire_lock(self, key: str, token: str, ttl: float) -> bool:
+        """Take a lock unless another holder has it; it expires after ttl seconds"""
+        try:
+            return bool(await self.redis_client.set(key, token, px=int(ttl * 1000), nx=True))
+        except Exception as e:
+            logger.error("Error acquiring lock %s: %s", key, e)
+            # Without Redis, proceed as if the lock was free
+            return True
+    
+    async def release_lock(self, key: str, token: str) -> bool:
+        """Release a lock if it is still held with this token"""
+        try:
+            # A lock that expired and was taken by someone else is left alone;
+            # the check-then-delete race only costs one duplicate call
+            value = await self.redis_client.get(key)
+            if value is not None and self._text(value) == token:
+                await self.redis_client.delete(key)
+                return True
+            return False
+        except Exception as e:
+            logger.error("Error releasing lock %s: %s", key, e)
+            return False
+    
+    async def lock_held(self, key: str) -> bool:
+        """Whether a lock is currently held"""
+        try:
+            return bool(await self.redis_client.exists(key))
+        except Exception as e:
+            logger.error("Error checking lock %s: %s", key, e)
+            return False
@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Awaitable, Callable, List, Optional
+
+# Protocol 1 sends every chunk together with the full response so far;
+# protocol 2 sends sequence-numbered deltas coalesced into frames, followed by
+# one final frame carrying the length and checksum of the complete response.
+PROTOCOL_FULL_CONTENT = 1
+PROTOCOL_DELTA = 2
+
+
+def response_digest(content: str) -> dict:
+    """UTF-8 byte length and SHA-256 of a complete response, sent in the final frame"""
+    encoded = content.encode("utf-8")
+    return {"length": len(encoded), "sha256": hashlib.sha256(encoded).hexdigest()}
+
+
+class DeltaStream:
+    """Coalesces streamed text into sequence-numbered delta frames.
+
+    Text passed to write() is buffered and flushed as one frame once
+    `window` seconds have passed since the first buffered chunk or the buffer
+    reaches `max_chars`, whichever comes first.
+    """
+
+    def __init__(self, send: Callable[[str], Awaitable[None]], window: Optional[float] = None,
+                 max_chars: Optional[int] = None):
+        self.send = send
+        self.window = window if window is not None else float(os.getenv("STREAM_COALESCE_MS", "30")) / 1000
+        self.max_chars = max_chars if max_chars is not None else int(os.getenv("STREAM_COALESCE_MAX_CHARS", "512"))
+        self.seq = 0
+        self.parts: List[str] = []
+        self._buffer: List[str] = []
+        self._buffered_chars = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_error: Optional[BaseException] = None
+        self._send_lock = asyncio.Lock()
+
+    @property
+    def content(self) -> str:
+        return "".join(self.parts)
+
+    async def _send_frame(self, frame: dict):
+        async with self._send_lock:
+            self.seq += 1
+            await self.send(json.dumps({"seq": self.seq, **frame}))
+
+    async def _flush(self):
+        if not self._buffer:
+            return
+        delta = "".join(self._buffer)
+        self._buffer, self._buffered_chars = [], 0
+        await self._send_frame({"delta": delta, "finished": False})
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._flush_task = None
+        try:
+            await self._flush()
+        except Exception as e:
+            # Nobody awaits this task; keep the error for the next write()/finish()
+            self._flush_error = e
+
+    def _raise_flush_error(self):
+        if self._flush_error is not None:
+            error, self._flush_error = self._flush_error, None
+            raise error
+
+    def _cancel_flush(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+    async def write(self, chunk: str):
+        self._raise_flush_error()
+        if not chunk:
+            return
+        self.parts.append(chunk)
+        self._buffer.append(chunk)
+        self._buffered_chars += len(chunk)
+
+        if self._buffered_chars >= self.max_chars or self.window <= 0:
+            self._cancel_flush()
+            await self._flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def finish(self) -> str:
+        """Flush buffered text and send the final frame; returns the complete response"""
+        self._cancel_flush()
+        self._raise_flush_error()
+        await self._flush()
+        content = self.content
+        await self._send_frame({"finished": True, **response_digest(content)})
+        return content
+
+    async def error(self, message: str):
+        self._cancel_flush()
+        await self._send_frame({"finished": True, "error": message})
+
+
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Events message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
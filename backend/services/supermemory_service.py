@@ -1,7 +1,12 @@
 import httpx
+import logging
 import os
 from typing import List, Dict, Any, Optional
 from models.schemas import SearchResult
+from services.http_client import http_pool
+from services.upstream_health import upstream_health
+
+logger = logging.getLogger(__name__)
 
 class SupermemoryService:
     def __init__(self):
@@ -9,15 +14,16 @@ class SupermemoryService:
         self.base_url = "https://api.supermemory.ai/v3"
         
     async def _make_request(self, method: str, url: str, headers: Dict[str, str], 
-                          json_data: Dict[str, Any] = None) -> httpx.Response:
-        """Make a single HTTP request without retries"""
-        async with httpx.AsyncClient() as client:
+                          json_data: Dict[str, Any] = None, idempotent: bool = False) -> httpx.Response:
+        """Make an HTTP request, retrying transient failures only when `idempotent`"""
+        client = http_pool.client("supermemory")
+        
+        async def send(timeout: float) -> httpx.Response:
             if method.upper() == "POST":
-                response = await client.post(url, headers=headers, json=json_data, timeout=10.0)
-            else:
-                response = await client.get(url, headers=headers, timeout=10.0)
+                return await client.post(url, headers=headers, json=json_data, timeout=timeout)
+            return await client.get(url, headers=headers, timeout=timeout)
             
-            return response
+        return await upstream_health.call("supermemory", send, idempotent=idempotent)
         
     async def create_notion_connection(self, redirect_url: str, user_id: str) -> Dict[str, Any]:
         """Create a Notion connection for a user"""
@@ -41,20 +47,20 @@ class SupermemoryService:
         }
         
         try:
-            print(f"DEBUG: Creating Notion connection to {url}")
-            print(f"DEBUG: Payload: {payload}")
+            logger.debug("Creating Notion connection to %s", url)
+            logger.debug("Payload: %s", payload)
             response = await self._make_request("POST", url, headers, payload)
-            print(f"DEBUG: Create connection response status: {response.status_code}")
+            logger.debug("Create connection response status: %s", response.status_code)
             
             if response.status_code == 429:
                 raise Exception("Rate limit exceeded. Please wait a few minutes before trying again.")
             
             response.raise_for_status()
             result = response.json()
-            print(f"DEBUG: Create connection result: {result}")
+            logger.debug("Create connection result: %s", result)
             return result
         except Exception as e:
-            print(f"Supermemory connection error: {e}")
+            logger.error("Supermemory connection error: %s", e)
             raise e
     
     async def search_memories(self, query: str, user_id: str, limit: int = 5) -> List[SearchResult]:
@@ -74,25 +80,24 @@ class SupermemoryService:
             "containerTags": [f"user_{user_id}"]
         }
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(url, headers=headers, json=payload, timeout=10.0)
-                response.raise_for_status()
-                data = response.json()
+        try:
+            response = await self._make_request("POST", url, headers, payload, idempotent=True)
+            response.raise_for_status()
+            data = response.json()
                 
-                results = []
-                for item in data.get("memories", []):
-                    results.append(SearchResult(
-                        title=item.get("title", "Personal Note"),
-                        url=item.get("url", "#"),
-                        content=item.get("content", "")[:500] + "..." if len(item.get("content", "")) > 500 else item.get("content", ""),
-                        snippet=item.get("content", "")[:200] + "..." if len(item.get("content", "")) > 200 else item.get("content", "")
-                    ))
+            results = []
+            for item in data.get("memories", []):
+                results.append(SearchResult(
+                    title=item.get("title", "Personal Note"),
+                    url=item.get("url", "#"),
+                    content=item.get("content", "")[:500] + "..." if len(item.get("content", "")) > 500 else item.get("content", ""),
+                    snippet=item.get("content", "")[:200] + "..." if len(item.get("content", "")) > 200 else item.get("content", "")
+                ))
                 
-                return results
-            except Exception as e:
-                print(f"Supermemory search error: {e}")
-                return []
+            return results
+        except Exception as e:
+            logger.error("Supermemory search error: %s", e)
+            return []
     
     async def get_connections(self, user_id: str) -> List[Dict[str, Any]]:
         """Get user's connections"""
@@ -106,17 +111,17 @@ class SupermemoryService:
         }
         
         try:
-            print(f"DEBUG: Making request to {url}")
-            response = await self._make_request("POST", url, headers, {})
-            print(f"DEBUG: Response status: {response.status_code}")
+            logger.debug("Making request to %s", url)
+            response = await self._make_request("POST", url, headers, {}, idempotent=True)
+            logger.debug("Response status: %s", response.status_code)
             
             if response.status_code == 429:
-                print("DEBUG: Rate limit exceeded when fetching connections")
+                logger.debug("Rate limit exceeded when fetching connections")
                 return []
             
             response.raise_for_status()
             data = response.json()
-            print(f"DEBUG: Response data: {data}")
+            logger.debug("Response data: %s", data)
             
             # The response is an array of connections
             all_connections = data if isinstance(data, list) else []
@@ -124,15 +129,15 @@ class SupermemoryService:
             for conn in all_connections:
                 # Check if this connection belongs to the user
                 metadata = conn.get("metadata", {})
-                print(f"DEBUG: Connection metadata: {metadata}")
+                logger.debug("Connection metadata: %s", metadata)
                 if metadata.get("user_id") == user_id:
                     user_connections.append(conn)
             
-            print(f"DEBUG: Found {len(user_connections)} user connections")
+            logger.debug("Found %s user connections", len(user_connections))
             return user_connections
         except Exception as e:
-            print(f"Get connections error: {e}")
-            print(f"DEBUG: URL was: {url}")
+            logger.error("Get connections error: %s", e)
+            logger.debug("URL was: %s", url)
             return []
     
 
@@ -146,11 +151,13 @@ class SupermemoryService:
             "Authorization": f"Bearer {self.api_key}"
         }
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(url, headers=headers, timeout=30.0)
-                response.raise_for_status()
-                return True
-            except Exception as e:
-                print(f"Sync connection error: {e}")
-                return False
+        client = http_pool.client("supermemory")
+        try:
+            response = await upstream_health.call(
+                "supermemory", lambda timeout: client.post(url, headers=headers, timeout=timeout), max_timeout=30.0
+            )
+            response.raise_for_status()
+            return True
+        except Exception as e:
+            logger.error("Sync connection error: %s", e)
+            return False
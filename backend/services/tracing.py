@@ -0,0 +1,263 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, Iterator, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# Spans propagate through awaits and into tasks created while they are current
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def _reset(token):
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # A streaming generator closed from another context; the span still ends
+        pass
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.started_at = time.time()
+        self.spans: List["Span"] = []
+
+
+class Span:
+    def __init__(self, trace: Trace, name: str, parent: Optional["Span"] = None, **attributes: Any):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.attributes: Dict[str, Any] = attributes
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+        trace.spans.append(self)
+
+    def set(self, **attributes: Any):
+        self.attributes.update(attributes)
+
+    def finish(self, error: Optional[BaseException] = None):
+        if self.end is None:
+            self.end = time.perf_counter()
+            if error is not None:
+                self.error = type(error).__name__
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round((end - self.start) * 1000, 2),
+            "finished": self.end is not None,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+
+class Tracer:
+    """Collects request traces into an in-memory ring buffer and optionally a JSONL file"""
+
+    def __init__(self):
+        self.enabled = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+        self.sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+        self.buffer_size = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+        self.export_path = os.getenv("TRACE_EXPORT_PATH")
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+
+    @contextmanager
+    def trace(self, name: str, **attributes: Any) -> Iterator[Optional[Trace]]:
+        """Start a new trace with a root span; yields None when the request is not sampled"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield None
+            return
+
+        trace = Trace(name)
+        root = Span(trace, name, **attributes)
+        token = _current_span.set(root)
+        self._remember(trace)
+        error = None
+        try:
+            yield trace
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _reset(token)
+            root.finish(error)
+            self._export(trace)
+
+    def _remember(self, trace: Trace):
+        self._traces[trace.trace_id] = trace
+        while len(self._traces) > self.buffer_size:
+            self._traces.popitem(last=False)
+
+    def _export(self, trace: Trace):
+        if not self.export_path:
+            return
+        line = json.dumps(self.waterfall(trace.trace_id)) + "\n"
+        try:
+            # Keep file I/O off the event loop
+            asyncio.get_running_loop().run_in_executor(None, self._write, line)
+        except RuntimeError:
+            self._write(line)
+
+    def _write(self, line: str):
+        try:
+            with open(self.export_path, "a") as f:
+                f.write(line)
+        except OSError as e:
+            logger.error("Failed to export trace: %s", e)
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        return self._traces.get(trace_id)
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        summaries = []
+        for trace in reversed(self._traces.values()):
+            root = trace.spans[0]
+            summaries.append({
+                "trace_id": trace.trace_id,
+                "name": trace.name,
+                "started_at": trace.started_at,
+                "duration_ms": root.to_dict(root.start)["duration_ms"],
+                "spans": len(trace.spans)
+            })
+            if len(summaries) >= limit:
+                break
+        return summaries
+
+    def waterfall(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """Spans of a trace in start order, with depth and critical-path markers"""
+        trace = self._traces.get(trace_id)
+        if trace is None:
+            return None
+
+        origin = trace.spans[0].start
+        spans = [span.to_dict(origin) for span in trace.spans]
+        by_id = {span["span_id"]: span for span in spans}
+        children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        for span in spans:
+            children.setdefault(span["parent_id"], []).append(span)
+            depth, parent = 0, by_id.get(span["parent_id"])
+            while parent:
+                depth, parent = depth + 1, by_id.get(parent["parent_id"])
+            span["depth"] = depth
+            span["critical"] = False
+
+        self._mark_critical_path(spans[0], children)
+        return {
+            "trace_id": trace.trace_id,
+            "name": trace.name,
+            "started_at": trace.started_at,
+            "duration_ms": spans[0]["duration_ms"],
+            "spans": sorted(spans, key=lambda span: span["start_ms"])
+        }
+
+    def _mark_critical_path(self, span: Dict[str, Any], children: Dict[Optional[str], List[Dict[str, Any]]]):
+        # Walk back from the end of the span: the child that finished last was
+        # being waited on, then the child that finished last before it started, ...
+        span["critical"] = True
+        cursor = span["start_ms"] + span["duration_ms"]
+        for child in sorted(children.get(span["span_id"], []),
+                            key=lambda child: child["start_ms"] + child["duration_ms"], reverse=True):
+            child_end = child["start_ms"] + child["duration_ms"]
+            if child_end <= cursor:
+                self._mark_critical_path(child, children)
+                cursor = child["start_ms"]
+
+    def render_text(self, trace_id: str, width: int = 60) -> Optional[str]:
+        """ASCII waterfall of a trace; critical-path spans are marked with *"""
+        data = self.waterfall(trace_id)
+        if data is None:
+            return None
+
+        total = max(data["duration_ms"], 0.001)
+        lines = [f"{data['name']} {data['trace_id']} {data['duration_ms']:.1f}ms"]
+        for span in data["spans"]:
+            offset = int(span["start_ms"] / total * width)
+            length = max(1, int(span["duration_ms"] / total * width))
+            bar = " " * offset + "█" * min(length, width - offset)
+            label = ("  " * span["depth"] + span["name"])[:40]
+            marker = "*" if span["critical"] else " "
+            lines.append(
+                f"{marker} {label:<40} {span['start_ms']:>9.1f} {span['duration_ms']:>9.1f}ms |{bar:<{width}}|"
+            )
+        return "\n".join(lines)
+
+
+tracer = Tracer()
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, parent: Optional[Span] = None, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Time a block as a child of `parent` or the current span (a no-op outside a trace)"""
+    parent = parent or _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(parent.trace, name, parent, **attributes)
+    token = _current_span.set(child)
+    error = None
+    try:
+        yield child
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _reset(token)
+        child.finish(error)
+
+
+def start_span(name: str, **attributes: Any) -> Optional[Span]:
+    """Start a child span without making it current, e.g. around an async generator; call finish()"""
+    parent = _current_span.get()
+    return Span(parent.trace, name, parent, **attributes) if parent else None
+
+
+T = TypeVar("T")
+
+
+def background_task(coro: Awaitable[T], trace_name: Optional[str] = None) -> "asyncio.Task[T]":
+    """Run a coroutine as a task detached from the caller's trace, optionally as its own root trace.
+
+    Tasks copy the current context, so without this a task outliving the
+    request would keep adding spans to a trace that has already finished.
+    """
+    async def run() -> T:
+        _current_span.set(None)
+        if trace_name is None:
+            return await coro
+        with tracer.trace(trace_name):
+            return await coro
+
+    return asyncio.create_task(run())
+
+
+def traced(name: str):
+    """Decorator wrapping an async function in a span"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
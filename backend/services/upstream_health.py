@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+import openai
+
+from services.latency_tracker import LatencyHistogram
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Longest a call may take before enough latency has been observed to adapt
+DEFAULT_MAX_TIMEOUTS = {"brave": 10.0, "exa": 10.0, "notion": 10.0, "openai": 60.0, "supermemory": 10.0}
+
+# Connection failures and timeouts; 5xx responses are detected by status code
+TRANSIENT_ERRORS = (httpx.TransportError, asyncio.TimeoutError, openai.APIConnectionError)
+
+BREAKER_TRANSITIONS = metrics.counter(
+    "farfalle_upstream_circuit_transitions_total", "Circuit breaker state changes per upstream", ["upstream", "state"]
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+    def __init__(self, upstream: str, retry_in: float):
+        super().__init__(f"{upstream} circuit open, retrying in {retry_in:.1f}s")
+        self.upstream = upstream
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures; after
+    `reset_timeout` one trial call is let through (half-open), which closes
+    the circuit on success or reopens it on failure."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state == OPEN and self.retry_in() == 0:
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+        return self.state != OPEN
+
+    def release(self):
+        """End a call that produced no verdict (e.g. it was cancelled)"""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self._trial_in_flight = False
+        self.consecutive_failures = 0
+        if self.state != CLOSED:
+            self._transition(CLOSED)
+
+    def record_failure(self):
+        self._trial_in_flight = False
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            if self.state != OPEN:
+                self._transition(OPEN)
+
+    def _transition(self, state: str):
+        logger.warning("Circuit for %s: %s -> %s", self.name, self.state, state)
+        self.state = state
+        BREAKER_TRANSITIONS.inc(upstream=self.name, state=state)
+
+
+class UpstreamHealth:
+    """Circuit breaker, adaptive timeout and bounded retries for one upstream"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker(
+            name,
+            failure_threshold=int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("UPSTREAM_BREAKER_RESET_SECONDS", "30"))
+        )
+        # Latency of successful calls only, per operation ("openai.stream" and
+        # "openai.json" differ too much to share a timeout); failures would be
+        # censored at the timeout. The breaker is shared by all operations.
+        self.latencies: Dict[Optional[str], LatencyHistogram] = {}
+        self.max_timeout = float(os.getenv(f"UPSTREAM_{name.upper()}_MAX_TIMEOUT", DEFAULT_MAX_TIMEOUTS.get(name, 10.0)))
+        self.min_timeout = float(os.getenv("UPSTREAM_TIMEOUT_MIN", "1.0"))
+        self.timeout_multiplier = float(os.getenv("UPSTREAM_TIMEOUT_MULTIPLIER", "3"))
+        self.timeout_min_samples = int(os.getenv("UPSTREAM_TIMEOUT_MIN_SAMPLES", "20"))
+        self.max_retries = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+        self.retry_base_delay = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.2"))
+        self.counts = {"calls": 0, "failures": 0, "rejected": 0, "retries": 0}
+
+    def latency(self, operation: Optional[str] = None) -> LatencyHistogram:
+        histogram = self.latencies.get(operation)
+        if histogram is None:
+            histogram = self.latencies[operation] = LatencyHistogram()
+        return histogram
+
+    def timeout(self, max_timeout: Optional[float] = None, operation: Optional[str] = None) -> float:
+        """A multiple of the operation's recent p99, between the configured floor and ceiling"""
+        ceiling = max_timeout or self.max_timeout
+        latency = self.latencies.get(operation)
+        if latency is None or len(latency.samples) < self.timeout_min_samples:
+            return ceiling
+        return min(ceiling, max(self.min_timeout, latency.percentile(0.99) * self.timeout_multiplier))
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: spread retries from concurrent requests over the window
+        return random.uniform(0, min(2.0, self.retry_base_delay * 2 ** attempt))
+
+    @staticmethod
+    def _is_failure(error: Optional[BaseException] = None, result: Any = None) -> bool:
+        if error is not None and isinstance(error, TRANSIENT_ERRORS):
+            return True
+        response = getattr(error, "response", None) if error is not None else result
+        status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+        return isinstance(status, int) and status >= 500
+
+    async def call(self, send: Callable[[float], Awaitable[T]], idempotent: bool = False,
+                   max_timeout: Optional[float] = None,
+                   before_attempt: Optional[Callable[[], Awaitable[None]]] = None,
+                   operation: Optional[str] = None) -> T:
+        """Run `send(timeout)` through the breaker.
+
+        Timeouts, connection errors and 5xx responses count as failures and
+        are retried with jittered backoff only when `idempotent`; other errors
+        propagate unchanged. Raises CircuitOpenError while the circuit is open.
+        `before_attempt` runs before every attempt, retries included (e.g. to
+        take a rate-limit token), and is not counted in the call's latency.
+        `operation` keys the latency (and so the adaptive timeout) for calls
+        whose durations differ, e.g. streamed vs. complete responses.
+        """
+        attempts = self.max_retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            if before_attempt is not None:
+                await before_attempt()
+            if not self.breaker.allow():
+                self.counts["rejected"] += 1
+                raise CircuitOpenError(self.name, self.breaker.retry_in())
+
+            self.counts["calls"] += 1
+            started_at = time.perf_counter()
+            error: Optional[Exception] = None
+            result = None
+            try:
+                result = await send(self.timeout(max_timeout, operation))
+            except Exception as e:
+                error = e
+            except BaseException:
+                self.breaker.release()
+                raise
+
+            if not self._is_failure(error, result):
+                self.breaker.record_success()
+                if error is None:
+                    self.latency(operation).observe(time.perf_counter() - started_at)
+                    return result
+                raise error
+
+            self.counts["failures"] += 1
+            self.breaker.record_failure()
+            if attempt == attempts - 1 or self.breaker.state == OPEN:
+                if error is not None:
+                    raise error
+                return result
+
+            self.counts["retries"] += 1
+            await asyncio.sleep(self._backoff(attempt))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "retry_in": round(self.breaker.retry_in(), 2) if self.breaker.state == OPEN else None,
+            "timeout": round(self.timeout(), 3),
+            # Keyed "openai.stream", "openai.json", or just the upstream name
+            "latency": {
+                f"{self.name}.{operation}" if operation else self.name: {
+                    "timeout": round(self.timeout(operation=operation), 3),
+                    "p50": latency.percentile(0.50),
+                    "p95": latency.percentile(0.95),
+                    "p99": latency.percentile(0.99)
+                }
+                for operation, latency in self.latencies.items()
+            },
+            **self.counts
+        }
+
+
+class UpstreamRegistry:
+    """Health state per upstream (brave, exa, notion, openai, supermemory)"""
+
+    def __init__(self):
+        self._upstreams: Dict[str, UpstreamHealth] = {}
+
+    def get(self, name: str) -> UpstreamHealth:
+        upstream = self._upstreams.get(name)
+        if upstream is None:
+            upstream = self._upstreams[name] = UpstreamHealth(name)
+        return upstream
+
+    async def call(self, name: str, send: Callable[[float], Awaitable[T]], idempotent: bool = False,
+                   max_timeout: Optional[float] = None,
+                   before_attempt: Optional[Callable[[], Awaitable[None]]] = None,
+                   operation: Optional[str] = None) -> T:
+        return await self.get(name).call(send, idempotent=idempotent, max_timeout=max_timeout,
+                                         before_attempt=before_attempt, operation=operation)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: self.get(name).snapshot() for name in DEFAULT_MAX_TIMEOUTS}
+
+
+upstream_health = UpstreamRegistry()
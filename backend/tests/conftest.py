@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+# Services read their configuration at import time; keep tests offline and off any real Redis
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["REDIS_URL"] = "memory://"
+os.environ.setdefault("NOTION_SYNC_WORKER", "off")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
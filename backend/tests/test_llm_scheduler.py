@@ -0,0 +1,20 @@
+import asyncio
+
+from services.llm_scheduler import LLM_QUEUE_REJECTIONS, llm_scheduler
+from services.llm_service import LLMService
+from services.metrics import UPSTREAM_ERRORS
+
+
+def test_queue_rejections_are_not_counted_as_openai_errors(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "max_depth", 0)
+    openai_errors = sum(value for (upstream, _), value in UPSTREAM_ERRORS.samples().items() if upstream == "openai")
+    rejections = LLM_QUEUE_REJECTIONS.value(priority="answer", reason="queue_full")
+
+    async def scenario():
+        return [chunk async for chunk in LLMService().generate_response("query", [])]
+
+    chunks = asyncio.run(scenario())
+
+    assert "LLM queue is full" in chunks[0]
+    assert LLM_QUEUE_REJECTIONS.value(priority="answer", reason="queue_full") == rejections + 1
+    assert sum(value for (upstream, _), value in UPSTREAM_ERRORS.samples().items() if upstream == "openai") == openai_errors
@@ -0,0 +1,16 @@
+from models.schemas import SearchResult
+from services.llm_service import LLMService
+from services.tracing import tracer
+
+
+def test_context_packing_report_is_attached_to_the_trace():
+    results = [
+        SearchResult(title=f"r{i}", url=f"https://example.com/{i}", content="word " * 2000, snippet="s", source="web")
+        for i in range(3)
+    ]
+    with tracer.trace("test") as trace:
+        LLMService().create_context_prompt("query", results)
+
+    packing = next(span for span in trace.spans if span.name == "llm.context_packing")
+    assert packing.attributes["included"] + len(packing.attributes["dropped"]) == 3
+    assert packing.attributes["used_tokens"] <= packing.attributes["budget"]
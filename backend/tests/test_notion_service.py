@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+import httpx
+
+from services.http_client import http_pool
+from services.notion_service import NotionService
+from services.upstream_health import upstream_health
+
+
+def test_every_http_attempt_takes_a_rate_limit_token(monkeypatch):
+    statuses = iter([503, 503, 429, 200])
+    attempts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        attempts.append(request.url.path)
+        status = next(statuses)
+        return httpx.Response(status, headers={"Retry-After": "0"}, json={"results": []})
+
+    monkeypatch.setitem(http_pool._clients, "notion", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(upstream_health.get("notion"), "retry_base_delay", 0.0)
+
+    service = NotionService()
+    acquires = []
+
+    async def acquire(access_token):
+        acquires.append(access_token)
+
+    monkeypatch.setattr(service.scheduler, "acquire", acquire)
+
+    response = asyncio.run(service._request("GET", f"{service.base_url}/blocks/page/children", "token"))
+
+    assert response.status_code == 200
+    assert len(attempts) == 4
+    assert len(acquires) == len(attempts)
+
+
+def test_page_listing_follows_cursors_up_to_the_limit(monkeypatch):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        requests.append(body)
+        offset = int(body.get("start_cursor", 0))
+        results = [{"id": f"page-{offset + i}"} for i in range(body["page_size"])]
+        return httpx.Response(200, json={"results": results, "has_more": True, "next_cursor": str(offset + len(results))})
+
+    monkeypatch.setitem(http_pool._clients, "notion", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    service = NotionService()
+
+    pages = asyncio.run(service.get_all_accessible_pages("token", limit=250))
+
+    assert [page["id"] for page in pages] == [f"page-{i}" for i in range(250)]
+    assert [body["page_size"] for body in requests] == [100, 100, 50]
+    assert "start_cursor" not in requests[0]
+
+
+def test_page_listing_fails_as_a_whole(monkeypatch):
+    statuses = iter([200, 400])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(next(statuses), json={"results": [{"id": "page"}], "has_more": True, "next_cursor": "x"})
+
+    monkeypatch.setitem(http_pool._clients, "notion", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    assert asyncio.run(NotionService().get_all_accessible_pages("token", limit=200)) == []
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from models.schemas import SearchResult
+from services.personalization_service import PersonalizationService, parse_json_response
+from services.storage_service import StorageService
+
+
+def notion_result(title: str, content: str) -> SearchResult:
+    return SearchResult(title=title, url=f"https://notion.so/{title}", content=content, snippet=content[:20],
+                        source="notion")
+
+
+def test_failing_page_does_not_rebuild_profile_on_every_call(monkeypatch):
+    calls = []
+
+    async def summarize_page(self, page, priority=None):
+        calls.append(page["title"])
+        if page["title"] == "broken":
+            raise ValueError("model returned prose")
+        return {"interests": ["retrieval"], "summary": "About retrieval."}
+
+    monkeypatch.setattr(PersonalizationService, "summarize_page", summarize_page)
+
+    async def scenario():
+        storage = StorageService()
+        await storage.connect()
+        personalization = PersonalizationService(storage)
+        results = [notion_result("good", "vector search notes"), notion_result("broken", "unparseable")]
+
+        assert await personalization.refresh_profile("user", results)
+        assert sorted(calls) == ["broken", "good"]
+        profile = await storage.get_personal_profile("user")
+        assert profile["profile"]["interests"] == ["retrieval"]
+
+        # The failed page is backing off, so the stored profile counts as current
+        assert not await personalization.refresh_profile("user", results)
+        assert await personalization.get_personal_profile("user", personalization.pages_from_results(results))
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_failed_page_is_retried_after_its_backoff(monkeypatch):
+    calls = []
+
+    async def summarize_page(self, page, priority=None):
+        calls.append(page["title"])
+        if len(calls) == 1:
+            raise ValueError("transient")
+        return {"interests": ["agents"]}
+
+    monkeypatch.setattr(PersonalizationService, "summarize_page", summarize_page)
+
+    async def scenario():
+        storage = StorageService()
+        await storage.connect()
+        personalization = PersonalizationService(storage)
+        personalization.failure_backoff = 0
+        results = [notion_result("page", "agent notes")]
+
+        await personalization.refresh_profile("user", results)
+        assert await personalization.refresh_profile("user", results)
+        assert calls == ["page", "page"]
+        assert (await storage.get_personal_profile("user"))["profile"]["interests"] == ["agents"]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("reply", [
+    '{"interests": ["a"]}',
+    '```json\n{"interests": ["a"]}\n```',
+    'Here is the analysis:\n{"interests": ["a"]}\nLet me know if you need more.',
+])
+def test_parse_json_response_tolerates_wrapping(reply):
+    assert parse_json_response(reply) == {"interests": ["a"]}
+
+
+def test_parse_json_response_lists():
+    assert parse_json_response('```\n["q1", "q2"]\n```') == ["q1", "q2"]
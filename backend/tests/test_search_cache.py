@@ -0,0 +1,50 @@
+import asyncio
+
+from models.schemas import SearchResult
+from services.metrics import CACHE_REQUESTS
+from services.search_cache import SearchCache
+from services.tracing import span, tracer
+
+
+def test_cache_outcomes_use_documented_metric_labels():
+    cache = SearchCache()
+    cache.ttl = 0.0
+    result = SearchResult(title="t", url="https://example.com", content="c", snippet="s", source="web")
+
+    async def fetch():
+        return [result]
+
+    async def scenario():
+        await cache.get_or_fetch("labels", "query", 5, fetch)  # miss
+        cache.ttl = 600.0
+        await cache.get_or_fetch("labels", "query", 5, fetch)  # hit
+        cache.ttl, cache.stale_ttl = -1.0, 3600.0
+        await cache.get_or_fetch("labels", "query", 5, fetch)  # stale hit
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+
+    outcomes = {outcome for (name, outcome) in CACHE_REQUESTS.samples() if name == "search_labels"}
+    assert outcomes == {"hit", "stale_hit", "miss"}
+
+
+def test_background_refresh_does_not_join_the_request_trace():
+    cache = SearchCache()
+    result = SearchResult(title="t", url="https://example.com", content="c", snippet="s", source="web")
+
+    async def fetch():
+        with span("provider.fetch"):
+            return [result]
+
+    async def scenario():
+        await cache.get_or_fetch("tracing", "query", 5, fetch)
+        cache.ttl, cache.stale_ttl = -1.0, 3600.0
+        with tracer.trace("request") as trace:
+            await cache.get_or_fetch("tracing", "query", 5, fetch)
+        await asyncio.gather(*cache._refreshing.values())
+        return trace
+
+    trace = asyncio.run(scenario())
+    assert [s.name for s in trace.spans] == ["request"]
+    refresh = [t for t in tracer._traces.values() if t.name == "search_cache.refresh"][-1]
+    assert "provider.fetch" in [s.name for s in refresh.spans]
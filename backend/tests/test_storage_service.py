@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from services.storage_service import StorageService
+
+
+def test_malformed_thread_metadata_is_skipped():
+    storage = StorageService()
+
+    async def scenario():
+        good = await storage.create_thread("good")
+        bad = await storage.create_thread("bad")
+        await storage.redis_client.hset(storage._meta_key(bad), "created_at", "not a date")
+        summaries, _ = await storage.get_thread_summaries(limit=10)
+        threads, _ = await storage.get_all_threads(limit=10)
+        return good, summaries, threads
+
+    good, summaries, threads = asyncio.run(scenario())
+    assert [summary.id for summary in summaries] == [good]
+    assert [thread.id for thread in threads] == [good]
+
+
+def test_invalid_page_arguments_are_rejected():
+    storage = StorageService()
+
+    async def scenario():
+        thread_id = await storage.create_thread("thread")
+        with pytest.raises(ValueError):
+            await storage.get_thread_summaries(limit=0)
+        with pytest.raises(ValueError):
+            await storage.get_thread(thread_id, limit=0)
+        with pytest.raises(ValueError):
+            await storage.get_thread(thread_id, offset=-1)
+
+    asyncio.run(scenario())
+
+
+def test_redis_clients_share_one_connection_pool(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:6379")
+    storage = StorageService()
+
+    assert storage.redis_client is storage.binary_client
+    assert storage.redis_client.connection_pool.max_connections == storage.max_connections
@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+from services.stream_protocol import DeltaStream
+
+
+def test_background_flush_failure_is_raised_from_next_write():
+    async def send(text):
+        raise ConnectionError("socket closed")
+
+    async def scenario():
+        stream = DeltaStream(send, window=0.001, max_chars=1000)
+        await stream.write("hello")
+        await asyncio.sleep(0.05)
+        with pytest.raises(ConnectionError):
+            await stream.write(" world")
+
+    asyncio.run(scenario())
+
+
+def test_background_flush_failure_is_raised_from_finish():
+    async def send(text):
+        raise ConnectionError("socket closed")
+
+    async def scenario():
+        stream = DeltaStream(send, window=0.001, max_chars=1000)
+        await stream.write("hello")
+        await asyncio.sleep(0.05)
+        with pytest.raises(ConnectionError):
+            await stream.finish()
+
+    asyncio.run(scenario())
@@ -0,0 +1,26 @@
+import asyncio
+
+from services.upstream_health import UpstreamHealth
+
+
+def test_latency_and_timeout_are_tracked_per_operation():
+    upstream = UpstreamHealth("openai")
+    upstream.timeout_min_samples = 1
+    upstream.latency("stream").observe(0.5)
+    upstream.latency("json").observe(8.0)
+
+    assert upstream.timeout(operation="stream") == 1.5
+    assert upstream.timeout(operation="json") == 24.0
+    assert set(upstream.snapshot()["latency"]) == {"openai.stream", "openai.json"}
+
+
+def test_call_records_latency_under_its_operation():
+    upstream = UpstreamHealth("openai")
+
+    async def send(timeout):
+        return "ok"
+
+    asyncio.run(upstream.call(send, operation="json"))
+
+    assert upstream.latency("json").count == 1
+    assert upstream.latency("stream").count == 0
@@ -25,11 +25,14 @@ export default function FarfalleSearch() {
   const [messages, setMessages] = useState<Message[]>([]);
   const [isLoading, setIsLoading] = useState(false);
   const [streamingContent, setStreamingContent] = useState('');
+  const [streamingSourceGroups, setStreamingSourceGroups] = useState<any>(null);
   const [showHistory, setShowHistory] = useState(false);
   const [showNotionConnect, setShowNotionConnect] = useState(false);
   const [threads, setThreads] = useState<any[]>([]);
+  const [threadsCursor, setThreadsCursor] = useState<string | null>(null);
+  const [isLoadingMoreThreads, setIsLoadingMoreThreads] = useState(false);
   const messagesEndRef = useRef<HTMLDivElement>(null);
-  const wsRef = useRef<WebSocket | null>(null);
+  const streamRef = useRef<EventSource | null>(null);
 
   const searchSuggestions = [
     "what is farfalle?",
@@ -70,50 +73,88 @@ export default function FarfalleSearch() {
     setMessages(prev => [...prev, userMessage]);
     setQuery('');
 
-    try {
-      // Start search
-      const searchResponse = await api.search(queryToSearch);
-      
-      // Create assistant message placeholder
-      const assistantMessage: Message = {
-        id: searchResponse.message_id,
-        content: '',
-        role: 'assistant',
-        timestamp: new Date().toISOString(),
-        sources: searchResponse.sources,
-        sourceGroups: searchResponse.source_groups
-      };
+    // Sources and answer tokens arrive progressively over one event stream
+    const stream = api.createSearchStream(queryToSearch);
+    streamRef.current = stream;
 
-      // Set up WebSocket for streaming
-      const ws = api.createWebSocket(searchResponse.thread_id, searchResponse.message_id);
-      wsRef.current = ws;
+    let messageId = '';
+    let notionResults: any[] = [];
+    let webResults: any[] = [];
+    let sourceGroups: any = null;
+    const chunks: string[] = [];
 
-      ws.onmessage = (event) => {
-        const data = JSON.parse(event.data);
-        
-        if (data.finished) {
-          setMessages(prev => [...prev, {
-            ...assistantMessage,
-            content: data.full_content || streamingContent,
-            sourceGroups: searchResponse.source_groups
-          }]);
-          setStreamingContent('');
-          setIsLoading(false);
-          ws.close();
-        } else {
-          setStreamingContent(data.full_content || '');
-        }
-      };
+    const groupSources = () => ({
+      notion: {
+        title: '📄 Your Personal Knowledge',
+        description: 'From your Notion pages',
+        results: notionResults,
+        count: notionResults.length
+      },
+      web: {
+        title: '🌐 Web Research',
+        description: 'Personalized search results',
+        results: webResults,
+        count: webResults.length
+      }
+    });
 
-      ws.onerror = () => {
-        setIsLoading(false);
-        setStreamingContent('');
-      };
+    const finish = (content: string) => {
+      setMessages(prev => [...prev, {
+        id: messageId || Date.now().toString(),
+        content,
+        role: 'assistant',
+        timestamp: new Date().toISOString(),
+        sources: [...notionResults, ...webResults],
+        sourceGroups: sourceGroups || groupSources()
+      }]);
+      setStreamingContent('');
+      setStreamingSourceGroups(null);
+      setIsLoading(false);
+      stream.close();
+    };
 
-    } catch (error) {
-      console.error('Search failed:', error);
+    stream.addEventListener('thread', (event) => {
+      messageId = JSON.parse((event as MessageEvent).data).message_id;
+    });
+    stream.addEventListener('notion', (event) => {
+      notionResults = JSON.parse((event as MessageEvent).data).results;
+      setStreamingSourceGroups(groupSources());
+    });
+    stream.addEventListener('web', (event) => {
+      webResults = [...webResults, ...JSON.parse((event as MessageEvent).data).results];
+      setStreamingSourceGroups(groupSources());
+    });
+    stream.addEventListener('sources', (event) => {
+      const data = JSON.parse((event as MessageEvent).data);
+      notionResults = data.source_groups.notion.results;
+      webResults = data.source_groups.web.results;
+      sourceGroups = data.source_groups;
+      setStreamingSourceGroups(sourceGroups);
+    });
+    stream.addEventListener('token', (event) => {
+      chunks.push(JSON.parse((event as MessageEvent).data).delta);
+      setStreamingContent(chunks.join(''));
+    });
+    stream.addEventListener('done', (event) => {
+      const data = JSON.parse((event as MessageEvent).data);
+      const content = chunks.join('');
+      if (new TextEncoder().encode(content).length !== data.length) {
+        console.warn('Streamed response length mismatch', data.length);
+      }
+      finish(content);
+    });
+    stream.addEventListener('failed', (event) => {
+      const data = JSON.parse((event as MessageEvent).data);
+      console.error('Search failed:', data.message);
+      finish(`Error: ${data.message}`);
+    });
+    stream.onerror = () => {
+      // Connection-level failure; the browser would otherwise retry the search
+      stream.close();
       setIsLoading(false);
-    }
+      setStreamingContent('');
+      setStreamingSourceGroups(null);
+    };
   };
 
   const handleSuggestionClick = (suggestion: string) => {
@@ -124,20 +165,37 @@ export default function FarfalleSearch() {
     setMessages([]);
     setStreamingContent('');
     setQuery('');
-    if (wsRef.current) {
-      wsRef.current.close();
+    setStreamingSourceGroups(null);
+    if (streamRef.current) {
+      streamRef.current.close();
     }
   };
 
   const loadThreads = async () => {
     try {
-      const threadsData = await api.getThreads();
-      setThreads(threadsData);
+      const page = await api.getThreadSummaries();
+      setThreads(page.threads);
+      setThreadsCursor(page.nextCursor);
     } catch (error) {
       console.error('Failed to load threads:', error);
     }
   };
 
+  const loadMoreThreads = async () => {
+    if (!threadsCursor || isLoadingMoreThreads) return;
+    try {
+      setIsLoadingMoreThreads(true);
+      const page = await api.getThreadSummaries(threadsCursor);
+      // A thread updated since the first page can show up again further down
+      setThreads(prev => [...prev, ...page.threads.filter(t => !prev.some(p => p.id === t.id))]);
+      setThreadsCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Failed to load more threads:', error);
+    } finally {
+      setIsLoadingMoreThreads(false);
+    }
+  };
+
   const handleThreadSelect = async (threadId: string) => {
     try {
       const thread = await api.getThread(threadId);
@@ -208,6 +266,15 @@ export default function FarfalleSearch() {
                       </div>
                     </button>
                   ))}
+                  {threadsCursor && (
+                    <button
+                      onClick={loadMoreThreads}
+                      disabled={isLoadingMoreThreads}
+                      className="w-full p-2 text-sm text-gray-400 hover:text-white hover:bg-[#353535] rounded-lg transition-colors disabled:opacity-50"
+                    >
+                      {isLoadingMoreThreads ? 'Loading...' : 'Load older conversations'}
+                    </button>
+                  )}
                 </div>
               )}
             </div>
@@ -303,7 +370,7 @@ export default function FarfalleSearch() {
               ))}
               
               {/* Streaming Message */}
-              {streamingContent && (
+              {(streamingContent || streamingSourceGroups) && (
                 <EnhancedMessageDisplay
                   message={{
                     id: 'streaming',
@@ -311,6 +378,7 @@ export default function FarfalleSearch() {
                     role: 'assistant',
                     timestamp: new Date().toISOString()
                   }}
+                  sourceGroups={streamingSourceGroups}
                   isStreaming={true}
                 />
               )}
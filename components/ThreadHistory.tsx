@@ -1,7 +1,7 @@
 'use client';
 
 import { useState, useEffect } from 'react';
-import { Thread } from '@/lib/types';
+import { ThreadSummary } from '@/lib/types';
 import { api } from '@/lib/api';
 import { History, MessageSquare, Trash2, Plus } from 'lucide-react';
 import { cn, formatTimeAgo, truncateText } from '@/lib/utils';
@@ -19,8 +19,10 @@ export default function ThreadHistory({
   onNewThread,
   className 
 }: ThreadHistoryProps) {
-  const [threads, setThreads] = useState<Thread[]>([]);
+  const [threads, setThreads] = useState<ThreadSummary[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [isLoading, setIsLoading] = useState(true);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
   const [isCollapsed, setIsCollapsed] = useState(false);
 
   useEffect(() => {
@@ -30,8 +32,9 @@ export default function ThreadHistory({
   const loadThreads = async () => {
     try {
       setIsLoading(true);
-      const threadsData = await api.getThreads();
-      setThreads(threadsData);
+      const page = await api.getThreadSummaries();
+      setThreads(page.threads);
+      setNextCursor(page.nextCursor);
     } catch (error) {
       console.error('Failed to load threads:', error);
     } finally {
@@ -39,6 +42,21 @@ export default function ThreadHistory({
     }
   };
 
+  const loadMoreThreads = async () => {
+    if (!nextCursor || isLoadingMore) return;
+    try {
+      setIsLoadingMore(true);
+      const page = await api.getThreadSummaries(nextCursor);
+      // A thread updated since the first page can show up again further down
+      setThreads(prev => [...prev, ...page.threads.filter(t => !prev.some(p => p.id === t.id))]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Failed to load more threads:', error);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
   const handleDeleteThread = async (threadId: string, e: React.MouseEvent) => {
     e.stopPropagation();
     if (confirm('Are you sure you want to delete this conversation?')) {
@@ -54,9 +72,8 @@ export default function ThreadHistory({
     }
   };
 
-  const getLastMessage = (thread: Thread) => {
-    const lastMessage = thread.messages[thread.messages.length - 1];
-    return lastMessage?.content || thread.title;
+  const getLastMessage = (thread: ThreadSummary) => {
+    return thread.last_snippet || thread.title;
   };
 
   return (
@@ -150,6 +167,19 @@ export default function ThreadHistory({
                   </div>
                 </button>
               ))}
+              {nextCursor && (
+                <button
+                  onClick={loadMoreThreads}
+                  disabled={isLoadingMore}
+                  className={cn(
+                    "w-full p-2 rounded-xl text-sm text-forest-600",
+                    "hover:bg-forest-50 transition-colors duration-200",
+                    "disabled:opacity-50"
+                  )}
+                >
+                  {isLoadingMore ? 'Loading...' : 'Load older conversations'}
+                </button>
+              )}
             </div>
           )}
         </div>
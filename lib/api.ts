@@ -1,4 +1,4 @@
-import { Thread, SearchResponse } from './types';
+import { Thread, ThreadSummary, ThreadSummaryPage, SearchResponse } from './types';
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
@@ -32,6 +32,21 @@ export const api = {
     return response.json();
   },
 
+  async getThreadSummaries(cursor?: string | null): Promise<ThreadSummaryPage> {
+    const params = new URLSearchParams({ fields: 'summary' });
+    if (cursor) {
+      params.set('cursor', cursor);
+    }
+    const response = await fetch(`${API_BASE_URL}/threads?${params}`);
+    
+    if (!response.ok) {
+      throw new Error(`Failed to fetch threads: ${response.statusText}`);
+    }
+
+    const threads: ThreadSummary[] = await response.json();
+    return { threads, nextCursor: response.headers.get('X-Next-Cursor') };
+  },
+
   async getThread(threadId: string): Promise<Thread> {
     const response = await fetch(`${API_BASE_URL}/threads/${threadId}`);
     
@@ -52,8 +67,11 @@ export const api = {
     }
   },
 
-  createWebSocket(threadId: string, messageId: string): WebSocket {
-    const wsUrl = API_BASE_URL.replace('http', 'ws');
-    return new WebSocket(`${wsUrl}/ws/stream/${threadId}/${messageId}`);
+  createSearchStream(query: string, threadId?: string): EventSource {
+    const params = new URLSearchParams({ query });
+    if (threadId) {
+      params.set('thread_id', threadId);
+    }
+    return new EventSource(`${API_BASE_URL}/search/stream?${params}`);
   },
 };
@@ -21,6 +21,20 @@ export interface Thread {
   updated_at: string;
 }
 
+export interface ThreadSummary {
+  id: string;
+  title: string;
+  created_at: string;
+  updated_at: string;
+  message_count: number;
+  last_snippet: string;
+}
+
+export interface ThreadSummaryPage {
+  threads: ThreadSummary[];
+  nextCursor: string | null;
+}
+
 export interface StreamingResponse {
   content: string;
   finished: boolean;